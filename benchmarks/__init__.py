@@ -0,0 +1,6 @@
+# Benchmarks for the itunesbot spider
+#
+# These are plain scripts, run them from the directory holding the
+# itunesbot package, for example :
+#
+#     python -m itunesbot.benchmarks.bench_parse_v2
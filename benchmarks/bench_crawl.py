@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+
+# End to end throughput of AppSpider against the mockserver. The mock store
+# is started with the given catalogue size , latency , error rates and page
+# sizes , then the spider crawls it once per --concurrency value , each run
+# in a fresh process , in popular or alphabet wise mode and with html or
+# lookup fetching. The requests/sec , items/sec , CPU time and memory per
+# item of each run are printed , the point where more concurrency stops
+# paying off is where requests/sec flattens.
+#
+#     python -m itunesbot.benchmarks.bench_crawl [--mode alphabet|popular] [--fetch html|lookup]
+#         [--concurrency 8,16,32] [--apps N] [--latency S] [--rate-403 R] [--rate-503 R]
+#         [--legacy-share R] [--payload-kb N] [-s NAME=VALUE ...]
+
+import argparse
+import json
+import os
+import resource
+import socket
+import subprocess
+import sys
+import time
+from urllib.parse import urlparse, urlunparse
+
+LIVE_HOST = 'itunes.apple.com'
+
+
+class MockStoreMiddleware(object):
+    # Sends the requests for itunes.apple.com to the mock store at MOCK_STORE_URL ,
+    # the responses get their live url back so the callbacks see the same urls
+
+    def __init__(self, netloc):
+        self.netloc = netloc
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(urlparse(crawler.settings.get('MOCK_STORE_URL')).netloc)
+
+    def process_request(self, request, spider):
+        parts = urlparse(request.url)
+        if parts.netloc != LIVE_HOST:
+            return None
+        url = urlunparse(parts._replace(scheme='http', netloc=self.netloc))
+        return request.replace(url=url, meta=dict(request.meta, mock_live_url=request.url))
+
+    def process_response(self, request, response, spider):
+        live_url = request.meta.get('mock_live_url')
+        if live_url is None:
+            return response
+        return response.replace(url=live_url)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_mock(args, port):
+    command = [sys.executable, '-m', 'itunesbot.benchmarks.mockserver', '--port', str(port),
+               '--apps', str(args.apps), '--latency', str(args.latency), '--rate-403', str(args.rate_403),
+               '--rate-503', str(args.rate_503), '--legacy-share', str(args.legacy_share),
+               '--payload-kb', str(args.payload_kb)]
+    mock = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    # Wait for it to listen
+    for _ in range(100):
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return mock
+        except OSError:
+            time.sleep(0.1)
+    mock.kill()
+    raise SystemExit('The mock store did not start')
+
+
+def run_crawl(args):
+    """
+    One crawl in this process , the results are printed as a JSON line
+    """
+    from scrapy.crawler import CrawlerProcess
+    from scrapy.utils.project import get_project_settings
+    from itunesbot.spiders.main import AppSpider
+
+    settings = get_project_settings()
+    settings.update({'ROBOTSTXT_OBEY': False, 'HTTPCACHE_ENABLED': False, 'AUTOTHROTTLE_ENABLED': False,
+                     'DOWNLOAD_DELAY': 0, 'LOG_LEVEL': 'WARNING', 'MOCK_STORE_URL': args.mock_url,
+                     'ITUNES_LOOKUP_URL': '{}/lookup'.format(args.mock_url),
+                     'CONCURRENT_REQUESTS': args.concurrency, 'CONCURRENT_REQUESTS_PER_DOMAIN': args.concurrency},
+                    priority='cmdline')
+    middlewares = dict(settings.getdict('DOWNLOADER_MIDDLEWARES'))
+    middlewares['itunesbot.benchmarks.bench_crawl.MockStoreMiddleware'] = 50
+    settings.set('DOWNLOADER_MIDDLEWARES', middlewares, priority='cmdline')
+    settings.update(dict(option.split('=', 1) for option in args.set), priority='cmdline')
+
+    process = CrawlerProcess(settings, install_root_handler=False)
+    crawler = process.create_crawler(AppSpider)
+    start = '{}/us/genre/ios-shopping/id6024?mt=8'.format(args.mock_url)
+    process.crawl(crawler, start=start, mode=args.fetch, popular='1' if args.mode == 'popular' else None)
+    before = resource.getrusage(resource.RUSAGE_SELF)
+    process.start()
+    after = resource.getrusage(resource.RUSAGE_SELF)
+
+    stats = crawler.stats.get_stats()
+    elapsed = stats['elapsed_time_seconds']
+    items = max(1, stats.get('item_scraped_count', 0))
+    print(json.dumps({
+        'concurrency': args.concurrency,
+        'elapsed': elapsed,
+        'requests': stats.get('downloader/request_count', 0),
+        'items': stats.get('item_scraped_count', 0),
+        'errors': sum(count for key, count in stats.items()
+                      if key.startswith('downloader/response_status_count/') and not key.endswith('/200')),
+        'cpu_ms_per_item': 1000.0 * (after.ru_utime + after.ru_stime - before.ru_utime - before.ru_stime) / items,
+        # ru_maxrss is in KB on Linux
+        'kb_per_item': float(after.ru_maxrss - before.ru_maxrss) / items,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--mode', choices=('alphabet', 'popular'), default='alphabet')
+    parser.add_argument('--fetch', choices=('html', 'lookup'), default='html')
+    parser.add_argument('--concurrency', default='8,16,32')
+    parser.add_argument('--apps', type=int, default=2000, help='Catalogue size')
+    parser.add_argument('--latency', type=float, default=0.05, help='Mean delay of an answer in seconds')
+    parser.add_argument('--rate-403', type=float, default=0.0)
+    parser.add_argument('--rate-503', type=float, default=0.0)
+    parser.add_argument('--legacy-share', type=float, default=0.2)
+    parser.add_argument('--payload-kb', type=int, default=0)
+    parser.add_argument('-s', dest='set', action='append', default=[], help='Extra setting NAME=VALUE')
+    # A single crawl against a mock store that is already running , used by the runs below
+    parser.add_argument('--mock-url', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mock_url:
+        args.concurrency = int(args.concurrency)
+        run_crawl(args)
+        return
+
+    port = free_port()
+    mock = start_mock(args, port)
+    env = dict(os.environ)
+    env.setdefault('SCRAPY_SETTINGS_MODULE', 'itunesbot.settings')
+    print('{} Apps , {} mode , {} fetch , {:.0f} ms latency , {:.0%} 403 , {:.0%} 503'.format(
+        args.apps, args.mode, args.fetch, args.latency * 1000, args.rate_403, args.rate_503))
+    print('{:>11s} {:>8s} {:>9s} {:>9s} {:>7s} {:>8s} {:>11s} {:>8s}'.format(
+        'concurrency', 'seconds', 'requests', 'req/sec', 'items', 'items/s', 'cpu ms/item', 'KB/item'))
+    try:
+        for concurrency in args.concurrency.split(','):
+            command = [sys.executable, '-m', 'itunesbot.benchmarks.bench_crawl', '--mock-url',
+                       'http://127.0.0.1:{}'.format(port), '--concurrency', concurrency,
+                       '--mode', args.mode, '--fetch', args.fetch]
+            for option in args.set:
+                command += ['-s', option]
+            output = subprocess.run(command, env=env, stdout=subprocess.PIPE, check=True).stdout
+            run = json.loads(output.decode('utf-8').strip().splitlines()[-1])
+            print('{concurrency:11d} {elapsed:8.1f} {requests:9d} {0:9.1f} {items:7d} {1:8.1f} '
+                  '{cpu_ms_per_item:11.2f} {kb_per_item:8.1f}'.format(
+                      run['requests'] / run['elapsed'], run['items'] / run['elapsed'], **run))
+    finally:
+        mock.terminate()
+        mock.wait()
+
+
+if __name__ == '__main__':
+    main()
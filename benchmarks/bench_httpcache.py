@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+# Benchmark the SQLite HTTP cache storage against FilesystemCacheStorage.
+# The same detail pages are stored in both backends , then read back in
+# random order and the hit latency and disk use of each is printed.
+#
+#     python -m itunesbot.benchmarks.bench_httpcache [--pages N] [--rounds N]
+
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from scrapy.extensions.httpcache import FilesystemCacheStorage
+from scrapy.http import HtmlResponse, Request
+from scrapy.settings import Settings
+from scrapy.spiders import Spider
+from scrapy.utils.test import get_crawler
+
+from itunesbot.httpcache import SqliteCacheStorage
+from itunesbot.benchmarks.pages import render_v2_detail_page
+
+
+def build_pages(count):
+    pages = []
+    for i in range(count):
+        url, html = render_v2_detail_page(400000000 + i)
+        pages.append((url, html.encode('utf-8')))
+    return pages
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100.0))]
+
+
+def diskUsage(path):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def run(storagecls, pages, rounds, cachedir):
+    """
+    Store the pages , reopen the cache and read them back
+
+    :return: (seconds to store all pages , list of hit latencies in seconds)
+    """
+    settings = Settings({'HTTPCACHE_DIR': cachedir, 'HTTPCACHE_EXPIRATION_SECS': 0})
+    crawler = get_crawler(Spider, {'HTTPCACHE_DIR': cachedir})
+    spider = Spider.from_crawler(crawler, name='bench')
+    requests = [Request(url) for url, _ in pages]
+
+    storage = storagecls(settings)
+    storage.open_spider(spider)
+    start = time.perf_counter()
+    for request, (url, body) in zip(requests, pages):
+        response = HtmlResponse(url=url, body=body, headers={'Content-Type': 'text/html; charset=utf-8'})
+        storage.store_response(spider, request, response)
+    storage.close_spider(spider)
+    store_time = time.perf_counter() - start
+
+    storage = storagecls(settings)
+    storage.open_spider(spider)
+    latencies = []
+    order = list(requests)
+    for _ in range(rounds):
+        random.shuffle(order)
+        for request in order:
+            start = time.perf_counter()
+            response = storage.retrieve_response(spider, request)
+            latencies.append(time.perf_counter() - start)
+            if response is None:
+                raise SystemExit('Cache miss for {} with {}'.format(request.url, storagecls.__name__))
+    storage.close_spider(spider)
+    return store_time, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--pages', type=int, default=2000)
+    parser.add_argument('--rounds', type=int, default=3)
+    args = parser.parse_args()
+
+    pages = build_pages(args.pages)
+    size = sum(len(body) for _, body in pages) / len(pages)
+    print('{} pages , {:.0f} KB average'.format(len(pages), size / 1024))
+    for storagecls in (FilesystemCacheStorage, SqliteCacheStorage):
+        cachedir = tempfile.mkdtemp(prefix='bench-httpcache-')
+        try:
+            store_time, latencies = run(storagecls, pages, args.rounds, cachedir)
+            disk = diskUsage(cachedir)
+        finally:
+            shutil.rmtree(cachedir)
+        print('{:24s}: store {:8.1f} pages/sec , hit p50 {:7.1f} us , p99 {:7.1f} us , disk {:7.1f} MB'.format(
+            storagecls.__name__, len(pages) / store_time,
+            percentile(latencies, 50) * 1e6, percentile(latencies, 99) * 1e6, disk / 1048576.0))
+
+
+if __name__ == '__main__':
+    main()
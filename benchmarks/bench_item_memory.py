@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+# Benchmark the memory of AppItem against CompactAppItem. The synthetic
+# detail pages are parsed once , then the same fields are loaded into items
+# of each kind from a JSON copy , so every item holds its own strings as it
+# would coming out of the parser , and the bytes held per item are printed.
+#
+#     python -m itunesbot.benchmarks.bench_item_memory [--pages N] [--items N]
+
+import argparse
+import gc
+import json
+import tracemalloc
+
+from scrapy.http import HtmlResponse, Request
+
+from itunesbot.items import AppItem, CompactAppItem
+from itunesbot.spiders.main import AppSpider
+from itunesbot.benchmarks.pages import render_v2_detail_page
+
+
+def build_records(count):
+    spider = AppSpider()
+    records = []
+    for i in range(count):
+        url, html = render_v2_detail_page(100000000 + i)
+        item = spider.parseAppDetails_v2(HtmlResponse(url=url, body=html, encoding='utf-8', request=Request(url)))
+        records.append(json.dumps(dict(item)))
+    return records
+
+
+def measure(item_class, records, count):
+    """
+    :return: Bytes held per item , with everything the item references
+    """
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    items = [item_class(json.loads(records[i % len(records)])) for i in range(count)]
+    gc.collect()
+    held = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del items
+    return held / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--pages', type=int, default=200)
+    parser.add_argument('--items', type=int, default=5000)
+    args = parser.parse_args()
+
+    records = build_records(args.pages)
+    # Both kinds must hand the same fields to the pipelines
+    for record in records:
+        if set(AppItem(json.loads(record))) != set(CompactAppItem(json.loads(record))):
+            raise SystemExit('Field mismatch on {}'.format(json.loads(record)['app_url']))
+
+    before = measure(AppItem, records, args.items)
+    after = measure(CompactAppItem, records, args.items)
+    print('{} items from {} pages'.format(args.items, args.pages))
+    print('AppItem        : {:8.0f} bytes/item'.format(before))
+    print('CompactAppItem : {:8.0f} bytes/item'.format(after))
+    print('Saving         : {:8.1f}%'.format(100.0 * (before - after) / before))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+# Benchmark the listing page link extraction of spiders/listing.py against
+# the CSS selectors it replaced. The listing pages of the recorded corpus
+# ( see record_corpus ) go through both , their App links and pagination
+# links are checked to be identical and the time per page of each is printed.
+#
+#     python -m itunesbot.benchmarks.bench_listing [--rounds N]
+
+import argparse
+import re
+import time
+
+from scrapy.http import HtmlResponse
+
+from itunesbot.spiders import listing
+from itunesbot.benchmarks.bench_parsers import load_corpus
+from itunesbot.benchmarks.record_corpus import CORPUS_DIR
+
+LISTING_CALLBACKS = ('parseCategory', 'parseAlphabetWise', 'parseListingPage')
+#App link filter the listing callbacks applied to the CSS selector results
+pat_app_link = re.compile(r'https://itunes.apple.com/[\w][\w]/app/(.)*')
+
+
+def links_css(response, pat_app_link):
+    """
+    The CSS selector extraction the listing callbacks used , kept as the reference
+    """
+    apps = [link for link in response.css('a[href^="https://itunes.apple.com/"]::attr(href)').extract()
+            if pat_app_link.match(link)]
+    pages = response.css('#selectedgenre > ul:nth-child(2) > li > a::attr(href)').extract()
+    return apps, pages
+
+
+def links_scan(response, pat_app_link):
+    return (listing.appLinks(response.body, response.encoding),
+            listing.paginationLinks(response.body, response.encoding))
+
+
+def run(extract, bodies, pat_app_link, rounds):
+    # Fresh responses , the selector is cached per response
+    elapsed = 0.0
+    for _ in range(rounds):
+        responses = [HtmlResponse(url=url, body=body, encoding='utf-8') for url, body in bodies]
+        started = time.perf_counter()
+        for response in responses:
+            extract(response, pat_app_link)
+        elapsed += time.perf_counter() - started
+    return elapsed / (len(bodies) * rounds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--corpus', default=CORPUS_DIR)
+    parser.add_argument('--rounds', type=int, default=20)
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus)
+    bodies = [(entry['url'], body) for name in LISTING_CALLBACKS for entry, body in corpus.get(name, [])]
+    if not bodies:
+        raise SystemExit('No listing page in {}'.format(args.corpus))
+
+    links = 0
+    for url, body in bodies:
+        before = links_css(HtmlResponse(url=url, body=body, encoding='utf-8'), pat_app_link)
+        after = links_scan(HtmlResponse(url=url, body=body, encoding='utf-8'), pat_app_link)
+        if before != after:
+            raise SystemExit('Link mismatch on {}'.format(url))
+        links += len(before[0]) + len(before[1])
+
+    print('{} listing pages , {} links , {:.0f} KB average'.format(
+        len(bodies), links, sum(len(body) for _, body in bodies) / len(bodies) / 1024))
+    before = run(links_css, bodies, pat_app_link, args.rounds)
+    after = run(links_scan, bodies, pat_app_link, args.rounds)
+    print('CSS selectors : {:8.1f} us/page'.format(before * 1e6))
+    print('Byte scan     : {:8.1f} us/page'.format(after * 1e6))
+    print('Speedup       : {:8.2f}x'.format(before / after))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+# Benchmark the parse pool against parsing on the reactor thread.
+# The same synthetic detail pages are parsed inline , then through a
+# ParsePool of 1 , 2 , 4 ... workers up to the number of cores , and the
+# pages/sec of each is printed. The pool only pays off with more than one core.
+#
+#     python -m itunesbot.benchmarks.bench_parse_pool [--pages N] [--max-workers N]
+
+import argparse
+import os
+import time
+
+from scrapy.http import HtmlResponse, Request
+from twisted.internet import defer, task
+
+from itunesbot.spiders.parsepool import ParsePool
+from itunesbot.spiders.main import AppSpider
+from itunesbot.benchmarks.pages import render_v2_detail_page
+
+
+def build_responses(count):
+    responses = []
+    for i in range(count):
+        url, html = render_v2_detail_page(100000000 + i)
+        responses.append(HtmlResponse(url=url, body=html.encode('utf-8'), request=Request(url),
+                                      headers={'Content-Type': 'text/html; charset=utf-8'}))
+    return responses
+
+
+def fresh(response):
+    # The selector is cached per response , every run starts from the raw body
+    return response.replace()
+
+
+def run_inline(responses):
+    spider = AppSpider()
+    start = time.perf_counter()
+    for response in responses:
+        spider.parseAppDetails_v2(fresh(response))
+    return len(responses) / (time.perf_counter() - start)
+
+
+@defer.inlineCallbacks
+def run_pool(responses, workers):
+    pool = ParsePool(workers)
+    # Start the processes before the clock runs
+    yield defer.gatherResults([pool.extract(response) for response in responses[:workers]])
+    start = time.perf_counter()
+    yield defer.gatherResults([pool.extract(response) for response in responses])
+    elapsed = time.perf_counter() - start
+    pool.close()
+    return len(responses) / elapsed
+
+
+@defer.inlineCallbacks
+def bench(reactor, args):
+    responses = build_responses(args.pages)
+    inline = run_inline(responses)
+    print('{} pages , {} cores'.format(len(responses), os.cpu_count()))
+    print('inline        : {:8.1f} pages/sec'.format(inline))
+    workers = 1
+    while workers <= args.max_workers:
+        rate = yield run_pool(responses, workers)
+        print('{:2d} workers    : {:8.1f} pages/sec , {:5.2f}x inline'.format(workers, rate, rate / inline))
+        workers *= 2
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--pages', type=int, default=500)
+    parser.add_argument('--max-workers', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+    task.react(bench, [args])
+
+
+if __name__ == '__main__':
+    main()
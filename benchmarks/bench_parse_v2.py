@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+
+# Benchmark parseAppDetails_v2 against the BeautifulSoup implementation it
+# replaced. Both parsers run over the same synthetic pages , their output is
+# checked to be identical and the pages/sec of each is printed.
+#
+#     python -m itunesbot.benchmarks.bench_parse_v2 [--pages N] [--rounds N]
+
+import argparse
+import re
+import time
+
+from bs4 import BeautifulSoup
+from scrapy.http import HtmlResponse, Request
+
+from itunesbot.items import AppItem
+from itunesbot.spiders.main import AppSpider
+from itunesbot.benchmarks.pages import render_v2_detail_page
+
+
+def parse_v2_bs4(response):
+    """
+    The BeautifulSoup based parseAppDetails_v2 , kept as the reference for
+    the output and speed of the selector based parser
+    """
+    appitem = AppItem()
+    appitem['app_for_watch'] = False
+    appitem['app_url'] = response.url
+    extras = {}
+    if (response.status != 200):
+        appitem['app_crawl_status'] = 'fail'
+        return appitem
+
+    kvmap={'Seller':'app_seller', 'Size':'app_size', 'Category':'app_category_name', 'Price':'app_pricing', 'App Support':'app_support_site', 'Developer Website':'app_publisher_home_site', 'Privacy Policy':'app_privacy_policy', 'Copyright':'app_copyright', 'Age Rating':'app_rating', 'In-App Purchases':'inapp_info'}
+    soup = BeautifulSoup(response.text, 'lxml')
+    app_name = soup.find('h1',{'class' : 'product-header__title app-header__title'}).text
+    appitem['app_name'] = re.sub(r'[\s] +',' ',app_name).strip()
+    app_info = soup.find_all("div",{"class":"information-list__item l-row"})
+    app_related_links = soup.find("div",{"class" : 'l-column small-hide medium-show medium-9 medium-offset-3 large-10 large-offset-2'})
+    customer_ratings = soup.find("div",{"class":"we-customer-ratings__averages"})
+    try:
+        app_ratings=customer_ratings.text
+        appitem['app_content_rating']=re.sub(r'[\s] +',' ',app_ratings).strip()
+    except:
+        appitem['app_content_rating']='not sufficent ratings'
+
+    for x in app_info:
+        try:
+            key=(x.find('dt',{'class' : 'information-list__item__term medium-valign-top l-column medium-3 large-2'})).text
+            value=(x.find('dd',{'class' : 'information-list__item__definition l-column medium-9 large-6'})).text
+            if key in kvmap:
+                appitem[re.sub(r'[\s] +',' ',kvmap[key]).strip()]=re.sub(r'[\s] +',' ',value).strip()
+            else:
+                stdkey = key.replace(' ','_').lower()
+                extras[stdkey] = value
+        except:
+            value='nil'
+    for link in app_related_links.find_all('a', href=True):
+        if link.text in kvmap:
+            appitem[kvmap[link.text]]=re.sub(r'[\s] +',' ',link['href']).strip()
+        else:
+            stdkey = link.text.replace(' ','_').lower()
+            extras[stdkey] = re.sub(r'[\s] +',' ',link['href']).strip()
+    appitem['app_extras'] = extras
+
+    temp=[]
+    supports = soup.find_all('div',attrs={"class":"supports-list__item__copy"})
+    for x in supports:
+        y = x.find('h3').text
+        temp.append(y.strip())
+    appitem['app_supports'] = temp
+
+    description = soup.find("div",{"class" : 'section__description'})
+    appitem['app_version_remarks']=description.find('p').get_text()
+
+    d={}
+    c={}
+    temp2=soup.find_all("section",{"class":'l-content-width section section--bordered'})
+    for h2tags in temp2:
+        temp=h2tags.find_all("h2",{"class":'section__headline'})
+        for x in temp:
+            names = x.get_text().strip()
+            if names == 'More By This Developer':
+                app_links=h2tags.find_all("a",{"class" : 'targeted-link'})
+                for z in app_links:
+                    app_href=(z.attrs['href'])
+                    app_names=z.find("div",{"class" : 'we-truncate we-truncate--single-line ember-view targeted-link__target'})
+                    app_name=(app_names.get_text())
+                    d[re.sub(r'[\s] +',' ',app_name).strip()]=re.sub(r'[\s] +',' ',app_href).strip()
+                    appitem['more_apps_by_developer']=d
+            elif names == 'You May Also Like':
+                app_links=h2tags.find_all("a",{"class" : 'targeted-link'})
+                for z in app_links:
+                    app_href=(z.attrs['href'])
+                    app_names=z.find("div",{"class" : 'we-truncate we-truncate--single-line ember-view targeted-link__target'})
+                    app_name=(app_names.get_text())
+                    c[re.sub(r'[\s] +',' ',app_name).strip()]=re.sub(r'[\s] +',' ',app_href).strip()
+                    appitem['similar_apps']=c
+    return appitem
+
+
+def build_pages(count):
+    return [render_v2_detail_page(100000000 + i) for i in range(count)]
+
+
+def run(parse, pages, rounds):
+    """
+    Time the parser over fresh responses , the response selector is cached
+    per response so every round has to start from the raw body
+
+    :return: pages per second
+    """
+    elapsed = 0.0
+    for _ in range(rounds):
+        responses = [HtmlResponse(url=url, body=html, encoding='utf-8', request=Request(url)) for url, html in pages]
+        started = time.perf_counter()
+        for response in responses:
+            parse(response)
+        elapsed += time.perf_counter() - started
+    return (len(pages) * rounds) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--pages', type=int, default=200)
+    parser.add_argument('--rounds', type=int, default=3)
+    args = parser.parse_args()
+
+    spider = AppSpider()
+    pages = build_pages(args.pages)
+
+    # Both parsers must agree on every field the BeautifulSoup parser fills before
+    # their speed is compared
+    for url, html in pages:
+        before = parse_v2_bs4(HtmlResponse(url=url, body=html, encoding='utf-8', request=Request(url)))
+        after = spider.parseAppDetails_v2(HtmlResponse(url=url, body=html, encoding='utf-8', request=Request(url)))
+        for key, value in before.items():
+            if after.get(key) != value:
+                raise SystemExit('Output mismatch for {} on {}'.format(url, key))
+
+    size = sum(len(html) for _, html in pages) / len(pages)
+    print('{} pages , {:.0f} KB average'.format(len(pages), size / 1024))
+    before = run(parse_v2_bs4, pages, args.rounds)
+    after = run(spider.parseAppDetails_v2, pages, args.rounds)
+    print('BeautifulSoup : {:8.1f} pages/sec'.format(before))
+    print('Selector      : {:8.1f} pages/sec'.format(after))
+    print('Speedup       : {:8.2f}x'.format(after / before))
+
+
+if __name__ == '__main__':
+    main()
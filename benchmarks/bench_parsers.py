@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+
+# Benchmark the spider callbacks on the recorded page corpus ( see
+# record_corpus ). Every page is wrapped in an HtmlResponse and run through
+# the callback named in the manifest , and for each callback the pages/sec ,
+# the p50 / p99 latency of one page and the peak memory of a pass over its
+# pages are printed. --save keeps the results as a baseline and --compare
+# flags the callbacks that got slower or bigger than the baseline by more
+# than --tolerance , with exit status 1.
+#
+#     python -m itunesbot.benchmarks.bench_parsers [--rounds N] [--save FILE] [--compare FILE]
+
+import argparse
+import gc
+import gzip
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+from scrapy.http import HtmlResponse, Request
+from scrapy.utils.spider import iterate_spider_output
+
+from itunesbot.spiders.main import AppSpider
+from itunesbot.benchmarks.record_corpus import CORPUS_DIR
+
+#Metrics compared with the baseline , True when higher is better
+METRICS = (('pages_per_sec', True), ('p50_ms', False), ('p99_ms', False), ('peak_kb', False))
+
+
+def load_corpus(path):
+    """
+    :return: {callback name : list of (manifest entry , body)}
+    """
+    with open(os.path.join(path, 'manifest.json')) as f:
+        entries = json.load(f)
+    pages = {}
+    for entry in entries:
+        with gzip.open(os.path.join(path, entry['file']), 'rb') as f:
+            pages.setdefault(entry['callback'], []).append((entry, f.read()))
+    return pages
+
+
+def responses(pages):
+    # Fresh responses , the selector is cached per response
+    return [HtmlResponse(url=entry['url'], body=body, status=entry['status'], encoding='utf-8',
+                         request=Request(entry['url'], meta=dict(entry['meta'])))
+            for entry, body in pages]
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100.0 * (len(values) - 1))))]
+
+
+def run(callback, pages, rounds):
+    # A pass to warm up the caches , not timed
+    for response in responses(pages):
+        list(iterate_spider_output(callback(response)))
+    latencies = []
+    for _ in range(rounds):
+        batch = responses(pages)
+        # Collections would land on whichever page happens to be running
+        gc.collect()
+        gc.disable()
+        for response in batch:
+            started = time.perf_counter()
+            # The listing callbacks are generators , they only run when consumed
+            list(iterate_spider_output(callback(response)))
+            latencies.append(time.perf_counter() - started)
+        gc.enable()
+
+    batch = responses(pages)
+    tracemalloc.start()
+    for response in batch:
+        list(iterate_spider_output(callback(response)))
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {'pages': len(pages), 'pages_per_sec': round(len(latencies) / sum(latencies), 1),
+            'p50_ms': round(percentile(latencies, 50) * 1000, 3), 'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+            'peak_kb': round(peak / 1024.0, 1)}
+
+
+def compare(results, baseline, tolerance):
+    """
+    :return: List of (callback , metric , baseline value , value) that are worse than the baseline
+    """
+    regressions = []
+    for name, result in sorted(results.items()):
+        if name not in baseline:
+            continue
+        for metric, higher_is_better in METRICS:
+            before, after = baseline[name][metric], result[metric]
+            if higher_is_better:
+                worse = after < before * (1 - tolerance)
+            else:
+                worse = after > before * (1 + tolerance)
+            if worse:
+                regressions.append((name, metric, before, after))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--corpus', default=CORPUS_DIR)
+    parser.add_argument('--rounds', type=int, default=20)
+    parser.add_argument('--save', help='Write the results to this baseline file')
+    parser.add_argument('--compare', help='Baseline file to check the results against')
+    parser.add_argument('--tolerance', type=float, default=0.15, help='Allowed change before a regression')
+    args = parser.parse_args()
+
+    spider = AppSpider()
+    corpus = load_corpus(args.corpus)
+    results = {}
+    print('{:20s} {:>6s} {:>10s} {:>9s} {:>9s} {:>10s}'.format('callback', 'pages', 'pages/sec', 'p50 ms',
+                                                                'p99 ms', 'peak KB'))
+    for name in sorted(corpus):
+        result = results[name] = run(getattr(spider, name), corpus[name], args.rounds)
+        print('{:20s} {pages:6d} {pages_per_sec:10.1f} {p50_ms:9.3f} {p99_ms:9.3f} {peak_kb:10.1f}'.format(
+            name, **result))
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for name, metric, before, after in regressions:
+            print('REGRESSION {} {} : {} -> {}'.format(name, metric, before, after))
+        if regressions:
+            sys.exit(1)
+        print('No regression against {}'.format(args.compare))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+
+# Local stand-in for the App Store , so the spider can be run offline
+#
+# Serves a generated catalogue of Apps as
+#   /<geo>/genre/<slug>/id<genre>?mt=8                    genre page with the popular Apps
+#   /<geo>/genre/<slug>/id<genre>?mt=8&letter=X&page=N    alphabet wise listing pages
+#   /<geo>/app/<slug>/id<app>?mt=8                        App Detail Pages , new or old layout
+#   /lookup?id=1,2,3&country=<geo>                        iTunes Lookup API
+#
+# The App links on the listing pages point at itunes.apple.com like the live
+# site , pagination links point back at this server. The detail pages are
+# served under their own path , bench_crawl sends the itunes.apple.com
+# requests here. --latency delays every answer , --rate-403 and --rate-503
+# answer that share of the requests with an error , --legacy-share of the
+# Apps get the old layout and --payload-kb pads the detail pages up to that
+# size. Run it with
+#
+#     python -m itunesbot.benchmarks.mockserver --port 8000 --apps 5000
+#
+# and point the spider at it
+#
+#     scrapy crawl argos_itunes -a mode=lookup \
+#         -a start='http://localhost:8000/us/genre/ios-shopping/id6024?mt=8' \
+#         -s ITUNES_LOOKUP_URL=http://localhost:8000/lookup -s ROBOTSTXT_OBEY=0
+
+import argparse
+import json
+import random
+
+from twisted.internet import reactor
+from twisted.web import resource, server
+
+from itunesbot.benchmarks.pages import LOREM, render_legacy_detail_page, render_v2_detail_page
+
+LETTERS = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ*'
+
+
+class Catalogue(object):
+    """
+    Deterministic set of Apps , the same size and seed always give the same Apps
+
+    :param size: Number of Apps
+    :param seed: Seed for the names and the App records
+    :param page_size: Apps per listing page
+    :param popular: Apps on the genre page
+    """
+
+    def __init__(self, size=5000, seed=0, page_size=100, popular=200):
+        rnd = random.Random(seed)
+        self.page_size = page_size
+        self.apps = []
+        self.by_id = {}
+        self.by_letter = dict((letter, []) for letter in LETTERS)
+        for i in range(size):
+            name = ' '.join(rnd.choice(LOREM) for _ in range(rnd.randint(1, 3))).title()
+            if rnd.random() < 0.1:
+                name = '{} {}'.format(rnd.randint(1, 99), name)
+            app = {'id': str(300000000 + i * 7919 % 900000000), 'name': name, 'seed': rnd.randint(0, 1 << 30)}
+            letter = name[0].upper() if name[0].isalpha() else '*'
+            self.apps.append(app)
+            self.by_id[app['id']] = app
+            self.by_letter[letter].append(app)
+        self.popular = self.apps[:popular]
+
+    def pages(self, letter):
+        count = len(self.by_letter.get(letter, []))
+        return max(1, (count + self.page_size - 1) // self.page_size)
+
+    def listing(self, letter, page):
+        start = (page - 1) * self.page_size
+        return self.by_letter.get(letter, [])[start:start + self.page_size]
+
+
+def appUrl(app, geo):
+    return 'https://itunes.apple.com/{}/app/{}/id{}?mt=8'.format(geo, app['name'].lower().replace(' ', '-'), app['id'])
+
+
+def lookupResult(app, geo):
+    """
+    Lookup API record for an App , with the fields the real endpoint returns
+    """
+    rnd = random.Random(app['seed'])
+    price = rnd.choice([0.0, 0.0, 0.0, 0.99, 4.99])
+    version = '{}.{}.{}'.format(rnd.randint(1, 9), rnd.randint(0, 20), rnd.randint(0, 9))
+    return {
+        'wrapperType': 'software', 'kind': 'software', 'trackId': int(app['id']), 'trackName': app['name'],
+        'trackViewUrl': appUrl(app, geo), 'bundleId': 'com.example.{}'.format(app['id']),
+        'artistId': rnd.randint(100000, 999999), 'artistName': '{} Inc.'.format(rnd.choice(LOREM).title()),
+        'artistViewUrl': 'https://itunes.apple.com/{}/developer/id{}'.format(geo, rnd.randint(100000, 999999)),
+        'sellerName': '{} Inc.'.format(rnd.choice(LOREM).title()),
+        'sellerUrl': 'https://www.example.com/{}'.format(app['id']),
+        'price': price, 'formattedPrice': 'Free' if not price else '${}'.format(price), 'currency': 'USD',
+        'version': version, 'fileSizeBytes': str(rnd.randint(1 << 20, 1 << 30)),
+        'primaryGenreName': 'Shopping', 'primaryGenreId': 6024, 'genreIds': ['6024', '6012'],
+        'releaseDate': '2016-0{}-1{}T07:00:00Z'.format(rnd.randint(1, 9), rnd.randint(0, 9)),
+        'currentVersionReleaseDate': '2017-0{}-1{}T07:00:00Z'.format(rnd.randint(1, 9), rnd.randint(0, 9)),
+        'languageCodesISO2A': ['EN', 'FR', 'DE'][:rnd.randint(1, 3)],
+        'trackContentRating': rnd.choice(['4+', '9+', '12+', '17+']), 'contentAdvisoryRating': '4+',
+        'advisories': [], 'minimumOsVersion': '{}.0'.format(rnd.randint(8, 11)),
+        'supportedDevices': ['iPhone6-iPhone6', 'iPadAir-iPadAir'] + (['Watch4-Watch4'] if rnd.random() < 0.2 else []),
+        'averageUserRating': rnd.randint(10, 50) / 10.0, 'userRatingCount': rnd.randint(0, 90000),
+        'averageUserRatingForCurrentVersion': rnd.randint(10, 50) / 10.0,
+        'userRatingCountForCurrentVersion': rnd.randint(0, 900),
+        'description': ' '.join(rnd.choice(LOREM) for _ in range(60)),
+        'releaseNotes': ' '.join(rnd.choice(LOREM) for _ in range(15)),
+    }
+
+
+class MockStore(resource.Resource):
+    """
+    :param catalogue: Apps served
+    :param latency: Mean delay of an answer in seconds , each one is 0.5 to 1.5 times that
+    :param rate_403: Share of the requests answered with a 403
+    :param rate_503: Share of the requests answered with a 503 and a Retry-After
+    :param legacy_share: Share of the Apps whose detail page has the old layout
+    :param payload_kb: Smallest size of a detail page , padded with a comment
+    """
+    isLeaf = True
+
+    def __init__(self, catalogue, latency=0.0, rate_403=0.0, rate_503=0.0, legacy_share=0.0, payload_kb=0,
+                 seed=0):
+        resource.Resource.__init__(self)
+        self.catalogue = catalogue
+        self.latency = latency
+        self.rate_403 = rate_403
+        self.rate_503 = rate_503
+        self.legacy_share = legacy_share
+        self.payload_kb = payload_kb
+        self.rnd = random.Random(seed)
+
+    def render_GET(self, request):
+        if not self.latency:
+            return self.answer(request)
+        call = reactor.callLater(self.latency * self.rnd.uniform(0.5, 1.5), self.finish, request)
+        # The client gave up , nothing to answer
+        request.notifyFinish().addErrback(lambda failure: call.cancel() if call.active() else None)
+        return server.NOT_DONE_YET
+
+    def finish(self, request):
+        request.write(self.answer(request))
+        request.finish()
+
+    def answer(self, request):
+        path = request.path.decode('utf-8')
+        args = dict((k.decode('utf-8'), v[0].decode('utf-8')) for k, v in request.args.items())
+        segments = path.split('/')
+        draw = self.rnd.random()
+        if draw < self.rate_403:
+            request.setResponseCode(403)
+            return b'Forbidden'
+        if draw < self.rate_403 + self.rate_503:
+            request.setResponseCode(503)
+            request.setHeader(b'Retry-After', b'1')
+            return b'Service Unavailable'
+        if path == '/lookup':
+            return self.renderLookup(request, args)
+        if len(segments) > 2 and segments[2] == 'genre':
+            return self.renderGenre(request, segments[1], args)
+        if len(segments) > 3 and segments[2] == 'app':
+            return self.renderApp(request, segments[1], segments[-1])
+        request.setResponseCode(404)
+        return b'Not Found'
+
+    def renderApp(self, request, geo, last_segment):
+        app_id = last_segment[2:] if last_segment.startswith('id') else ''
+        app = self.catalogue.by_id.get(app_id)
+        if app is None:
+            request.setResponseCode(404)
+            return b'Not Found'
+        # The same App always gets the same layout
+        if random.Random(app['seed']).random() < self.legacy_share:
+            html = render_legacy_detail_page(int(app_id), geo=geo, seed=app['seed'])[1]
+        else:
+            html = render_v2_detail_page(int(app_id), geo=geo, seed=app['seed'])[1]
+        body = html.encode('utf-8')
+        padding = self.payload_kb * 1024 - len(body)
+        if padding > 0:
+            body += b'<!-- ' + b'x' * padding + b' -->'
+        request.setHeader(b'Content-Type', b'text/html; charset=utf-8')
+        return body
+
+    def renderLookup(self, request, args):
+        geo = args.get('country', 'us')
+        results = [lookupResult(self.catalogue.by_id[app_id], geo)
+                   for app_id in args.get('id', '').split(',') if app_id in self.catalogue.by_id]
+        request.setHeader(b'Content-Type', b'text/javascript; charset=utf-8')
+        return json.dumps({'resultCount': len(results), 'results': results}).encode('utf-8')
+
+    def renderGenre(self, request, geo, args):
+        host = request.getHeader(b'host').decode('utf-8')
+        base = 'http://{}{}?mt=8'.format(host, request.path.decode('utf-8'))
+        letter = args.get('letter')
+        if letter is None:
+            apps, pages = self.catalogue.popular, 0
+        else:
+            page = int(args.get('page', 1))
+            apps, pages = self.catalogue.listing(letter, page), self.catalogue.pages(letter)
+        alpha = ''.join('<li><a href="{}&amp;letter={}">{}</a></li>'.format(base, l, l) for l in LETTERS)
+        paginate = ''.join('<li><a href="{}&amp;letter={}&amp;page={}#page">{}</a></li>'.format(
+            base, letter, n, n) for n in range(1, pages + 1))
+        links = ''.join('<li><a href="{}">{}</a></li>\n'.format(appUrl(app, geo), app['name']) for app in apps)
+        html = ('<!DOCTYPE html><html lang="en"><head><title>Shopping Apps</title></head><body>'
+                '<div id="genre-nav" class="main nav"><ul class="list top-level-genres">'
+                '<li><a href="https://itunes.apple.com/{0}/genre/ios-books/id6018?mt=8">Books</a></li></ul></div>'
+                '<div id="selectedgenre"><ul class="list alpha">{1}</ul><ul class="list paginate">{2}</ul>'
+                '<div id="selectedcontent"><div class="column first"><ul>{3}</ul></div></div></div>'
+                '</body></html>').format(geo, alpha, paginate, links)
+        request.setHeader(b'Content-Type', b'text/html; charset=utf-8')
+        return html.encode('utf-8')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in for the App Store')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--apps', type=int, default=5000, help='Catalogue size')
+    parser.add_argument('--page-size', type=int, default=100, help='Apps per listing page')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--latency', type=float, default=0.0, help='Mean delay of an answer in seconds')
+    parser.add_argument('--rate-403', type=float, default=0.0, help='Share of the requests answered with a 403')
+    parser.add_argument('--rate-503', type=float, default=0.0, help='Share of the requests answered with a 503')
+    parser.add_argument('--legacy-share', type=float, default=0.0, help='Share of the Apps in the old layout')
+    parser.add_argument('--payload-kb', type=int, default=0, help='Smallest size of a detail page in KB')
+    args = parser.parse_args()
+
+    catalogue = Catalogue(args.apps, args.seed, args.page_size)
+    store = MockStore(catalogue, latency=args.latency, rate_403=args.rate_403, rate_503=args.rate_503,
+                      legacy_share=args.legacy_share, payload_kb=args.payload_kb, seed=args.seed)
+    reactor.listenTCP(args.port, server.Site(store), interface='127.0.0.1')
+    print('Mock App Store with {} Apps on http://127.0.0.1:{}/'.format(args.apps, args.port))
+    reactor.run()
+
+
+if __name__ == '__main__':
+    main()
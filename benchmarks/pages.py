@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+
+# Synthetic App Store pages used by the benchmarks.
+# The markup mirrors the class names the spider parsers look for so the
+# pages exercise the same code paths as the live site.
+
+import json
+import random
+
+LOREM = ('Lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor '
+         'incididunt ut labore et dolore magna aliqua Ut enim ad minim veniam quis '
+         'nostrud exercitation ullamco laboris nisi ut aliquip ex ea commodo consequat').split()
+
+RELATED_TITLE_CLASS = 'we-truncate we-truncate--single-line ember-view targeted-link__target'
+
+
+def words(rnd, count):
+    return ' '.join(rnd.choice(LOREM) for _ in range(count))
+
+
+def _info_row(term, definition):
+    return ('<div class="information-list__item l-row">\n'
+            '  <dt class="information-list__item__term medium-valign-top l-column medium-3 large-2">{}</dt>\n'
+            '  <dd class="information-list__item__definition l-column medium-9 large-6">\n'
+            '      {}\n'
+            '  </dd>\n'
+            '</div>\n').format(term, definition)
+
+
+def _related_section(rnd, headline, geo, count):
+    lockups = []
+    for _ in range(count):
+        app_id = rnd.randint(100000000, 1999999999)
+        lockups.append(
+            '<div class="l-column small-2 medium-3 large-2 small-valign-top">\n'
+            '  <a href="https://itunes.apple.com/{geo}/app/{slug}/id{id}?mt=8" class="we-lockup targeted-link">\n'
+            '    <div class="we-lockup__overlay"><picture class="we-artwork"><img src="/img/{id}.png"></picture></div>\n'
+            '    <div class="we-lockup__title ">\n'
+            '      <div class="{cls}">  {name}  </div>\n'
+            '    </div>\n'
+            '    <div class="we-lockup__subtitle">{genre}</div>\n'
+            '  </a>\n'
+            '</div>\n'.format(geo=geo, slug=words(rnd, 2).replace(' ', '-'), id=app_id,
+                              cls=RELATED_TITLE_CLASS, name=words(rnd, 3).title(),
+                              genre=words(rnd, 1).title()))
+    return ('<section class="l-content-width section section--bordered">\n'
+            '  <h2 class="section__headline">\n      {}\n  </h2>\n'
+            '  <div class="l-row l-row--peek">\n{}  </div>\n'
+            '</section>\n').format(headline, ''.join(lockups))
+
+
+def render_v2_detail_page(app_id, geo='us', seed=None):
+    """
+    Render a detail page in the new (product-header) layout
+
+    :param app_id: Numeric App Id used in the page links
+    :param geo: Storefront code used in the page links
+    :param seed: Seed for the random filler , defaults to the app id
+    :return: (url, html) tuple
+    """
+    rnd = random.Random(app_id if seed is None else seed)
+    name = words(rnd, 3).title()
+    url = 'https://itunes.apple.com/{}/app/{}/id{}?mt=8'.format(geo, name.lower().replace(' ', '-'), app_id)
+    seller = '{} Inc.'.format(words(rnd, 2).title())
+    price = rnd.choice(['Free', '$0.99', '$4.99'])
+    info = [
+        ('Seller', '\n      {}\n'.format(seller)),
+        ('Size', '{}.{} MB'.format(rnd.randint(1, 900), rnd.randint(0, 9))),
+        ('Category', '<a href="https://itunes.apple.com/{}/genre/ios-shopping/id6024?mt=8">  Shopping </a>'.format(geo)),
+        ('Compatibility', '<p>Requires iOS {}.0 or later. Compatible with iPhone, iPad, and iPod touch.</p>'.format(rnd.randint(8, 11))),
+        ('Languages', '<p>English,  French,   German</p>'),
+        ('Age Rating', 'Rated {}+'.format(rnd.choice([4, 9, 12, 17]))),
+        ('Copyright', '&#169; 2017 {}'.format(words(rnd, 2).title())),
+        ('Price', price),
+        ('In-App Purchases', '<ol>{}</ol>'.format(''.join(
+            '<li><span>{}</span>   <span>${}.99</span></li>'.format(words(rnd, 2), rnd.randint(0, 49))
+            for _ in range(rnd.randint(0, 8))))),
+    ]
+    links = [('Developer Website', 'https://www.example.com/{}'.format(app_id)),
+             ('App Support', 'https://support.example.com/{}'.format(app_id)),
+             ('Privacy Policy', 'https://www.example.com/{}/privacy'.format(app_id))]
+    version = '{}.{}.{}'.format(rnd.randint(1, 9), rnd.randint(0, 20), rnd.randint(0, 9))
+    updated = '2017-{:02d}-{:02d}'.format(rnd.randint(1, 12), rnd.randint(1, 28))
+    supports = ''.join(
+        '<li class="supports-list__item"><div class="supports-list__item__copy">'
+        '<h3 class="supports-list__item__copy__heading">  {}  </h3>'
+        '<p>{}</p></div></li>'.format(words(rnd, 2).title(), words(rnd, 12)) for _ in range(rnd.randint(1, 3)))
+    ratings = ''
+    record = {'@context': 'http://schema.org', '@type': 'SoftwareApplication', 'name': name,
+              'description': words(rnd, 60), 'operatingSystem': 'Requires iOS 10.0 or later.',
+              'applicationCategory': 'Shopping', 'datePublished': 'Jan 5, 2017',
+              'author': {'@type': 'Person', 'name': seller},
+              'offers': {'@type': 'Offer', 'category': 'free' if price == 'Free' else 'paid',
+                         'price': 0 if price == 'Free' else float(price[1:]), 'priceCurrency': 'USD'}}
+    if rnd.random() < 0.8:
+        rating, count = '{}.{}'.format(rnd.randint(1, 4), rnd.randint(0, 9)), rnd.randint(1, 90000)
+        ratings = ('<div class="we-customer-ratings__averages">\n'
+                   '  <span class="we-customer-ratings__averages__display">{}</span>\n'
+                   '  out of 5\n</div>\n'
+                   '<div class="we-customer-ratings__count small-hide medium-show">{} Ratings</div>\n'
+                   ).format(rating, count)
+        record['aggregateRating'] = {'@type': 'AggregateRating', 'ratingValue': float(rating), 'reviewCount': count}
+    jsonld = ''
+    if rnd.random() < 0.9:
+        jsonld = '<script name="schema:software-application" type="application/ld+json">{}</script>'.format(
+            json.dumps(record))
+    reviews = ''.join(
+        '<div class="we-customer-review lockup"><h3 class="we-customer-review__title">{}</h3>'
+        '<blockquote class="we-clamp"><p>{}</p></blockquote></div>\n'.format(words(rnd, 4), words(rnd, 40))
+        for _ in range(rnd.randint(2, 6)))
+    # Boilerplate navigation and script blobs the live pages are padded with
+    boilerplate = ''.join(
+        '<li class="ac-gn-item"><a class="ac-gn-link" href="https://www.apple.com/{0}/">{0}</a></li>\n'.format(w)
+        for w in LOREM) * 6
+    html = '''<!DOCTYPE html>
+<html lang="en-us" dir="ltr">
+<head>
+<meta charset="utf-8">
+<title>{name} on the App Store</title>
+{jsonld}
+<script>window.appConfig = {{"env": "prod", "locale": "en-us", "flags": [{flags}]}};</script>
+<link rel="stylesheet" href="/assets/web-experience-app.css">
+</head>
+<body class="no-js no-touch">
+<nav id="ac-globalnav"><ul class="ac-gn-list">
+{boilerplate}</ul></nav>
+<main class="selfclear is-apps-theme">
+<div class="animation-wrapper is-visible">
+<section class="l-content-width section section--hero product-hero">
+  <header class="product-header app-header product-header--padded-start">
+    <h1 class="product-header__title app-header__title">
+        {name}
+        <span class="badge badge--product-title">{rated}</span>
+    </h1>
+    <h2 class="product-header__identity app-header__identity">
+      <a class="link" href="https://itunes.apple.com/{geo}/developer/id{dev}">{seller}</a>
+    </h2>
+  </header>
+</section>
+<section class="l-content-width section section--bordered">
+  <div class="section__description">
+    <h2 class="section__headline">Description</h2>
+    <p>{description}</p>
+  </div>
+</section>
+<section class="l-content-width section section--bordered">
+  <h2 class="section__headline">Ratings and Reviews</h2>
+  {ratings}
+  <div class="l-row">{reviews}</div>
+</section>
+<section class="l-content-width section section--bordered whats-new">
+  <h2 class="section__headline">What's New</h2>
+  <div class="l-row whats-new__content"><div class="whats-new__latest"><div class="l-row">
+    <time data-test-we-datetime datetime="{updated}T00:00:00.000Z" aria-label="{updated}">{updated}</time>
+    <p class="l-column small-6 medium-12 whats-new__latest__version">Version {version}</p>
+  </div></div><p>{notes}</p></div>
+</section>
+<section class="l-content-width section section--bordered">
+  <h2 class="section__headline">Supports</h2>
+  <ul class="supports-list">{supports}</ul>
+</section>
+<section class="l-content-width section section--bordered section--information">
+  <h2 class="section__headline">Information</h2>
+  <dl class="information-list information-list--app medium-columns l-row">
+{info}  </dl>
+  <div class="l-row">
+    <div class="l-column small-hide medium-show medium-9 medium-offset-3 large-10 large-offset-2">
+      <ul class="inline-list inline-list--app-extensions">
+{links}      </ul>
+    </div>
+  </div>
+</section>
+{more_by}{also_like}</div>
+</main>
+<footer><script>{footer_js}</script></footer>
+</body>
+</html>
+'''.format(name=name, rated=rnd.choice(['4+', '9+', '12+', '17+']), geo=geo,
+           dev=rnd.randint(100000, 999999), seller=seller, jsonld=jsonld,
+           version=version, updated=updated, notes=words(rnd, 20),
+           description=words(rnd, 120), ratings=ratings, reviews=reviews, supports=supports,
+           info=''.join(_info_row(k, v) for k, v in info),
+           links=''.join('<li class="inline-list__item"><a class="link icon icon-after icon-external" '
+                         'href="{}">{}</a></li>\n'.format(h, t) for t, h in links),
+           more_by=_related_section(rnd, 'More By This Developer', geo, rnd.randint(1, 8)),
+           also_like=_related_section(rnd, 'You May Also Like', geo, 12),
+           flags=', '.join('"{}"'.format(w) for w in LOREM * 4),
+           footer_js='var x = {};'.format(words(rnd, 400)),
+           boilerplate=boilerplate)
+    return url, html
+
+
+def render_legacy_detail_page(app_id, geo='us', seed=None):
+    """
+    Render a detail page in the old (#left-stack) layout
+
+    :param app_id: Numeric App Id used in the page links
+    :param geo: Storefront code used in the page links
+    :param seed: Seed for the random filler , defaults to the app id
+    :return: (url, html) tuple
+    """
+    rnd = random.Random(app_id if seed is None else seed)
+    name = words(rnd, 3).title()
+    url = 'https://itunes.apple.com/{}/app/{}/id{}?mt=8'.format(geo, name.lower().replace(' ', '-'), app_id)
+    price = rnd.choice(['Free', '$0.99', '$4.99'])
+    rows = [
+        '<li><span itemprop="offers" itemscope itemtype="http://schema.org/Offer">'
+        '<div class="price">{}</div></span></li>'.format(price),
+        '<li class="genre"><span class="label">Category: </span>'
+        '<a href="https://itunes.apple.com/{}/genre/ios-shopping/id6024?mt=8">'
+        '<span itemprop="applicationCategory">Shopping</span></a></li>'.format(geo),
+        '<li class="release-date"><span class="label">Updated: </span>'
+        '<span itemprop="datePublished" content="2017-0{0}-1{0}">Jan 1{0}, 2017</span></li>'.format(rnd.randint(1, 9)),
+        '<li><span class="label">Version: </span><span itemprop="softwareVersion">{}.{}.{}</span></li>'.format(
+            rnd.randint(1, 9), rnd.randint(0, 9), rnd.randint(0, 9)),
+        '<li><span class="label">Size: </span>{}.{} MB</li>'.format(rnd.randint(1, 900), rnd.randint(0, 9)),
+        '<li class="language"><span class="label">Languages: </span>English, French</li>',
+        '<li><span class="label">Seller: </span><span itemprop="author" itemscope itemtype="http://schema.org/Organization">'
+        '<span itemprop="name">{} Inc.</span></span></li>'.format(words(rnd, 2).title()),
+    ]
+    if rnd.random() < 0.3:
+        rows.append('<li><span class="label">Apple Watch: </span>Yes</li>')
+    reasons = ''.join('<li>  {}  </li>'.format(words(rnd, 3)) for _ in range(rnd.randint(0, 3)))
+    inapp = ''
+    if rnd.random() < 0.5:
+        inapp = ('<div class="extra-list in-app-purchases"><h4>Top In-App Purchases</h4><ol>{}</ol></div>'.format(
+            ''.join('<li><span class="in-app-title">{}</span><span class="in-app-price">${}.99</span></li>'.format(
+                words(rnd, 2), rnd.randint(0, 49)) for _ in range(rnd.randint(1, 10)))))
+    also_bought = ''.join(
+        '<div class="lockup small application" aria-label="{name}">'
+        '<a href="https://itunes.apple.com/{geo}/app/x/id{id}?mt=8 ">{name}</a></div>'.format(
+            geo=geo, id=rnd.randint(100000000, 1999999999), name=words(rnd, 2)) for _ in range(8))
+    reviews = ''.join(
+        '<div class="customer-review"><h5><span class="customerReviewTitle">{}</span>'
+        '<div class="rating" aria-label="{} stars\n\t"></div></h5>'
+        '<p class="content">\n\t{}\n</p></div>'.format(words(rnd, 3), rnd.randint(1, 5), words(rnd, 30))
+        for _ in range(rnd.randint(0, 5)))
+    html = '''<!DOCTYPE html>
+<html lang="en">
+<head><title>{name} on the App Store</title>
+<script>var its = {{"flags": [{flags}]}};</script>
+</head>
+<body>
+<div id="globalheader"><ul>{boilerplate}</ul></div>
+<div id="title" class="intro">
+  <div class="left"><h1>{name}</h1><h2>By {seller}</h2></div>
+  <div class="right"><a href="https://itunes.apple.com/{geo}/developer/id{dev}">View More By This Developer</a></div>
+</div>
+<div id="content">
+<div class="padder">
+<div id="left-stack">
+  <div class="lockup product application">
+    <ul class="list">{rows}</ul>
+    <div class="app-rating"><a href="https://itunes.apple.com/WebObjects/MZStore.woa/wa/appRatings">Rated {rated}+</a><ul class="list app-rating-reasons">{reasons}</ul></div>
+    <p><span class="app-requirements">Compatibility: </span><span>Requires iOS {ios}.0 or later.</span></p>
+  </div>
+  <div class="extra-list customer-ratings">
+    <h4>Customer Ratings</h4>
+    <div>Current Version:</div>
+    <div class="rating" aria-label="{cv} stars, {cvn} Ratings"><span>{cv}</span><span class="rating-count">{cvn} Ratings</span></div>
+    <div>All Versions:</div>
+    <div class="rating" aria-label="{av} stars, {avn} Ratings"><span>{av}</span><span class="rating-count">{avn} Ratings</span></div>
+  </div>
+  {inapp}
+</div>
+<div class="center-stack">
+  <div class="product-review"><h4>Description</h4><p>{description}</p><p>{description2}</p></div>
+  <div class="app-links"><a href="https://www.example.com/{id}">Developer Website</a><a href="https://support.example.com/{id}">App Support</a></div>
+  <div class="product-review"><h4>What's New in Version</h4><p>{remarks}</p></div>
+  <div class="swoosh lockup-container"></div>
+  <div class="swoosh"></div>
+  <div class="swoosh lockup-container application small"><div class="title"><h2>Customers Also Bought</h2></div>
+    <div class="content"><div>{also_bought}</div></div></div>
+  <div class="customer-reviews">{reviews}</div>
+</div>
+</div>
+</div>
+</body>
+</html>
+'''.format(name=name, seller=words(rnd, 2).title(), geo=geo, dev=rnd.randint(100000, 999999), id=app_id,
+           rows=''.join(rows), rated=rnd.choice([4, 9, 12, 17]), reasons=reasons, ios=rnd.randint(8, 11),
+           cv='{}.{}'.format(rnd.randint(1, 4), rnd.choice([0, 5])), cvn=rnd.randint(1, 900),
+           av='{}.{}'.format(rnd.randint(1, 4), rnd.choice([0, 5])), avn=rnd.randint(1, 90000),
+           inapp=inapp, description=words(rnd, 80), description2=words(rnd, 40), remarks=words(rnd, 20),
+           also_bought=also_bought, reviews=reviews,
+           flags=', '.join('"{}"'.format(w) for w in LOREM * 4),
+           boilerplate=''.join('<li><a href="https://www.apple.com/{0}/">{0}</a></li>'.format(w) for w in LOREM) * 6)
+    return url, html
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+# Record the page corpus of the parser benchmark ( bench_parsers ).
+# Every page is stored gzipped next to a manifest.json that tells its url ,
+# status , the spider callback that parses it and the request meta the
+# callback expects. Pages come from
+#
+#   --urls FILE      lines of '<callback> <url>' , fetched as they are ( the live site )
+#   --mock URL       listing pages of a running mockserver , for every storefront
+#   --synthetic N    N detail pages of each layout per storefront , from benchmarks.pages
+#
+#     python -m itunesbot.benchmarks.record_corpus --mock http://localhost:8000 --synthetic 3
+
+import argparse
+import gzip
+import json
+import os
+import urllib.request
+
+from scrapy.utils.project import get_project_settings
+
+from itunesbot.benchmarks.pages import render_legacy_detail_page, render_v2_detail_page
+
+CORPUS_DIR = os.path.join(os.path.dirname(__file__), 'corpus')
+GENRE_PATH = '/{}/genre/ios-shopping/id6024?mt=8'
+
+
+def fetch(url, user_agent):
+    # The status and body , error pages included
+    request = urllib.request.Request(url, headers={'User-Agent': user_agent})
+    try:
+        with urllib.request.urlopen(request, timeout=30) as response:
+            return response.status, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read()
+
+
+class Corpus(object):
+    """
+    Pages written to a corpus directory
+
+    :param path: Directory , created if missing
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = []
+        os.makedirs(path, exist_ok=True)
+
+    def add(self, name, url, callback, body, status=200, meta=None):
+        filename = '{}.html.gz'.format(name)
+        with gzip.open(os.path.join(self.path, filename), 'wb') as f:
+            f.write(body)
+        self.entries.append({'file': filename, 'url': url, 'callback': callback, 'status': status,
+                             'meta': meta or {}})
+
+    def save(self):
+        with open(os.path.join(self.path, 'manifest.json'), 'w') as f:
+            json.dump(self.entries, f, indent=1, sort_keys=True)
+
+
+def record_urls(corpus, path, user_agent):
+    with open(path) as f:
+        lines = [line.split() for line in f if line.strip() and not line.startswith('#')]
+    for i, (callback, url) in enumerate(lines):
+        status, body = fetch(url, user_agent)
+        corpus.add('{}-{:03d}'.format(callback, i), url, callback, body, status)
+
+
+def record_mock(corpus, base, geos, user_agent):
+    for geo in geos:
+        genre = base.rstrip('/') + GENRE_PATH.format(geo)
+        corpus.add('{}-genre'.format(geo), genre, 'parseCategory', fetch(genre, user_agent)[1])
+        letter = '{}&letter=A'.format(genre)
+        meta = {'letter_url': letter, 'page': 1, 'planned': 1}
+        corpus.add('{}-letter'.format(geo), letter, 'parseAlphabetWise', fetch(letter, user_agent)[1], meta=meta)
+        for page in (2, 99):
+            url = '{}&page={}'.format(letter, page)
+            meta = {'letter_url': letter, 'page': page, 'planned': page + 1}
+            # Page 99 is past the end , the empty page check
+            corpus.add('{}-page{}'.format(geo, page), url, 'parseListingPage', fetch(url, user_agent)[1], meta=meta)
+
+
+def record_synthetic(corpus, geos, count):
+    for geo in geos:
+        for i in range(count):
+            app_id = 400000000 + i
+            url, html = render_v2_detail_page(app_id, geo=geo)
+            corpus.add('{}-v2-{}'.format(geo, i), url, 'parseAppDetails_v2', html.encode('utf-8'))
+            url, html = render_legacy_detail_page(app_id, geo=geo)
+            corpus.add('{}-legacy-{}'.format(geo, i), url, 'parseAppDetails', html.encode('utf-8'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--out', default=CORPUS_DIR)
+    parser.add_argument('--urls', help="File of '<callback> <url>' lines")
+    parser.add_argument('--mock', help='Base url of a running mockserver')
+    parser.add_argument('--synthetic', type=int, default=0, help='Detail pages of each layout per storefront')
+    parser.add_argument('--storefronts', default='us,uk,de,fr,jp')
+    args = parser.parse_args()
+
+    user_agent = get_project_settings().get('USER_AGENT')
+    geos = args.storefronts.split(',')
+    corpus = Corpus(args.out)
+    if args.urls:
+        record_urls(corpus, args.urls, user_agent)
+    if args.mock:
+        record_mock(corpus, args.mock, geos, user_agent)
+    if args.synthetic:
+        record_synthetic(corpus, geos, args.synthetic)
+    corpus.save()
+    print('{} pages recorded in {}'.format(len(corpus.entries), args.out))
+
+
+if __name__ == '__main__':
+    main()
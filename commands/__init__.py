@@ -0,0 +1 @@
+# Scrapy commands of the itunesbot project , listed by COMMANDS_MODULE in settings.py
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+# scrapy compactcache [options] [spider ...]
+#
+# Evicts the responses of the SQLite HTTP cache that are past
+# HTTPCACHE_SQLITE_MAX_AGE or beyond HTTPCACHE_SQLITE_MAX_SIZE , compresses
+# the bodies stored before the current zstd dictionary with it , then
+# rebuilds the file so the freed space is given back to the disk.
+
+import os
+
+from scrapy.commands import ScrapyCommand
+from scrapy.exceptions import UsageError
+from scrapy.utils.project import data_path
+
+from itunesbot.httpcache import openCache
+
+
+class Command(ScrapyCommand):
+
+    requires_project = True
+    default_settings = {'LOG_ENABLED': False}
+
+    def syntax(self):
+        return '[options] [spider ...]'
+
+    def short_desc(self):
+        return 'Evict old responses from the SQLite HTTP cache and compact it'
+
+    def add_options(self, parser):
+        ScrapyCommand.add_options(self, parser)
+        parser.add_argument('--max-size', type=int, default=None,
+                            help='Cache size in bytes to evict down to , HTTPCACHE_SQLITE_MAX_SIZE by default')
+        parser.add_argument('--max-age', type=int, default=None,
+                            help='Evict responses older than this many seconds , HTTPCACHE_SQLITE_MAX_AGE by default')
+
+    def run(self, args, opts):
+        settings = self.settings
+        cachedir = data_path(settings['HTTPCACHE_DIR'])
+        if args:
+            paths = [os.path.join(cachedir, '{}.sqlite'.format(name)) for name in args]
+        elif os.path.isdir(cachedir):
+            paths = [os.path.join(cachedir, name) for name in sorted(os.listdir(cachedir)) if name.endswith('.sqlite')]
+        else:
+            paths = []
+        if not paths:
+            raise UsageError('No SQLite cache found in {}'.format(cachedir))
+
+        for path in paths:
+            if not os.path.exists(path):
+                raise UsageError('No SQLite cache at {}'.format(path))
+            before = os.path.getsize(path)
+            cache = openCache(path, settings, opts.max_size, opts.max_age)
+            dropped = cache.compact()
+            kept = cache.count()
+            cache.close()
+            print('{} : {} responses evicted , {} kept , {:.1f} MB -> {:.1f} MB'.format(
+                path, dropped, kept, before / 1048576.0, os.path.getsize(path) / 1048576.0))
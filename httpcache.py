@@ -0,0 +1,360 @@
+# -*- coding: utf-8 -*-
+
+# HTTP cache storage on a single SQLite file
+#
+# FilesystemCacheStorage keeps every cached response in its own directory ,
+# which at our scale means millions of small directories under HTTPCACHE_DIR.
+# SqliteCacheStorage keeps them all in <HTTPCACHE_DIR>/<spider>.sqlite with
+# batched writes and size and age based eviction. It is selected with
+#
+#     HTTPCACHE_STORAGE = 'itunesbot.httpcache.SqliteCacheStorage'
+#
+# and reads the usual HTTPCACHE_DIR and HTTPCACHE_EXPIRATION_SECS settings.
+#
+# Bodies are content addressed , a body served under several urls or
+# storefronts is kept once , and compressed with zstd. Once enough pages are
+# cached a zstd dictionary is trained on them , most of a detail page is
+# boilerplate shared by every App so later bodies compress far better.
+# Compression needs the zstandard package , without it bodies are stored as is.
+
+import hashlib
+import logging
+import os
+import sqlite3
+from time import time
+
+from scrapy.http import Headers
+from scrapy.responsetypes import responsetypes
+from scrapy.utils.project import data_path
+from w3lib.http import headers_dict_to_raw, headers_raw_to_dict
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+#Bumped when the layout of the cache file changes , older files are dropped
+SCHEMA_VERSION = 2
+
+#dict_id of a body stored without compression , 0 is zstd without a dictionary
+RAW = -1
+
+
+def bodyDigest(body):
+    return hashlib.blake2b(body, digest_size=16).digest()
+
+
+class SqliteCache(object):
+    """
+    The cache file itself , shared by the storage and the compactcache command
+
+    :param path: SQLite file , created if missing
+    :param max_size: Evict the oldest responses beyond this many stored body bytes , 0 for no limit
+    :param max_age: Evict the responses stored more than this many seconds ago , 0 for no limit
+    :param compress: Compress the bodies with zstd , ignored if zstandard is not installed
+    :param level: zstd compression level
+    :param dict_size: Size in bytes of the trained dictionary
+    :param train_samples: Bodies to collect before a dictionary is trained , 0 to never train one
+    """
+
+    def __init__(self, path, max_size=0, max_age=0, compress=True, level=3, dict_size=112640, train_samples=200):
+        self.path = path
+        self.max_size = max_size
+        self.max_age = max_age
+        self.compress = compress and zstandard is not None
+        self.level = level
+        self.dict_size = dict_size
+        self.train_samples = train_samples
+        self.samples = []
+        self.compressors = {}
+        self.decompressors = {}
+        if compress and zstandard is None:
+            logger.warning('zstandard is not installed , HTTP cache bodies are stored uncompressed')
+
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        if self.conn.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION:
+            # Only a cache , a file in an older layout is started over
+            with self.conn:
+                for table in ('responses', 'bodies', 'dicts'):
+                    self.conn.execute('DROP TABLE IF EXISTS {}'.format(table))
+                self.conn.execute('PRAGMA user_version = {}'.format(SCHEMA_VERSION))
+        self.conn.execute('CREATE TABLE IF NOT EXISTS responses ('
+                          'key BLOB PRIMARY KEY, stored REAL NOT NULL, url TEXT NOT NULL, '
+                          'status INTEGER NOT NULL, headers BLOB NOT NULL, digest BLOB NOT NULL)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS responses_stored ON responses (stored)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS responses_digest ON responses (digest)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS bodies ('
+                          'digest BLOB PRIMARY KEY, dict_id INTEGER NOT NULL, data BLOB NOT NULL, '
+                          'size INTEGER NOT NULL)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS dicts (id INTEGER PRIMARY KEY, data BLOB NOT NULL)')
+        self.conn.commit()
+        self.dict_id = self.conn.execute('SELECT COALESCE(MAX(id), 0) FROM dicts').fetchone()[0]
+        self.size = self.storedSize()
+
+    def storedSize(self):
+        return self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM bodies').fetchone()[0]
+
+    def zstdDict(self, dict_id):
+        data = self.conn.execute('SELECT data FROM dicts WHERE id = ?', (dict_id,)).fetchone()[0]
+        return zstandard.ZstdCompressionDict(data)
+
+    def compressor(self, dict_id):
+        if dict_id not in self.compressors:
+            if dict_id:
+                self.compressors[dict_id] = zstandard.ZstdCompressor(level=self.level, dict_data=self.zstdDict(dict_id))
+            else:
+                self.compressors[dict_id] = zstandard.ZstdCompressor(level=self.level)
+        return self.compressors[dict_id]
+
+    def decompressor(self, dict_id):
+        if dict_id not in self.decompressors:
+            if zstandard is None:
+                raise IOError('zstandard is needed to read the compressed bodies of {}'.format(self.path))
+            if dict_id:
+                self.decompressors[dict_id] = zstandard.ZstdDecompressor(dict_data=self.zstdDict(dict_id))
+            else:
+                self.decompressors[dict_id] = zstandard.ZstdDecompressor()
+        return self.decompressors[dict_id]
+
+    def encode(self, body):
+        # (dict_id , stored bytes) for a raw body
+        if not self.compress:
+            return RAW, body
+        return self.dict_id, self.compressor(self.dict_id).compress(body)
+
+    def decode(self, dict_id, data):
+        if dict_id == RAW:
+            return data
+        return self.decompressor(dict_id).decompress(data)
+
+    def train(self):
+        """
+        Train a dictionary on the bodies collected so far , the bodies stored
+        from then on are compressed with it
+        """
+        try:
+            trained = zstandard.train_dictionary(self.dict_size, self.samples, level=self.level)
+        except zstandard.ZstdError as e:
+            logger.warning('Could not train a zstd dictionary on %d bodies : %s', len(self.samples), e)
+            return
+        finally:
+            self.samples = []
+        with self.conn:
+            self.dict_id = self.conn.execute('INSERT INTO dicts (data) VALUES (?)',
+                                             (trained.as_bytes(),)).lastrowid
+        logger.info('Trained zstd dictionary %d for %s', self.dict_id, self.path)
+
+    def get(self, key):
+        # (stored , url , status , headers , body) or None
+        row = self.conn.execute('SELECT r.stored, r.url, r.status, r.headers, b.dict_id, b.data '
+                                'FROM responses r JOIN bodies b ON b.digest = r.digest WHERE r.key = ?',
+                                (key,)).fetchone()
+        if row is None:
+            return None
+        stored, url, status, headers, dict_id, data = row
+        return stored, url, status, headers, self.decode(dict_id, data)
+
+    def put(self, rows):
+        """
+        Write a batch of responses in one transaction
+
+        :param rows: List of (key , stored , url , status , headers , body)
+        """
+        with self.conn:
+            replaced = set()
+            for key, stored, url, status, headers, body in rows:
+                digest = bodyDigest(body)
+                if self.conn.execute('SELECT 1 FROM bodies WHERE digest = ?', (digest,)).fetchone() is None:
+                    dict_id, data = self.encode(body)
+                    self.conn.execute('INSERT INTO bodies VALUES (?, ?, ?, ?)', (digest, dict_id, data, len(data)))
+                    self.size += len(data)
+                    if self.compress and self.train_samples and not self.dict_id:
+                        self.samples.append(body)
+                old = self.conn.execute('SELECT digest FROM responses WHERE key = ?', (key,)).fetchone()
+                if old is not None and old[0] != digest:
+                    replaced.add(old[0])
+                self.conn.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)',
+                                  (key, stored, url, status, headers, digest))
+            # A response stored again with another body may leave its old body unused
+            self.dropBodies(replaced)
+        if self.samples and len(self.samples) >= self.train_samples:
+            self.train()
+        self.evict()
+
+    def collect(self):
+        # Drop the bodies no response points at anymore , a scan of the whole
+        # file kept for compact , eviction drops the bodies as it goes
+        collected = self.conn.execute('DELETE FROM bodies WHERE digest NOT IN (SELECT digest FROM responses)').rowcount
+        self.size = self.storedSize()
+        return collected
+
+    def dropBodies(self, digests):
+        # Drop the bodies among digests no response points at anymore , self.size follows
+        for digest in digests:
+            if self.conn.execute('SELECT 1 FROM responses WHERE digest = ? LIMIT 1', (digest,)).fetchone() is not None:
+                continue
+            row = self.conn.execute('SELECT size FROM bodies WHERE digest = ?', (digest,)).fetchone()
+            if row is not None:
+                self.conn.execute('DELETE FROM bodies WHERE digest = ?', (digest,))
+                self.size -= row[0]
+
+    def dropResponses(self, rows):
+        # rows : list of (key , digest)
+        self.conn.executemany('DELETE FROM responses WHERE key = ?', [(key,) for key, digest in rows])
+        self.dropBodies(set(digest for key, digest in rows))
+
+    def evict(self):
+        """
+        Drop the expired responses , then the oldest ones until the cache fits max_size.
+        Only the bodies of the responses dropped are looked at , so a batch that
+        drops nothing costs an index lookup
+
+        :return: Number of responses dropped
+        """
+        dropped = 0
+        if self.max_age:
+            with self.conn:
+                rows = self.conn.execute('SELECT key, digest FROM responses WHERE stored < ?',
+                                         (time() - self.max_age,)).fetchall()
+                if rows:
+                    self.dropResponses(rows)
+            dropped += len(rows)
+        if self.max_size and self.size > self.max_size:
+            # Oldest first , a tenth below the limit so eviction does not run on
+            # every batch. Bodies are shared so the space freed is only known
+            # once the orphaned bodies are gone , responses go in chunks
+            target = self.max_size * 0.9
+            while self.size > target:
+                with self.conn:
+                    rows = self.conn.execute('SELECT key, digest FROM responses ORDER BY stored LIMIT 100').fetchall()
+                    if not rows:
+                        break
+                    self.dropResponses(rows)
+                dropped += len(rows)
+        return dropped
+
+    def recompress(self):
+        """
+        Compress again the bodies stored before the current dictionary was trained
+
+        :return: Number of bodies rewritten
+        """
+        if not self.compress:
+            return 0
+        if not self.dict_id and self.train_samples:
+            # Not enough pages came in during the crawls to train one , train on the cache as it is now
+            rows = self.conn.execute('SELECT dict_id, data FROM bodies ORDER BY RANDOM() LIMIT ?',
+                                     (max(self.train_samples, 1000),)).fetchall()
+            self.samples = [self.decode(dict_id, data) for dict_id, data in rows]
+            if len(self.samples) >= 10:
+                self.train()
+            self.samples = []
+        rewritten = 0
+        rows = self.conn.execute('SELECT digest, dict_id, data FROM bodies WHERE dict_id != ?',
+                                 (self.dict_id,)).fetchall()
+        with self.conn:
+            for digest, dict_id, data in rows:
+                dict_id, data = self.encode(self.decode(dict_id, data))
+                self.conn.execute('UPDATE bodies SET dict_id = ?, data = ?, size = ? WHERE digest = ?',
+                                  (dict_id, data, len(data), digest))
+                rewritten += 1
+            # Dictionaries no body uses anymore
+            self.conn.execute('DELETE FROM dicts WHERE id NOT IN (SELECT DISTINCT dict_id FROM bodies) AND id != ?',
+                              (self.dict_id,))
+        self.size = self.storedSize()
+        return rewritten
+
+    def compact(self):
+        # Evict , bring every body to the current dictionary , then rebuild the
+        # file so the space of the dropped responses is given back
+        dropped = self.evict()
+        with self.conn:
+            self.collect()
+        self.recompress()
+        self.conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        self.conn.execute('VACUUM')
+        return dropped
+
+    def count(self):
+        return self.conn.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+
+class SqliteCacheStorage(object):
+    """
+    Scrapy HTTP cache storage backed by SqliteCache.
+    Responses are written in batches of HTTPCACHE_SQLITE_BATCH , the batch
+    not yet written is looked up first so a response is a hit right away
+    """
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.cachedir = data_path(settings['HTTPCACHE_DIR'], createdir=True)
+        self.expiration_secs = settings.getint('HTTPCACHE_EXPIRATION_SECS')
+        self.batch_size = settings.getint('HTTPCACHE_SQLITE_BATCH', 100)
+        self.cache = None
+        self.pending = {}
+
+    def open_spider(self, spider):
+        path = os.path.join(self.cachedir, '{}.sqlite'.format(spider.name))
+        logger.debug('Using SQLite cache storage in %(path)s', {'path': path}, extra={'spider': spider})
+        self.fingerprinter = spider.crawler.request_fingerprinter
+        self.cache = openCache(path, self.settings)
+        self.cache.evict()
+
+    def close_spider(self, spider):
+        self.flush()
+        self.cache.close()
+
+    def flush(self):
+        if self.pending:
+            self.cache.put(list(self.pending.values()))
+            self.pending = {}
+
+    def retrieve_response(self, spider, request):
+        """Return response if present in cache, or None otherwise."""
+        key = self.fingerprinter.fingerprint(request)
+        row = self.pending.get(key)
+        if row is not None:
+            row = row[1:]
+        else:
+            row = self.cache.get(key)
+        if row is None:
+            return None  # not cached
+        stored, url, status, rawheaders, body = row
+        if 0 < self.expiration_secs < time() - stored:
+            return None  # expired
+        headers = Headers(headers_raw_to_dict(rawheaders))
+        respcls = responsetypes.from_args(headers=headers, url=url, body=body)
+        return respcls(url=url, headers=headers, status=status, body=body)
+
+    def store_response(self, spider, request, response):
+        """Store the given response in the cache."""
+        key = self.fingerprinter.fingerprint(request)
+        self.pending[key] = (key, time(), response.url, response.status,
+                             headers_dict_to_raw(response.headers), response.body)
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+
+def openCache(path, settings, max_size=None, max_age=None):
+    """
+    SqliteCache configured from the HTTPCACHE_SQLITE_* and HTTPCACHE_ZSTD_* settings
+
+    :param max_size: Overrides HTTPCACHE_SQLITE_MAX_SIZE
+    :param max_age: Overrides HTTPCACHE_SQLITE_MAX_AGE
+    """
+    return SqliteCache(path,
+                       max_size=settings.getint('HTTPCACHE_SQLITE_MAX_SIZE', 0) if max_size is None else max_size,
+                       max_age=settings.getint('HTTPCACHE_SQLITE_MAX_AGE', 0) if max_age is None else max_age,
+                       compress=settings.getbool('HTTPCACHE_ZSTD_ENABLED', True),
+                       level=settings.getint('HTTPCACHE_ZSTD_LEVEL', 3),
+                       dict_size=settings.getint('HTTPCACHE_ZSTD_DICT_SIZE', 112640),
+                       train_samples=settings.getint('HTTPCACHE_ZSTD_TRAIN_SAMPLES', 200))
@@ -5,7 +5,24 @@
 # See documentation in:
 # http://doc.scrapy.org/en/latest/topics/items.html
 
+import re
+import sys
+from collections.abc import MutableMapping, KeysView
+from pprint import pformat
+from types import MappingProxyType
+
 import scrapy
+from itemadapter import ItemAdapter
+from itemadapter.adapter import AdapterInterface
+
+#Pattern to get the digits of a count like '1,234 Ratings'
+pat_digits = re.compile(r'\d+')
+#Pattern to get the number and unit of a count like '1.2K Ratings' , the one of countColumn in the pipelines
+pat_count = re.compile(r'([\d.,]*\d)\s*([KkMm]?)\b')
+#Multipliers of the count units
+count_units = {'': 1, 'K': 1000, 'M': 1000000}
+#Pattern to get the number and unit of an App Size like '45.6 MB'
+pat_size = re.compile(r'([\d.,]+)\s*([KMG]B)', re.I)
 
 
 class AppItem(scrapy.Item):
@@ -76,4 +93,166 @@ class AppItem(scrapy.Item):
     app_num = scrapy.Field()
     app_country = scrapy.Field()
 
+    #Fields filled by the new layout parser (parseAppDetails_v2)
+    app_rating = scrapy.Field() # Age Rating as shown in the Information list
+    app_extras = scrapy.Field() # Information list entries without a dedicated field
+    app_supports = scrapy.Field() # Features listed in the Supports section
+    more_apps_by_developer = scrapy.Field() # {AppName : AppURL} from More By This Developer
+    similar_apps = scrapy.Field() # {AppName : AppURL} from You May Also Like
+
+    #Filled by the NormalizePipeline
+    app_age_rating = scrapy.Field() # Age Rating as a number , 12 for 'Rated 12+'
+
     #End of New Fields
+
+
+def toFloat(val):
+    try:
+        return float(val)
+    except (TypeError, ValueError):
+        return None
+
+
+def toInt(val):
+    if isinstance(val, (int, float)) and not isinstance(val, bool):
+        return int(val)
+    if isinstance(val, str):
+        digits = ''.join(pat_digits.findall(val))
+        return int(digits) if digits else None
+    return None
+
+
+def toCount(val):
+    # Count like '63434' , '1,234 Ratings' or '1.2K Ratings' , as NormalizePipeline reads it
+    if isinstance(val, (int, float)) and not isinstance(val, bool):
+        return int(val)
+    if isinstance(val, str):
+        match = pat_count.search(val)
+        if match is None:
+            return None
+        try:
+            number = float(match.group(1).replace(',', ''))
+        except ValueError:
+            return None
+        return int(round(number * count_units[match.group(2).upper()]))
+    return None
+
+
+def toBool(val):
+    if val is None or isinstance(val, bool):
+        return val
+    return str(val).strip().lower() in ('true', '1', 'yes')
+
+
+def toMegabytes(val):
+    # App Size like '45.6 MB' or '1.2 GB' in MB
+    if val is None or isinstance(val, float):
+        return val
+    match = pat_size.search(str(val))
+    if match is None:
+        return toFloat(val)
+    size = float(match.group(1).replace(',', ''))
+    return size * {'KB': 1 / 1024.0, 'MB': 1.0, 'GB': 1024.0}[match.group(2).upper()]
+
+
+def toInterned(val):
+    # One copy of the strings that repeat from item to item
+    return sys.intern(val) if isinstance(val, str) else val
+
+
+class CompactAppItem(MutableMapping):
+
+    '''
+    The fields of AppItem in slots instead of a dict. Counts are ints , ratings
+    and the App Size ( in MB ) floats , flags bools and the strings with few
+    distinct values are interned. Reads and writes like an AppItem , so the
+    parsers can fill it and the pipelines and exporters take it as it is.
+    '''
+
+    __slots__ = tuple(AppItem.fields)
+    fields = AppItem.fields
+    converters = dict([(name, toCount) for name in ('app_review_counts_cv', 'app_review_counts_av')] +
+                      [(name, toFloat) for name in ('app_rating_value_cv', 'app_rating_value_av',
+                                                    'app_star_rating_cv', 'app_star_rating_av')] +
+                      [(name, toBool) for name in ('is_paid', 'app_for_watch', 'has_inapp')] +
+                      [(name, toInterned) for name in ('app_html_lang', 'app_geo', 'app_country', 'app_seller',
+                                                       'app_publisher', 'app_category_name', 'app_category_id',
+                                                       'app_content_rating', 'app_rating', 'app_designed_for',
+                                                       'app_compatibility', 'app_crawl_status')] +
+                      [('app_size', toMegabytes)])
+
+    def __init__(self, *args, **kwargs):
+        if args or kwargs:
+            self.update(*args, **kwargs)
+
+    def __getitem__(self, key):
+        # Only the fields , not the methods nor the class attributes
+        if key not in self.fields:
+            raise KeyError(key)
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key not in self.fields:
+            raise KeyError('{} does not support field: {}'.format(self.__class__.__name__, key))
+        convert = self.converters.get(key)
+        setattr(self, key, convert(value) if convert is not None else value)
+
+    def __delitem__(self, key):
+        if key not in self.fields:
+            raise KeyError(key)
+        try:
+            delattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def __iter__(self):
+        return (name for name in self.__slots__ if hasattr(self, name))
+
+    def __len__(self):
+        return sum(1 for name in self.__slots__ if hasattr(self, name))
+
+    def __repr__(self):
+        return pformat(dict(self))
+
+    def copy(self):
+        return self.__class__(self)
+
+
+class CompactItemAdapter(AdapterInterface):
+    # Lets Scrapy ( is_item , the feed exporters ) take CompactAppItem like a scrapy.Item
+
+    @classmethod
+    def is_item_class(cls, item_class):
+        return issubclass(item_class, CompactAppItem)
+
+    @classmethod
+    def get_field_meta_from_class(cls, item_class, field_name):
+        return MappingProxyType(item_class.fields[field_name])
+
+    @classmethod
+    def get_field_names_from_class(cls, item_class):
+        return list(item_class.fields)
+
+    def field_names(self):
+        return KeysView(self.item.fields)
+
+    def __getitem__(self, field_name):
+        return self.item[field_name]
+
+    def __setitem__(self, field_name, value):
+        self.item[field_name] = value
+
+    def __delitem__(self, field_name):
+        del self.item[field_name]
+
+    def __iter__(self):
+        return iter(self.item)
+
+    def __len__(self):
+        return len(self.item)
+
+
+ItemAdapter.ADAPTER_CLASSES.appendleft(CompactItemAdapter)
@@ -5,7 +5,22 @@
 # See documentation in:
 # http://doc.scrapy.org/en/latest/topics/spider-middleware.html
 
-from scrapy import signals
+from email.utils import parsedate_to_datetime
+from time import perf_counter, time
+from urllib.parse import urlparse
+
+from scrapy import Request, signals
+from scrapy.exceptions import DontCloseSpider, NotConfigured
+from scrapy.spidermiddlewares.httperror import HttpError
+from scrapy.utils.misc import load_object
+from scrapy.utils.request import request_from_dict
+from twisted.internet import reactor, task
+from twisted.web.server import Site
+
+from itunesbot.items import AppItem, CompactAppItem
+from itunesbot.spiders.frontier import FrontierAppIdFilter, defaultWorkerId, frontierKey
+from itunesbot.spiders.schema import appGeoAndId, projectItem
+from itunesbot.timing import MetricsResource, Timings
 
 
 class ItunesbotSpiderMiddleware(object):
@@ -54,3 +69,403 @@ class ItunesbotSpiderMiddleware(object):
 
     def spider_opened(self, spider):
         spider.logger.info('Spider opened: %s' % spider.name)
+
+
+class CompactItemMiddleware(object):
+    # Turns the AppItems the callbacks return into CompactAppItems
+    # ( COMPACT_ITEMS_ENABLED ) , so the items waiting in the scraper and in the
+    # batches of the pipelines take less memory.
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('COMPACT_ITEMS_ENABLED'):
+            raise NotConfigured
+        return cls()
+
+    def process_spider_output(self, response, result, spider):
+        for x in result:
+            yield CompactAppItem(x) if isinstance(x, AppItem) else x
+
+    async def process_spider_output_async(self, response, result, spider):
+        async for x in result:
+            yield CompactAppItem(x) if isinstance(x, AppItem) else x
+
+
+class FieldProjectionMiddleware(object):
+    # Trims the AppItems to the fields= projection of the spider , the rules
+    # filling several fields at once set some that were not asked for.
+
+    def process_spider_output(self, response, result, spider):
+        fields = getattr(spider, 'item_fields', None)
+        for x in result:
+            yield projectItem(x, fields) if fields is not None and isinstance(x, AppItem) else x
+
+    async def process_spider_output_async(self, response, result, spider):
+        fields = getattr(spider, 'item_fields', None)
+        async for x in result:
+            yield projectItem(x, fields) if fields is not None and isinstance(x, AppItem) else x
+
+
+class IncrementalRecrawlMiddleware(object):
+    # Conditional requests for the incremental recrawl ( INCREMENTAL_ENABLED ).
+    # The App Detail Page requests of Apps crawled before get If-None-Match and
+    # If-Modified-Since from the spider's incremental state , and the validators
+    # of the pages fetched from the site are stored back into it , the pages
+    # replayed from the HTTP cache carry the validators of an older fetch.
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('INCREMENTAL_ENABLED'):
+            raise NotConfigured
+        return cls()
+
+    def appKey(self, url, spider):
+        state = getattr(spider, 'incremental_state', None)
+        if state is None or '/app/' not in urlparse(url).path:
+            return None, None, None
+        geo, app_num = appGeoAndId(url)
+        return state, geo, app_num
+
+    def process_request(self, request, spider):
+        state, geo, app_num = self.appKey(request.url, spider)
+        if app_num is None:
+            return None
+        known = state.get(geo, app_num)
+        if known is None:
+            return None
+
+        request.meta['incremental_known'] = known
+        # The cache would answer from its stale copy without asking the site
+        request.meta['dont_cache'] = True
+        # Let the 304 through to the spider callback
+        request.meta['handle_httpstatus_list'] = list(request.meta.get('handle_httpstatus_list', [])) + [304]
+        if known['etag']:
+            request.headers.setdefault('If-None-Match', known['etag'])
+        if known['last_modified']:
+            request.headers.setdefault('If-Modified-Since', known['last_modified'])
+        return None
+
+    def process_response(self, request, response, spider):
+        if response.status != 200 or 'cached' in response.flags:
+            return response
+        state, geo, app_num = self.appKey(response.url, spider)
+        if app_num is None:
+            return response
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if etag or last_modified:
+            state.recordValidators(geo, app_num,
+                                   etag.decode('latin-1') if etag else None,
+                                   last_modified.decode('latin-1') if last_modified else None)
+        return response
+
+
+class FrontierMiddleware(object):
+    # Distributed mode ( FRONTIER_ENABLED ). The start requests , every
+    # request the callbacks yield and the storefront , lookup and retry
+    # requests the spider sends itself ( AppSpider.crawlRequest ) go to the
+    # shared frontier instead of the local scheduler , and the spider crawls
+    # what it leases back from it ,
+    # FRONTIER_PREFETCH requests at a time. A request is acked once its
+    # callback has run , released for another lease when it fails to
+    # download , and the spider stays open until the whole frontier is done.
+    # The frontier is polled every FRONTIER_POLL_SECS , so a worker with
+    # free slots picks up what the others push without waiting to go idle.
+
+    def __init__(self, crawler, frontier, prefetch, worker, poll_secs=1.0):
+        self.crawler = crawler
+        self.frontier = frontier
+        self.prefetch = prefetch
+        self.worker = worker
+        self.poll_secs = poll_secs
+        self.inflight = set()
+        self.timer = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('FRONTIER_ENABLED'):
+            raise NotConfigured
+        frontier = load_object(settings.get('FRONTIER_BACKEND', 'itunesbot.spiders.frontier.SqliteFrontier'))
+        mw = cls(crawler, frontier.fromSettings(settings),
+                 prefetch=settings.getint('FRONTIER_PREFETCH', settings.getint('CONCURRENT_REQUESTS')),
+                 worker=settings.get('FRONTIER_WORKER_ID') or defaultWorkerId(),
+                 poll_secs=settings.getfloat('FRONTIER_POLL_SECS', 1.0))
+        crawler.signals.connect(mw.spiderOpened, signal=signals.spider_opened)
+        crawler.signals.connect(mw.spiderIdle, signal=signals.spider_idle)
+        crawler.signals.connect(mw.spiderClosed, signal=signals.spider_closed)
+        return mw
+
+    def process_start_requests(self, start_requests, spider):
+        # Every worker seeds the frontier , the start requests of the others are dropped as duplicates
+        self.push(list(start_requests), spider)
+        return []
+
+    def process_spider_output(self, response, result, spider):
+        requests = []
+        for x in result:
+            if isinstance(x, Request) and not x.meta.get('frontier_local'):
+                requests.append(x)
+            else:
+                yield x
+        self.done(response, requests, spider)
+
+    async def process_spider_output_async(self, response, result, spider):
+        requests = []
+        async for x in result:
+            if isinstance(x, Request) and not x.meta.get('frontier_local'):
+                requests.append(x)
+            else:
+                yield x
+        self.done(response, requests, spider)
+
+    def process_spider_exception(self, response, exception, spider):
+        # The callback failed , another lease may do better
+        self.release(response.meta.get('frontier_key'))
+        return None
+
+    def push(self, requests, spider):
+        if not requests:
+            return
+        fingerprinter = self.crawler.request_fingerprinter
+        tasks = [(frontierKey(request, fingerprinter), request.priority, request.to_dict(spider=spider))
+                 for request in requests]
+        added = self.frontier.push(tasks)
+        self.incStat('frontier/pushed', added)
+        self.incStat('frontier/duplicate', len(tasks) - added)
+
+    def pushRequests(self, requests):
+        spider = self.crawler.spider
+        self.push(requests, spider)
+        self.fill(spider)
+
+    def done(self, response, requests, spider):
+        self.push(requests, spider)
+        key = response.meta.get('frontier_key')
+        if key in self.inflight:
+            self.inflight.discard(key)
+            self.frontier.ack(key)
+            self.incStat('frontier/acked')
+        self.fill(spider)
+
+    def release(self, key):
+        if key in self.inflight:
+            self.inflight.discard(key)
+            self.frontier.release(key)
+            self.incStat('frontier/released')
+
+    def downloadFailed(self, failure):
+        # Errback of the leased requests
+        key = failure.request.meta.get('frontier_key')
+        if failure.check(HttpError):
+            # The site answered , an other worker would get the same
+            if key in self.inflight:
+                self.inflight.discard(key)
+                self.frontier.fail(key)
+                self.incStat('frontier/failed')
+        else:
+            self.release(key)
+        self.fill(self.crawler.spider)
+
+    def fill(self, spider):
+        # Lease enough requests to keep FRONTIER_PREFETCH of them in flight
+        wanted = self.prefetch - len(self.inflight)
+        if wanted <= 0:
+            return
+        for key, data, stolen in self.frontier.lease(self.worker, wanted):
+            request = request_from_dict(data, spider=spider)
+            request.meta['frontier_key'] = key
+            # The frontier already dropped the duplicates
+            request = request.replace(dont_filter=True, errback=self.downloadFailed)
+            self.inflight.add(key)
+            self.incStat('frontier/leased')
+            if stolen:
+                self.incStat('frontier/stolen')
+            self.crawler.engine.crawl(request)
+
+    def spiderOpened(self, spider):
+        if getattr(spider, 'app_filter', None) is not None:
+            spider.app_filter = FrontierAppIdFilter(self.frontier, spider.app_filter)
+        # The storefront , lookup and retry requests the spider sends outside its callbacks
+        spider.frontier_push = self.pushRequests
+        self.timer = task.LoopingCall(self.fill, spider)
+        self.timer.start(self.poll_secs, now=False)
+
+    def spiderIdle(self, spider):
+        self.fill(spider)
+        if self.inflight or not self.frontier.finished():
+            # Other workers hold leases , they may still yield requests or let their leases expire
+            raise DontCloseSpider
+
+    def spiderClosed(self, spider):
+        if self.timer is not None and self.timer.running:
+            self.timer.stop()
+        # Leases not acked go back to the frontier for the other workers
+        for key in list(self.inflight):
+            self.release(key)
+        self.frontier.close()
+
+    def incStat(self, key, count=1):
+        if self.crawler.stats is not None and count:
+            self.crawler.stats.inc_value(key, count)
+
+
+def retryAfterSecs(value):
+    """
+    :param value: Retry-After header , seconds or an HTTP date
+    :return: Seconds to wait or None if the header can not be read
+    """
+    value = value.decode('latin-1').strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time())
+    except (TypeError, ValueError):
+        return None
+
+
+class BanThrottleMiddleware(object):
+    # Additive increase / multiplicative decrease of the download slots on
+    # bans ( BANTHROTTLE_ENABLED ). AutoThrottle only looks at latency , so a
+    # site answering 403 / 503 fast gets the full request rate. Here a ban
+    # halves the slot's concurrency and doubles its delay , once per round
+    # trip ( bans of requests sent before the last decrease are not counted
+    # again ). Every good response takes BANTHROTTLE_DELAY_STEP off the delay
+    # and every BANTHROTTLE_INCREASE_EVERY of them give one request of
+    # concurrency back.
+    # A Retry-After pauses the slot for as long as asked. Slots are per host ,
+    # per storefront with the storefront fan-out , and the error rate is kept
+    # per slot and per storefront in the crawl stats.
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        self.crawler = crawler
+        self.codes = set(int(code) for code in settings.getlist('BANTHROTTLE_CODES', [403, 429, 503]))
+        self.decrease = settings.getfloat('BANTHROTTLE_DECREASE', 0.5)
+        self.increase_every = settings.getint('BANTHROTTLE_INCREASE_EVERY', 20)
+        self.min_concurrency = settings.getint('BANTHROTTLE_MIN_CONCURRENCY', 1)
+        self.min_delay = settings.getfloat('DOWNLOAD_DELAY')
+        self.max_delay = settings.getfloat('BANTHROTTLE_MAX_DELAY', 60.0)
+        self.delay_step = settings.getfloat('BANTHROTTLE_DELAY_STEP', 0.01)
+        self.min_backoff = settings.getfloat('BANTHROTTLE_MIN_BACKOFF', 0.05)
+        self.max_retry_after = settings.getfloat('BANTHROTTLE_MAX_RETRY_AFTER', 600.0)
+        self.autothrottle = settings.getbool('AUTOTHROTTLE_ENABLED')
+        self.slots = {}
+        self.error_rates = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('BANTHROTTLE_ENABLED'):
+            raise NotConfigured
+        return cls(crawler)
+
+    def slotState(self, key, slot):
+        if key not in self.slots:
+            # The concurrency the slot started with is the ceiling of the increases
+            self.slots[key] = {'max_concurrency': slot.concurrency, 'floor_delay': slot.delay,
+                               'successes': 0, 'decreased_at': 0.0}
+        return self.slots[key]
+
+    def process_response(self, request, response, spider):
+        if 'cached' in response.flags:
+            return response
+        key = request.meta.get('download_slot')
+        slot = self.crawler.engine.downloader.slots.get(key)
+        if slot is None:
+            return response
+        state = self.slotState(key, slot)
+        banned = response.status in self.codes
+        geo = appGeoAndId(request.url)[0]
+        self.trackErrorRate('throttle/{}/error_rate'.format(key), banned)
+        if geo:
+            self.trackErrorRate('throttle/storefront/{}/error_rate'.format(geo), banned)
+
+        now = time()
+        if banned:
+            self.incStat('throttle/bans')
+            # Sent before the last decrease , that decrease already answered it
+            sent_at = now - request.meta.get('download_latency', 0)
+            if sent_at >= state['decreased_at']:
+                state['decreased_at'] = now
+                state['successes'] = 0
+                slot.concurrency = max(self.min_concurrency, int(slot.concurrency * self.decrease))
+                state['floor_delay'] = min(self.max_delay, max(state['floor_delay'] * 2, self.min_backoff))
+                self.incStat('throttle/decreases')
+            retry_after = response.headers.get('Retry-After')
+            secs = retryAfterSecs(retry_after) if retry_after else None
+            if secs:
+                # No request leaves the slot before now + secs
+                secs = min(secs, self.max_retry_after)
+                slot.delay = max(slot.delay, 0.001)
+                slot.lastseen = max(slot.lastseen, now + secs - slot.delay)
+                self.incStat('throttle/retry_after')
+        else:
+            state['successes'] += 1
+            state['floor_delay'] = max(self.min_delay, state['floor_delay'] - self.delay_step)
+            if state['successes'] >= self.increase_every:
+                state['successes'] = 0
+                slot.concurrency = min(state['max_concurrency'], slot.concurrency + 1)
+        # AutoThrottle sets the delay from the latency before this runs , the ban delay stays a floor
+        slot.delay = max(slot.delay if self.autothrottle else self.min_delay, state['floor_delay'])
+        self.setStat('throttle/{}/concurrency'.format(key), slot.concurrency)
+        self.setStat('throttle/{}/delay'.format(key), round(slot.delay, 3))
+        return response
+
+    def trackErrorRate(self, key, banned, alpha=0.05):
+        # Moving average of the share of bans
+        rate = self.error_rates.get(key, 0.0) * (1 - alpha) + (alpha if banned else 0.0)
+        self.error_rates[key] = rate
+        self.setStat(key, round(rate, 4))
+
+    def incStat(self, key, count=1):
+        self.crawler.stats.inc_value(key, count)
+
+    def setStat(self, key, value):
+        self.crawler.stats.set_value(key, value)
+
+
+class TimingMiddleware(object):
+    # Hot path timing ( TIMING_ENABLED , see timing.py ). Hands the spider the
+    # histograms its @timed callbacks record into , times the wait of every
+    # response from its download to its callback , writes the histograms to
+    # the crawl stats on close and serves them on TIMING_PROMETHEUS_PORT.
+
+    def __init__(self, crawler, timings, port=None):
+        self.crawler = crawler
+        self.timings = timings
+        self.port = port
+        self.listener = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('TIMING_ENABLED'):
+            raise NotConfigured
+        middleware = cls(crawler, Timings.fromSettings(crawler.settings),
+                         port=crawler.settings.getint('TIMING_PROMETHEUS_PORT') or None)
+        crawler.signals.connect(middleware.responseDownloaded, signal=signals.response_downloaded)
+        crawler.signals.connect(middleware.spiderOpened, signal=signals.spider_opened)
+        crawler.signals.connect(middleware.spiderClosed, signal=signals.spider_closed)
+        return middleware
+
+    def responseDownloaded(self, response, request, spider):
+        request.meta['timing_downloaded'] = perf_counter()
+
+    def process_spider_input(self, response, spider):
+        # Last in the chain , the callback runs next. Cached responses have no download time
+        downloaded = response.meta.get('timing_downloaded')
+        if downloaded is not None:
+            callback = response.request.callback
+            name = getattr(callback, '__name__', 'parse')
+            self.timings.observe('queue_wait', (name,), perf_counter() - downloaded)
+        return None
+
+    def spiderOpened(self, spider):
+        spider.timings = self.timings
+        if self.port is not None:
+            self.listener = reactor.listenTCP(self.port, Site(MetricsResource(self.timings)), interface='127.0.0.1')
+            spider.logger.info('Timings served on http://127.0.0.1:{}/metrics'.format(self.port))
+
+    def spiderClosed(self, spider):
+        self.timings.toStats(self.crawler.stats)
+        if self.listener is not None:
+            self.listener.stopListening()
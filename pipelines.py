@@ -5,7 +5,468 @@
 # Don't forget to add your pipeline to the ITEM_PIPELINES setting
 # See: http://doc.scrapy.org/en/latest/topics/item-pipeline.html
 
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+from queue import Queue
+from time import perf_counter, strftime, time
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from twisted.internet import defer, task
+
+from itunesbot.items import AppItem, toBool, toCount, toFloat, toInt, toMegabytes
+from itunesbot.spiders.schema import appGeoAndId
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+try:
+    import pandas as pd
+except ImportError:
+    pd = None
+
+logger = logging.getLogger(__name__)
+
 
 class ItunesbotPipeline(object):
     def process_item(self, item, spider):
         return item
+
+
+def toString(val):
+    if val is None or isinstance(val, str):
+        return val
+    return json.dumps(val, ensure_ascii=False, sort_keys=True)
+
+
+def toColumn(val):
+    # SQLite keeps scalars as they are , lists and dicts go in as JSON
+    if val is None or isinstance(val, (str, int, float)):
+        return val
+    return toString(val)
+
+
+def toStringList(val):
+    if val is None:
+        return None
+    if isinstance(val, str):
+        return [val]
+    return [toString(v) for v in val]
+
+
+def toStringMap(val):
+    if not isinstance(val, dict):
+        return None
+    return [(str(k), toString(v)) for k, v in val.items()]
+
+
+def parquetColumns():
+    """
+    Typed columns of the Parquet export , every AppItem field without an
+    entry here is written as a string
+
+    :return: {field name : (arrow type , converter)}
+    """
+    category = pa.dictionary(pa.int32(), pa.string())
+    string_map = pa.map_(pa.string(), pa.string())
+    columns = {}
+    for name in ('app_rating_value_cv', 'app_rating_value_av', 'app_star_rating_cv', 'app_star_rating_av'):
+        columns[name] = (pa.float64(), toFloat)
+    for name in ('app_review_counts_cv', 'app_review_counts_av'):
+        columns[name] = (pa.int64(), toCount)
+    columns['app_age_rating'] = (pa.int64(), toInt)
+    columns['app_size'] = (pa.float64(), toMegabytes)
+    for name in ('is_paid', 'app_for_watch', 'has_inapp'):
+        columns[name] = (pa.bool_(), toBool)
+    # Few distinct values , dictionary encoded
+    for name in ('app_geo', 'app_country', 'app_category_name', 'app_category_id', 'app_crawl_status'):
+        columns[name] = (category, toString)
+    for name in ('supported_devices', 'app_supports'):
+        columns[name] = (pa.list_(pa.string()), toStringList)
+    for name in ('app_extras', 'more_apps_by_developer', 'similar_apps'):
+        columns[name] = (string_map, toStringMap)
+    return columns
+
+
+class ParquetExportPipeline(object):
+    """
+    Writes the AppItems to a Parquet file in row groups of PARQUET_EXPORT_BATCH
+    items. Full batches are handed to a writer thread through a queue of
+    PARQUET_EXPORT_QUEUE batches , so file I/O does not block the reactor
+    """
+
+    def __init__(self, path, batch_size=5000, queue_size=4, stats=None):
+        self.path = path
+        self.batch_size = batch_size
+        self.stats = stats
+        columns = parquetColumns()
+        self.fields = list(AppItem.fields)
+        self.converters = [columns.get(name, (pa.string(), toString))[1] for name in self.fields]
+        self.schema = pa.schema([pa.field(name, columns.get(name, (pa.string(),))[0]) for name in self.fields])
+        self.queue = Queue(queue_size)
+        self.batch = []
+        self.error = None
+        self.writer = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if pa is None:
+            raise NotConfigured('ParquetExportPipeline needs the pyarrow package')
+        settings = crawler.settings
+        path = settings.get('PARQUET_EXPORT_PATH', 'exports/%(name)s-%(time)s.parquet')
+        path = path % {'name': crawler.spidercls.name, 'time': strftime('%Y-%m-%dT%H-%M-%S')}
+        return cls(path, batch_size=settings.getint('PARQUET_EXPORT_BATCH', 5000),
+                   queue_size=settings.getint('PARQUET_EXPORT_QUEUE', 4), stats=crawler.stats)
+
+    def open_spider(self, spider):
+        if os.path.dirname(self.path) and not os.path.isdir(os.path.dirname(self.path)):
+            os.makedirs(os.path.dirname(self.path))
+        self.writer = threading.Thread(target=self.writeBatches, name='parquet-writer', daemon=True)
+        self.writer.start()
+
+    def process_item(self, item, spider):
+        self.batch.append(item)
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+        return item
+
+    def close_spider(self, spider):
+        self.flush()
+        self.queue.put(None)
+        self.writer.join()
+        if self.error is not None:
+            raise self.error
+        logger.info('Exported items to %(path)s', {'path': self.path}, extra={'spider': spider})
+
+    def flush(self):
+        if self.error is not None:
+            raise self.error
+        if self.batch:
+            # Blocks only when the writer is PARQUET_EXPORT_QUEUE batches behind
+            self.queue.put(self.batch)
+            self.batch = []
+
+    def toTable(self, items):
+        arrays = []
+        for name, convert, field in zip(self.fields, self.converters, self.schema):
+            arrays.append(pa.array([convert(item.get(name)) for item in items], type=field.type))
+        return pa.Table.from_arrays(arrays, schema=self.schema)
+
+    def writeBatches(self):
+        # Runs on the writer thread , one row group per batch
+        writer = None
+        try:
+            while True:
+                items = self.queue.get()
+                if items is None:
+                    break
+                table = self.toTable(items)
+                if writer is None:
+                    writer = pq.ParquetWriter(self.path, self.schema, compression='zstd')
+                writer.write_table(table, row_group_size=len(items))
+                if self.stats is not None:
+                    self.stats.inc_value('parquet/items', len(items))
+                    self.stats.inc_value('parquet/row_groups')
+        except Exception as e:
+            logger.exception('Parquet export to %s failed', self.path)
+            self.error = e
+            # Keep taking batches so the reactor thread is never left blocked on a full queue
+            while self.queue.get() is not None:
+                pass
+        finally:
+            if writer is not None:
+                writer.close()
+
+
+class SqliteUpsertPipeline(ItunesbotPipeline):
+    """
+    Keeps the latest state of every App in a SQLite table , one row per
+    (app_geo , app_num). Items are upserted with executemany , one transaction
+    per DB_PIPELINE_BATCH items or every DB_PIPELINE_INTERVAL seconds ,
+    whichever comes first. Fields an item does not have ( the 'unchanged' and
+    'fail' records ) keep their stored value
+    """
+
+    def __init__(self, path, batch_size=500, interval=5.0, stats=None):
+        self.path = path
+        self.batch_size = batch_size
+        self.interval = interval
+        self.stats = stats
+        self.fields = [name for name in AppItem.fields if name not in ('app_geo', 'app_num')]
+        self.batch = []
+        self.conn = None
+        self.timer = None
+        self.rows = 0
+        self.write_time = 0.0
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        pipeline = cls(settings.get('DB_PIPELINE_PATH', 'apps.sqlite'),
+                       batch_size=settings.getint('DB_PIPELINE_BATCH', 500),
+                       interval=settings.getfloat('DB_PIPELINE_INTERVAL', 5.0), stats=crawler.stats)
+        crawler.signals.connect(pipeline.spiderClosed, signal=signals.spider_closed)
+        return pipeline
+
+    def open_spider(self, spider):
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        columns = ', '.join(self.fields)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS apps (app_geo TEXT NOT NULL, app_num TEXT NOT NULL, '
+                          '{}, crawled_at REAL NOT NULL, PRIMARY KEY (app_geo, app_num))'.format(columns))
+        # Fields added to AppItem since the table was created
+        known = set(row[1] for row in self.conn.execute('PRAGMA table_info(apps)'))
+        for name in self.fields:
+            if name not in known:
+                self.conn.execute('ALTER TABLE apps ADD COLUMN {}'.format(name))
+        self.conn.commit()
+
+        names = ['app_geo', 'app_num'] + self.fields + ['crawled_at']
+        updates = ', '.join('{0} = COALESCE(excluded.{0}, apps.{0})'.format(name) for name in self.fields)
+        self.upsert = ('INSERT INTO apps ({}) VALUES ({}) ON CONFLICT (app_geo, app_num) DO UPDATE SET {}, '
+                       'crawled_at = excluded.crawled_at').format(', '.join(names), ', '.join('?' * len(names)),
+                                                                  updates)
+        self.timer = task.LoopingCall(self.flush)
+        self.timer.start(self.interval, now=False)
+
+    def process_item(self, item, spider):
+        geo, app_num = item.get('app_geo'), item.get('app_num')
+        if not (geo and app_num) and item.get('app_url'):
+            geo, app_num = appGeoAndId(item['app_url'])
+        if not (geo and app_num):
+            self.incStat('db/skipped')
+            return item
+        self.batch.append((geo, app_num) + tuple(toColumn(item.get(name)) for name in self.fields) + (time(),))
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+        return item
+
+    def flush(self):
+        if not self.batch:
+            return
+        rows, self.batch = self.batch, []
+        start = perf_counter()
+        with self.conn:
+            self.conn.executemany(self.upsert, rows)
+        self.write_time += perf_counter() - start
+        self.rows += len(rows)
+        self.incStat('db/rows', len(rows))
+        self.incStat('db/transactions')
+        if self.stats is not None and self.write_time:
+            self.stats.set_value('db/rows_per_sec', round(self.rows / self.write_time, 1))
+
+    def spiderClosed(self, spider):
+        if self.timer is not None and self.timer.running:
+            self.timer.stop()
+        if self.conn is not None:
+            self.flush()
+            self.conn.close()
+            self.conn = None
+
+    def incStat(self, key, count=1):
+        if self.stats is not None:
+            self.stats.inc_value(key, count)
+
+
+#Placeholders the parsers put in for a value the page does not show
+missing_values = ('', 'Not Found', 'Not found', 'not sufficent ratings', 'na', 'nil')
+#Multipliers of the count suffixes , '1.2K Ratings'
+count_units = {'': 1, 'K': 1000, 'M': 1000000}
+#Multipliers to MB of the size units
+size_units = {'KB': 1 / 1024.0, 'MB': 1.0, 'GB': 1024.0}
+
+
+def textColumn(values):
+    # Column of strings , the placeholders and None as NA
+    column = pd.Series(values, dtype=object)
+    column = column.where(~column.isin(missing_values))
+    return column.astype('string')
+
+
+def numberColumn(parts, units):
+    """
+    :param parts: Frame of the number ( with , separators ) and its unit
+    :param units: {unit : multiplier}
+    :return: Float column , NA where there was no number
+    """
+    number = pd.to_numeric(parts[0].str.replace(',', '', regex=False), errors='coerce')
+    return number * parts[1].fillna('').str.upper().map(units).astype('float64')
+
+
+def countColumn(values):
+    # '63434' , '1,234 Ratings' , '1.2K Ratings' or an int
+    parts = textColumn(values).str.extract(r'([\d.,]*\d)\s*([KkMm]?)\b')
+    return numberColumn(parts, count_units).round()
+
+
+def sizeColumn(values):
+    # '123.4 MB' , '1.2 GB' , a number is taken as MB already
+    text = textColumn(values)
+    parts = text.str.extract(r'([\d.,]*\d)\s*([KMG]B)', flags=re.I)
+    return numberColumn(parts, size_units).fillna(pd.to_numeric(text, errors='coerce'))
+
+
+def ratingLabelColumns(values):
+    # '4.5 stars, 1.2K Ratings' , the aria-label of the rating blocks , gives the rating and the count
+    parts = textColumn(values).str.extract(r'([\d.]+) stars?,\s*([\d.,]*\d)\s*([KkMm]?) Ratings?')
+    return pd.to_numeric(parts[0], errors='coerce'), numberColumn(parts[[1, 2]].set_axis([0, 1], axis=1),
+                                                                  count_units).round()
+
+
+def averageColumn(values):
+    # '3.4 out of 5'
+    return pd.to_numeric(textColumn(values).str.extract(r'([\d.]+) out of 5')[0], errors='coerce')
+
+
+def ageColumn(values):
+    # 'Rated 12+' or '12+'
+    return pd.to_numeric(textColumn(values).str.extract(r'(\d+)\+')[0], errors='coerce')
+
+
+def normalizeItems(items):
+    """
+    Typed values for the fields the parsers leave as text , a whole batch at a time
+
+    :param items: AppItems , changed in place
+    :return: {field name : number of values that could not be read}
+    """
+    def column(name):
+        return [item.get(name) for item in items]
+
+    rating_av, count_av = ratingLabelColumns(column('app_rating_av'))
+    rating_cv, count_cv = ratingLabelColumns(column('app_rating_cv'))
+    # The new layout shows the average as '3.4 out of 5' in app_content_rating
+    content = column('app_content_rating')
+    outputs = {
+        'app_size': (column('app_size'), sizeColumn(column('app_size'))),
+        'app_review_counts_av': (column('app_review_counts_av'),
+                                 countColumn(column('app_review_counts_av')).fillna(count_av)),
+        'app_review_counts_cv': (column('app_review_counts_cv'),
+                                 countColumn(column('app_review_counts_cv')).fillna(count_cv)),
+        'app_rating_value_av': (column('app_rating_value_av'),
+                                pd.to_numeric(textColumn(column('app_rating_value_av')), errors='coerce')
+                                .fillna(rating_av).fillna(averageColumn(content))),
+        'app_rating_value_cv': (column('app_rating_value_cv'),
+                                pd.to_numeric(textColumn(column('app_rating_value_cv')), errors='coerce')
+                                .fillna(rating_cv)),
+        # The old layout has the Age Rating in app_content_rating
+        'app_age_rating': (column('app_rating'), ageColumn(column('app_rating')).fillna(ageColumn(content))),
+    }
+    outputs['app_star_rating_av'] = (column('app_star_rating_av'), outputs['app_rating_value_av'][1])
+    outputs['app_star_rating_cv'] = (column('app_star_rating_cv'), outputs['app_rating_value_cv'][1])
+
+    errors = {}
+    for name, (raw, values) in outputs.items():
+        # A value the field had that gave no number
+        given = textColumn(raw).notna()
+        errors[name] = int((given & values.isna()).sum())
+        as_int = name in ('app_review_counts_av', 'app_review_counts_cv', 'app_age_rating')
+        values = values.astype('Int64' if as_int else 'Float64')
+        present = values.notna().to_numpy()
+        values = values.astype(object).to_numpy()
+        for i, item in enumerate(items):
+            if present[i]:
+                item[name] = int(values[i]) if as_int else float(values[i])
+            elif name in item and name != 'app_age_rating':
+                item[name] = None
+    return errors
+
+
+class NormalizePipeline(object):
+    """
+    Turns the sizes , counts and ratings the parsers extract as text into
+    numbers with pandas , NORMALIZE_BATCH items at a time or every
+    NORMALIZE_INTERVAL seconds. An item waits for its batch before it goes
+    on to the next pipelines , values that can not be read are set to None
+    and counted in normalize/errors/<field>.
+    Scrapy only lets go of a response once its items are through the
+    pipelines , so the responses of a waiting batch count against
+    SCRAPER_SLOT_MAX_ACTIVE_SIZE and the engine stops downloading when they
+    fill it. A batch is therefore also flushed once the responses it holds ,
+    estimated from the mean size of the responses received , reach
+    NORMALIZE_MAX_HELD_SIZE , 3/4 of SCRAPER_SLOT_MAX_ACTIVE_SIZE if not set.
+    With large pages that comes well before NORMALIZE_BATCH
+    """
+
+    def __init__(self, batch_size=500, interval=1.0, max_held_size=3750000, stats=None):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_held_size = max_held_size
+        self.stats = stats
+        self.batch = []
+        self.timer = None
+        #Responses received and their total size , for the mean response size
+        self.responses = 0
+        self.response_bytes = 0
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if pd is None:
+            raise NotConfigured('NormalizePipeline needs the numpy and pandas packages')
+        settings = crawler.settings
+        max_held_size = settings.getint('NORMALIZE_MAX_HELD_SIZE') or \
+            settings.getint('SCRAPER_SLOT_MAX_ACTIVE_SIZE', 5000000) * 3 // 4
+        pipeline = cls(batch_size=settings.getint('NORMALIZE_BATCH', 500),
+                       interval=settings.getfloat('NORMALIZE_INTERVAL', 1.0), max_held_size=max_held_size,
+                       stats=crawler.stats)
+        crawler.signals.connect(pipeline.responseReceived, signal=signals.response_received)
+        return pipeline
+
+    def open_spider(self, spider):
+        self.timer = task.LoopingCall(self.flush)
+        self.timer.start(self.interval, now=False)
+
+    def responseReceived(self, response, request, spider):
+        # The scraper counts a response as at least 1 KB
+        self.responses += 1
+        self.response_bytes += max(len(response.body), 1024)
+
+    def heldSize(self):
+        # Estimated size of the responses the waiting items keep in the scraper
+        if not self.responses:
+            return 0
+        return len(self.batch) * self.response_bytes // self.responses
+
+    def process_item(self, item, spider):
+        d = defer.Deferred()
+        self.batch.append((item, d))
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+        elif self.heldSize() >= self.max_held_size:
+            self.incStat('normalize/size_flushes')
+            self.flush()
+        return d
+
+    def flush(self):
+        if not self.batch:
+            return
+        batch, self.batch = self.batch, []
+        try:
+            errors = normalizeItems([item for item, d in batch])
+        except Exception:
+            # The items go on as they are rather than being lost
+            logger.exception('Normalizing {} items failed'.format(len(batch)))
+            self.incStat('normalize/batch_errors')
+            errors = {}
+        self.incStat('normalize/items', len(batch))
+        self.incStat('normalize/batches')
+        for name, count in errors.items():
+            self.incStat('normalize/errors/{}'.format(name), count)
+        for item, d in batch:
+            d.callback(item)
+
+    def close_spider(self, spider):
+        if self.timer is not None and self.timer.running:
+            self.timer.stop()
+        self.flush()
+
+    def incStat(self, key, count=1):
+        if self.stats is not None and count:
+            self.stats.inc_value(key, count)
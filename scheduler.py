@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+# Deadline aware scheduler
+#
+# The requests come out of the scheduler by priority , and with
+# APP_PRIORITY_ENABLED the App requests carry a score for popularity and
+# staleness ( see spiders/priority.py ). With CRAWL_DEADLINE set , a local
+# time like '06:00' or a date and time like '2018-01-31T06:00' , requests
+# below CRAWL_DEADLINE_MIN_PRIORITY are no longer started in the last
+# CRAWL_DEADLINE_MARGIN seconds and the crawl is closed at the deadline ,
+# the requests under way are left to finish. Without APP_PRIORITY_ENABLED
+# every request has priority 0 , so nothing is dropped in the margin and the
+# crawl only closes at the deadline.
+
+import logging
+from datetime import datetime, timedelta
+from time import time
+
+from scrapy.core.scheduler import Scheduler
+from twisted.internet import reactor
+
+logger = logging.getLogger(__name__)
+
+
+def parseDeadline(value, now=None):
+    """
+    :param value: 'HH:MM' , the next time the clock shows it , or an ISO date and time
+    :param now: datetime the 'HH:MM' form is taken from , the current time if not given
+    :return: Deadline as a timestamp
+    """
+    now = now or datetime.now()
+    if 'T' in value or '-' in value:
+        return datetime.fromisoformat(value).timestamp()
+    hour, minute = (int(part) for part in value.split(':'))
+    deadline = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if deadline <= now:
+        # A nightly window that ends after midnight
+        deadline += timedelta(days=1)
+    return deadline.timestamp()
+
+
+class DeadlineScheduler(Scheduler):
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        scheduler = super(DeadlineScheduler, cls).from_crawler(crawler)
+        settings = crawler.settings
+        deadline = settings.get('CRAWL_DEADLINE')
+        scheduler.deadline = parseDeadline(deadline) if deadline else None
+        scheduler.margin = settings.getfloat('CRAWL_DEADLINE_MARGIN', 1800.0)
+        scheduler.min_priority = settings.getint('CRAWL_DEADLINE_MIN_PRIORITY', 50)
+        if scheduler.deadline is not None and not settings.getbool('APP_PRIORITY_ENABLED'):
+            # The requests are not ranked , dropping them on priority would drop all of them
+            logger.warning('CRAWL_DEADLINE is set without APP_PRIORITY_ENABLED , '
+                           'no request is dropped before the deadline')
+            scheduler.margin = 0.0
+        scheduler.deadline_timer = None
+        return scheduler
+
+    def open(self, spider):
+        if self.deadline is not None:
+            logger.info('Crawl deadline {:%Y-%m-%d %H:%M} , low priority requests stop {} seconds before'.format(
+                datetime.fromtimestamp(self.deadline), int(self.margin)))
+            self.deadline_timer = reactor.callLater(max(0.0, self.deadline - time()), self.deadlineReached)
+        return super(DeadlineScheduler, self).open(spider)
+
+    def close(self, reason):
+        if self.deadline_timer is not None and self.deadline_timer.active():
+            self.deadline_timer.cancel()
+        return super(DeadlineScheduler, self).close(reason)
+
+    def lowValue(self, request):
+        # Inside the margin only the requests that rank high enough are started
+        return self.deadline is not None and request.priority < self.min_priority \
+            and time() >= self.deadline - self.margin
+
+    def enqueue_request(self, request):
+        if self.lowValue(request):
+            self.stats.inc_value('scheduler/deadline_dropped', spider=self.spider)
+            return False
+        return super(DeadlineScheduler, self).enqueue_request(request)
+
+    def next_request(self):
+        while True:
+            request = super(DeadlineScheduler, self).next_request()
+            if request is None or not self.lowValue(request):
+                return request
+            self.stats.inc_value('scheduler/deadline_dropped', spider=self.spider)
+
+    def deadlineReached(self):
+        logger.info('Crawl deadline reached , {} requests left in the queue'.format(len(self)))
+        self.stats.set_value('scheduler/deadline_left', len(self), spider=self.spider)
+        self.crawler.engine.close_spider(self.spider, 'deadline')
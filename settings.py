@@ -13,6 +13,7 @@ BOT_NAME = 'argos_itunes'
 
 SPIDER_MODULES = ['itunesbot.spiders']
 NEWSPIDER_MODULE = 'itunesbot.spiders'
+COMMANDS_MODULE = 'itunesbot.commands'
 
 
 # Crawl responsibly by identifying yourself (and your website) on the user-agent
@@ -22,6 +23,98 @@ USER_AGENT = 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Ge
 # Obey robots.txt rules
 ROBOTSTXT_OBEY = True
 
+# iTunes Lookup API used when the spider runs with -a mode=lookup
+ITUNES_LOOKUP_URL = 'https://itunes.apple.com/lookup'
+# App Ids sent in one lookup request , the API accepts up to 200
+ITUNES_LOOKUP_BATCH = 200
+# A full lookup batch needs longer urls than the default limit of 2083
+URLLENGTH_LIMIT = 4096
+
+# The listing pages of a letter are all requested at once , the page count
+# comes from the pagination links of the first page or from the last crawl
+# when PAGINATION_STATE_FILE is set. The last planned page , if it still
+# lists Apps , requests PAGINATION_PROBE more
+#PAGINATION_STATE_FILE = 'pagecounts.json'
+#PAGINATION_PROBE = 3
+
+# Rank the App requests , Apps on the popular genre page , with many ratings
+# in the last crawl or not crawled for long go first. The last crawl of every
+# App is kept in APP_PRIORITY_STATE_FILE
+APP_PRIORITY_ENABLED = False
+APP_PRIORITY_STATE_FILE = 'priority.sqlite'
+#APP_PRIORITY_POPULAR = 100
+#APP_PRIORITY_STALE_DAYS = 30
+#APP_PRIORITY_LISTING = 1000
+
+# Crawl deadline , a local time like '06:00' or a date and time. In the last
+# CRAWL_DEADLINE_MARGIN seconds only requests with a priority of at least
+# CRAWL_DEADLINE_MIN_PRIORITY are started , at the deadline the crawl closes.
+# The priorities come from APP_PRIORITY_ENABLED , without it nothing is
+# dropped in the margin
+SCHEDULER = 'itunesbot.scheduler.DeadlineScheduler'
+#CRAWL_DEADLINE = '06:00'
+#CRAWL_DEADLINE_MARGIN = 1800
+#CRAWL_DEADLINE_MIN_PRIORITY = 50
+
+# Storefront fan-out ( -a storefronts=all or -a storefronts=gb,de,fr ) , each
+# storefront is a download slot of STOREFRONT_CONCURRENCY requests at a time ,
+# STOREFRONT_BUDGETS gives other budgets to some of them , like {'cn': 1}
+#STOREFRONT_CONCURRENCY = 2
+#STOREFRONT_BUDGETS = {}
+
+# Apps are requested once per run , keyed on storefront and App Id
+APPID_DEDUP_ENABLED = True
+# Keep the App Ids crawled in this directory so later runs ( the other
+# start_letter/end_letter batches ) skip them. The files are kept per job ,
+# APPID_DEDUP_JOB or the name of JOBDIR , and files older than APPID_DEDUP_TTL
+# seconds ( 0 keeps them for good ) are ignored , so the next crawl of the
+# same Apps is not skipped
+#APPID_DEDUP_DIR = 'appids'
+#APPID_DEDUP_JOB = 'crawl-2017-12-06'
+#APPID_DEDUP_TTL = 43200
+# Persist a Bloom filter instead of the exact App Id set
+#APPID_DEDUP_BLOOM = False
+#APPID_DEDUP_BLOOM_CAPACITY = 5000000
+#APPID_DEDUP_BLOOM_ERROR = 0.001
+
+# Incremental recrawl , Apps crawled before are requested with If-None-Match /
+# If-Modified-Since and come out as 'unchanged' records when they did not change
+INCREMENTAL_ENABLED = False
+INCREMENTAL_STATE_FILE = 'incremental.sqlite'
+
+# Deferred retry queue , Apps whose page answered one of RETRY_QUEUE_CODES are
+# kept in RETRY_QUEUE_FILE and sent again after a backoff doubling from
+# RETRY_QUEUE_BASE_SECS up to RETRY_QUEUE_MAX_SECS , with jitter. The crawl
+# stays open for the Apps due within RETRY_QUEUE_MAX_WAIT , the later ones go
+# out at the start of the next crawl. -a retry_only=1 crawls only the queue
+RETRY_QUEUE_ENABLED = False
+RETRY_QUEUE_FILE = 'retryqueue.sqlite'
+#RETRY_QUEUE_CODES = [403, 429, 500, 502, 503, 504]
+#RETRY_QUEUE_BASE_SECS = 60.0
+#RETRY_QUEUE_MAX_SECS = 3600.0
+#RETRY_QUEUE_MAX_ATTEMPTS = 5
+#RETRY_QUEUE_MAX_WAIT = 600.0
+#RETRY_QUEUE_POLL_SECS = 30.0
+
+# Parse the App Detail Pages in this many worker processes instead of on the
+# reactor thread , 0 parses them in the crawl process. At most PARSE_POOL_QUEUE
+# pages ( twice the workers by default ) are handed to the pool at a time
+#PARSE_POOL_WORKERS = 0
+#PARSE_POOL_QUEUE = 0
+
+# Distributed mode , all the spider processes opening the same frontier share
+# the listing pages and Apps to crawl ( instead of start_letter/end_letter
+# ranges ) and a request leased by a process that dies goes to the others
+# after FRONTIER_LEASE_SECS. FRONTIER_BACKEND takes the class of the shared store
+FRONTIER_ENABLED = False
+#FRONTIER_BACKEND = 'itunesbot.spiders.frontier.SqliteFrontier'
+#FRONTIER_PATH = 'frontier.sqlite'
+# Requests leased and crawled at a time , CONCURRENT_REQUESTS by default
+#FRONTIER_PREFETCH = 32
+#FRONTIER_LEASE_SECS = 300
+#FRONTIER_MAX_ATTEMPTS = 3
+#FRONTIER_POLL_SECS = 1.0
+
 # Configure maximum concurrent requests performed by Scrapy (default: 16)
 CONCURRENT_REQUESTS = 32
 
@@ -47,15 +140,37 @@ CONCURRENT_REQUESTS_PER_DOMAIN = 16
 
 # Enable or disable spider middlewares
 # See http://scrapy.readthedocs.org/en/latest/topics/spider-middleware.html
-#SPIDER_MIDDLEWARES = {
+SPIDER_MIDDLEWARES = {
 #    'itunesbot.middlewares.ItunesbotSpiderMiddleware': 543,
-#}
+    'itunesbot.middlewares.FrontierMiddleware': 45,
+    'itunesbot.middlewares.CompactItemMiddleware': 950,
+    # Ahead of the compact items , trims the items to the fields= spider argument
+    'itunesbot.middlewares.FieldProjectionMiddleware': 960,
+    # Last before the callbacks , for the wait between download and callback
+    'itunesbot.middlewares.TimingMiddleware': 990,
+}
+
+# Time the spider callbacks and the wait of the responses between download
+# and callback in histograms , written to the crawl stats ( timing/... ) and ,
+# with TIMING_PROMETHEUS_PORT , served at http://127.0.0.1:<port>/metrics.
+# TIMING_FIELD_GROUPS also times the field groups of the detail pages
+# ( information list , ratings , related apps , supports )
+TIMING_ENABLED = False
+#TIMING_FIELD_GROUPS = False
+#TIMING_PROMETHEUS_PORT = 9410
+#TIMING_BUCKETS = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+
+# Hand the items on as CompactAppItems , with typed fields and interned
+# strings in slots , to keep the memory of the items in flight down
+COMPACT_ITEMS_ENABLED = False
 
 # Enable or disable downloader middlewares
 # See http://scrapy.readthedocs.org/en/latest/topics/downloader-middleware.html
-#DOWNLOADER_MIDDLEWARES = {
-#    'itunesbot.middlewares.MyCustomDownloaderMiddleware': 543,
-#}
+DOWNLOADER_MIDDLEWARES = {
+    'itunesbot.middlewares.IncrementalRecrawlMiddleware': 543,
+    # Ahead of RetryMiddleware so the bans are seen before they are retried
+    'itunesbot.middlewares.BanThrottleMiddleware': 580,
+}
 
 # Enable or disable extensions
 # See http://scrapy.readthedocs.org/en/latest/topics/extensions.html
@@ -66,9 +181,51 @@ CONCURRENT_REQUESTS_PER_DOMAIN = 16
 # Configure item pipelines
 # See http://scrapy.readthedocs.org/en/latest/topics/item-pipeline.html
 #ITEM_PIPELINES = {
+#    'itunesbot.pipelines.NormalizePipeline': 200,
 #    'itunesbot.pipelines.ItunesbotPipeline': 300,
+#    'itunesbot.pipelines.ParquetExportPipeline': 800,
+#    'itunesbot.pipelines.SqliteUpsertPipeline': 900,
 #}
 
+# NormalizePipeline turns sizes , rating counts like '1.2K Ratings' and the
+# rating labels into numbers with pandas , NORMALIZE_BATCH items at a time or
+# every NORMALIZE_INTERVAL seconds , ahead of the storage pipelines. Needs the
+# numpy and pandas packages. Without it the review counts stay as the pages
+# show them , like '1,234 Ratings'. A batch holds its responses in the
+# scraper , it is flushed early when they reach NORMALIZE_MAX_HELD_SIZE bytes ,
+# 3/4 of SCRAPER_SLOT_MAX_ACTIVE_SIZE by default
+#NORMALIZE_BATCH = 500
+#NORMALIZE_INTERVAL = 1.0
+#NORMALIZE_MAX_HELD_SIZE = 3750000
+
+# Latest state of every App ( SqliteUpsertPipeline ) , upserted on storefront
+# and App Id in one transaction per DB_PIPELINE_BATCH items or every
+# DB_PIPELINE_INTERVAL seconds
+#DB_PIPELINE_PATH = 'apps.sqlite'
+#DB_PIPELINE_BATCH = 500
+#DB_PIPELINE_INTERVAL = 5.0
+
+# Parquet export ( ParquetExportPipeline , needs the pyarrow package ) ,
+# %(name)s is the spider name and %(time)s the start time of the crawl
+#PARQUET_EXPORT_PATH = 'exports/%(name)s-%(time)s.parquet'
+# Items per row group , and row groups waiting for the writer thread
+#PARQUET_EXPORT_BATCH = 5000
+#PARQUET_EXPORT_QUEUE = 4
+
+# Back off on bans , a 403 / 429 / 503 halves the concurrency and doubles the
+# delay of its download slot , good responses bring them back step by step
+# and a Retry-After pauses the slot. Works next to AutoThrottle , which only
+# looks at latency
+BANTHROTTLE_ENABLED = False
+#BANTHROTTLE_CODES = [403, 429, 503]
+#BANTHROTTLE_DECREASE = 0.5
+#BANTHROTTLE_INCREASE_EVERY = 20
+#BANTHROTTLE_MIN_CONCURRENCY = 1
+#BANTHROTTLE_DELAY_STEP = 0.01
+#BANTHROTTLE_MIN_BACKOFF = 0.05
+#BANTHROTTLE_MAX_DELAY = 60.0
+#BANTHROTTLE_MAX_RETRY_AFTER = 600.0
+
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See http://doc.scrapy.org/en/latest/topics/autothrottle.html
 AUTOTHROTTLE_ENABLED = True
@@ -88,4 +245,18 @@ HTTPCACHE_ENABLED = True
 #HTTPCACHE_EXPIRATION_SECS = 0
 HTTPCACHE_DIR = 'httpcache'
 #HTTPCACHE_IGNORE_HTTP_CODES = []
-HTTPCACHE_STORAGE = 'scrapy.extensions.httpcache.FilesystemCacheStorage'
+HTTPCACHE_STORAGE = 'itunesbot.httpcache.SqliteCacheStorage'
+# Responses written to the SQLite cache per transaction
+HTTPCACHE_SQLITE_BATCH = 100
+# Evict the oldest responses once the cached bodies pass this many bytes ,
+# and the responses older than this many seconds , 0 for no limit. Run
+# scrapy compactcache to give the space back to the disk
+#HTTPCACHE_SQLITE_MAX_SIZE = 0
+#HTTPCACHE_SQLITE_MAX_AGE = 0
+# Cached bodies are stored once per content and compressed with zstd ( needs
+# the zstandard package ) , with a dictionary trained on the first
+# HTTPCACHE_ZSTD_TRAIN_SAMPLES pages cached
+HTTPCACHE_ZSTD_ENABLED = True
+#HTTPCACHE_ZSTD_LEVEL = 3
+#HTTPCACHE_ZSTD_DICT_SIZE = 112640
+#HTTPCACHE_ZSTD_TRAIN_SAMPLES = 200
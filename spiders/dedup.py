@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+
+# App Id dedup for the crawl frontier
+#
+# The same App is linked from many letter pages , popular lists and
+# pagination pages under url variants the request fingerprint sees as
+# different. Apps are deduplicated on their numeric App Id per storefront ,
+# kept in a sorted array of 64 bit ints ( or a Bloom filter ) and , when
+# APPID_DEDUP_DIR is set , persisted so the next letter batch of the same
+# crawl skips them. The files are kept per job , APPID_DEDUP_JOB or the name
+# of JOBDIR , and a file older than APPID_DEDUP_TTL seconds is ignored , so
+# a later crawl ( the daily recrawl , an incremental run ) starts afresh.
+
+import math
+import os
+import struct
+from array import array
+from bisect import bisect_left
+from time import time
+
+MASK64 = (1 << 64) - 1
+
+
+class AppIdSet(object):
+    """
+    Compact set of App Ids , a sorted array of 64 bit ints plus a small set
+    of recent additions that is merged into the array in batches
+    """
+
+    def __init__(self, ids=()):
+        self.ids = array('Q', sorted(set(ids)))
+        self.recent = set()
+
+    def __contains__(self, app_id):
+        if app_id in self.recent:
+            return True
+        i = bisect_left(self.ids, app_id)
+        return i < len(self.ids) and self.ids[i] == app_id
+
+    def __len__(self):
+        return len(self.ids) + len(self.recent)
+
+    def __iter__(self):
+        self.merge()
+        return iter(self.ids)
+
+    def add(self, app_id):
+        # Returns False when the App Id was already in the set
+        if app_id in self:
+            return False
+        self.recent.add(app_id)
+        if len(self.recent) >= max(1024, len(self.ids) // 16):
+            self.merge()
+        return True
+
+    def update(self, other):
+        for app_id in other:
+            self.add(app_id)
+        self.merge()
+
+    def merge(self):
+        # Linear merge of the sorted recent App Ids into the array , the runs
+        # of the array between them are copied as slices , not as Python ints
+        if not self.recent:
+            return
+        ids = self.ids
+        merged = array('Q')
+        start = 0
+        for app_id in sorted(self.recent):
+            end = bisect_left(ids, app_id, start)
+            merged.extend(ids[start:end])
+            merged.append(app_id)
+            start = end
+        merged.extend(ids[start:])
+        self.ids = merged
+        self.recent = set()
+
+    def save(self, path):
+        self.merge()
+        with open(path, 'wb') as f:
+            self.ids.tofile(f)
+
+    @classmethod
+    def load(cls, path):
+        appids = cls()
+        with open(path, 'rb') as f:
+            appids.ids.frombytes(f.read())
+        return appids
+
+
+def mix64(value):
+    # splitmix64 finalizer , spreads consecutive App Ids over the whole range
+    value = (value + 0x9E3779B97F4A7C15) & MASK64
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & MASK64
+    return value ^ (value >> 31)
+
+
+class BloomFilter(object):
+    """
+    Bloom filter over App Ids , for frontiers too large to keep exactly.
+    A false positive means a new App is taken as already crawled , at the
+    given error rate
+
+    :param capacity: Number of App Ids the filter is sized for
+    :param error_rate: False positive rate at capacity
+    """
+
+    header = struct.Struct('<QI')
+
+    def __init__(self, capacity=5000000, error_rate=0.001, bits=None, hashes=None):
+        if bits is None:
+            bits = int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+            hashes = max(1, int(round(bits / float(capacity) * math.log(2))))
+        self.bits = bits
+        self.hashes = hashes
+        self.data = bytearray((bits + 7) // 8)
+
+    def positions(self, app_id):
+        h1 = mix64(app_id)
+        h2 = mix64(h1) | 1
+        for i in range(self.hashes):
+            yield ((h1 + i * h2) & MASK64) % self.bits
+
+    def __contains__(self, app_id):
+        data = self.data
+        return all(data[pos >> 3] & (1 << (pos & 7)) for pos in self.positions(app_id))
+
+    def add(self, app_id):
+        # Returns False when all the bits were already set
+        added = False
+        for pos in self.positions(app_id):
+            if not self.data[pos >> 3] & (1 << (pos & 7)):
+                self.data[pos >> 3] |= 1 << (pos & 7)
+                added = True
+        return added
+
+    def update(self, other):
+        if isinstance(other, BloomFilter):
+            if (other.bits, other.hashes) != (self.bits, self.hashes):
+                raise ValueError('Bloom filters of different sizes can not be merged')
+            self.data = bytearray(a | b for a, b in zip(self.data, other.data))
+        else:
+            for app_id in other:
+                self.add(app_id)
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            f.write(self.header.pack(self.bits, self.hashes))
+            f.write(self.data)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            bits, hashes = cls.header.unpack(f.read(cls.header.size))
+            bloom = cls(bits=bits, hashes=hashes)
+            bloom.data = bytearray(f.read())
+        return bloom
+
+
+class AppIdFilter(object):
+    """
+    Per storefront App Id dedup.
+    Apps requested in this run are never requested again , Apps scraped
+    successfully are added to the persisted set when the spider closes
+
+    :param path: Directory holding one file per storefront , nothing is persisted if None
+    :param bloom: Persist a Bloom filter instead of the exact App Id set
+    :param capacity: Bloom filter capacity
+    :param error_rate: Bloom filter false positive rate
+    :param ttl: Seconds after which a persisted file is ignored , 0 to keep it for good
+    """
+
+    def __init__(self, path=None, bloom=False, capacity=5000000, error_rate=0.001, ttl=0):
+        self.path = path
+        self.bloom = bloom
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.ttl = ttl
+        self.known = {}
+        self.requested = {}
+        self.completed = {}
+
+    @classmethod
+    def fromSettings(cls, settings):
+        path = settings.get('APPID_DEDUP_DIR')
+        if path:
+            # One directory per job , the letter batches of a crawl share it
+            job = settings.get('APPID_DEDUP_JOB') or \
+                (os.path.basename(os.path.normpath(settings['JOBDIR'])) if settings.get('JOBDIR') else None)
+            if job:
+                path = os.path.join(path, job)
+        return cls(path=path or None,
+                   bloom=settings.getbool('APPID_DEDUP_BLOOM'),
+                   capacity=settings.getint('APPID_DEDUP_BLOOM_CAPACITY', 5000000),
+                   error_rate=settings.getfloat('APPID_DEDUP_BLOOM_ERROR', 0.001),
+                   ttl=settings.getfloat('APPID_DEDUP_TTL', 43200))
+
+    def filePath(self, geo):
+        return os.path.join(self.path, '{}.{}'.format(geo, 'bloom' if self.bloom else 'ids'))
+
+    def emptySet(self):
+        if self.bloom:
+            return BloomFilter(self.capacity, self.error_rate)
+        return AppIdSet()
+
+    def loadSet(self, geo):
+        # A file written by an earlier crawl , past the ttl , is left out
+        path = self.filePath(geo) if self.path is not None else None
+        if path is not None and os.path.exists(path) and \
+                (not self.ttl or time() - os.path.getmtime(path) <= self.ttl):
+            if self.bloom:
+                return BloomFilter.load(path)
+            return AppIdSet.load(path)
+        return self.emptySet()
+
+    def isNew(self, geo, app_id):
+        """
+        :return: True the first time an App is seen , False if it was requested
+                 earlier in this run or crawled by an earlier run
+        """
+        app_id = int(app_id)
+        if geo not in self.known:
+            self.known[geo] = self.loadSet(geo)
+        if app_id in self.known[geo]:
+            return False
+        return self.requested.setdefault(geo, AppIdSet()).add(app_id)
+
+    def done(self, geo, app_id):
+        self.completed.setdefault(geo, AppIdSet()).add(int(app_id))
+
+    def save(self):
+        # Re read the file before writing , so batches running side by side
+        # keep each other's App Ids
+        if self.path is None:
+            return
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        for geo, completed in self.completed.items():
+            merged = self.loadSet(geo)
+            merged.update(completed)
+            tmp_path = self.filePath(geo) + '.tmp'
+            merged.save(tmp_path)
+            os.replace(tmp_path, self.filePath(geo))
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+
+# Shared crawl frontier for the distributed mode
+#
+# Instead of one process per start_letter/end_letter range , every spider
+# process pushes the listing page and App requests it finds into one shared
+# frontier and leases small batches back from it. A leased request is acked
+# once its callback has run. A lease that is not acked in time ( the
+# process died or stalled ) expires and the request goes to whichever
+# process asks next , so idle processes take over the backlog of slow ones.
+#
+# SqliteFrontier keeps the frontier in one SQLite file , enough for the
+# processes of one node and for tests. A store shared by several nodes
+# implements the same methods and is set with FRONTIER_BACKEND.
+
+import os
+import pickle
+import socket
+import sqlite3
+from time import time
+from urllib.parse import urlparse
+
+from itunesbot.spiders.schema import appGeoAndId
+
+PENDING, LEASED, DONE, FAILED = 0, 1, 2, 3
+
+
+def frontierKey(request, fingerprinter):
+    """
+    Dedup key of a request , App Detail Pages are keyed on storefront and App Id
+    so the url variants of an App are fetched once. A retry of the retry queue
+    ( meta frontier_retry ) gets a key of its own
+
+    :param request: Scrapy Request
+    :param fingerprinter: Request fingerprinter of the crawler
+    """
+    segments = urlparse(request.url).path.split('/')
+    if len(segments) > 2 and segments[2] == 'app':
+        geo, app_id = appGeoAndId(request.url)
+        if app_id is not None:
+            key = 'app/{}/{}'.format(geo, app_id)
+            retry = request.meta.get('frontier_retry')
+            return key if retry is None else '{}/retry/{}'.format(key, retry)
+    return fingerprinter.fingerprint(request).hex()
+
+
+def defaultWorkerId():
+    return '{}-{}'.format(socket.gethostname(), os.getpid())
+
+
+class SqliteFrontier(object):
+    """
+    Frontier in a SQLite file , shared by the processes that open the same file
+
+    :param path: SQLite file , created if missing
+    :param lease_secs: Seconds a leased request is kept for its worker
+    :param max_attempts: Leases after which a request is given up
+    """
+
+    def __init__(self, path, lease_secs=300, max_attempts=3):
+        self.lease_secs = lease_secs
+        self.max_attempts = max_attempts
+        # Transactions are opened by hand , a lease must select and update in one
+        self.conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS tasks ('
+                          'key TEXT PRIMARY KEY, priority INTEGER NOT NULL, request BLOB NOT NULL, '
+                          'state INTEGER NOT NULL, worker TEXT, lease_until REAL, attempts INTEGER NOT NULL)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS tasks_todo ON tasks (state, priority DESC)')
+
+    @classmethod
+    def fromSettings(cls, settings):
+        return cls(settings.get('FRONTIER_PATH', 'frontier.sqlite'),
+                   lease_secs=settings.getfloat('FRONTIER_LEASE_SECS', 300),
+                   max_attempts=settings.getint('FRONTIER_MAX_ATTEMPTS', 3))
+
+    def push(self, tasks):
+        """
+        Add requests , the ones whose key is already in the frontier are dropped
+
+        :param tasks: List of (key , priority , request dict)
+        :return: Number of requests added
+        """
+        added = 0
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            for key, priority, request in tasks:
+                added += self.conn.execute('INSERT OR IGNORE INTO tasks VALUES (?, ?, ?, ?, NULL, NULL, 0)',
+                                           (key, priority, pickle.dumps(request), PENDING)).rowcount
+            self.conn.execute('COMMIT')
+        except BaseException:
+            self.conn.execute('ROLLBACK')
+            raise
+        return added
+
+    def lease(self, worker, count):
+        """
+        Lease up to count requests , pending ones and the ones whose lease expired
+
+        :param worker: Id of the leasing process
+        :return: List of (key , request dict , True if taken over from another worker)
+        """
+        now = time()
+        leased = []
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            rows = self.conn.execute('SELECT key, request, state, attempts FROM tasks '
+                                     'WHERE state = ? OR (state = ? AND lease_until < ?) '
+                                     'ORDER BY state, priority DESC, rowid LIMIT ?',
+                                     (PENDING, LEASED, now, count)).fetchall()
+            for key, request, state, attempts in rows:
+                if attempts >= self.max_attempts:
+                    self.conn.execute('UPDATE tasks SET state = ?, worker = NULL WHERE key = ?', (FAILED, key))
+                    continue
+                self.conn.execute('UPDATE tasks SET state = ?, worker = ?, lease_until = ?, attempts = ? '
+                                  'WHERE key = ?', (LEASED, worker, now + self.lease_secs, attempts + 1, key))
+                leased.append((key, pickle.loads(request), state == LEASED))
+            self.conn.execute('COMMIT')
+        except BaseException:
+            self.conn.execute('ROLLBACK')
+            raise
+        return leased
+
+    def claim(self, key):
+        """
+        Take a key no worker took before , for dedup outside of the requests
+
+        :return: True if this worker got it
+        """
+        return self.conn.execute('INSERT OR IGNORE INTO tasks VALUES (?, 0, ?, ?, NULL, NULL, 0)',
+                                 (key, b'', DONE)).rowcount == 1
+
+    def ack(self, key):
+        self.conn.execute('UPDATE tasks SET state = ?, lease_until = NULL WHERE key = ?', (DONE, key))
+
+    def release(self, key):
+        # Back to pending for the next lease , given up after max_attempts
+        self.conn.execute('UPDATE tasks SET state = CASE WHEN attempts >= ? THEN ? ELSE ? END , '
+                          'worker = NULL, lease_until = NULL WHERE key = ? AND state = ?',
+                          (self.max_attempts, FAILED, PENDING, key, LEASED))
+
+    def fail(self, key):
+        self.conn.execute('UPDATE tasks SET state = ?, lease_until = NULL WHERE key = ?', (FAILED, key))
+
+    def finished(self):
+        # Nothing pending and nothing leased by any worker
+        return self.conn.execute('SELECT 1 FROM tasks WHERE state IN (?, ?) LIMIT 1',
+                                 (PENDING, LEASED)).fetchone() is None
+
+    def counts(self):
+        # {state : number of requests}
+        return dict(self.conn.execute('SELECT state, COUNT(*) FROM tasks GROUP BY state').fetchall())
+
+    def close(self):
+        self.conn.close()
+
+
+class FrontierAppIdFilter(object):
+    """
+    App Id dedup across all the workers of the frontier , in front of the
+    spider's own AppIdFilter. In lookup mode the Apps go out in batches built
+    by each worker , the App Ids are claimed in the frontier so that no two
+    workers put the same App in their batches
+
+    :param frontier: Shared frontier
+    :param inner: AppIdFilter of the spider or None
+    """
+
+    def __init__(self, frontier, inner=None):
+        self.frontier = frontier
+        self.inner = inner
+
+    def isNew(self, geo, app_id):
+        if self.inner is not None and not self.inner.isNew(geo, app_id):
+            return False
+        return self.frontier.claim('appid/{}/{}'.format(geo, app_id))
+
+    def done(self, geo, app_id):
+        if self.inner is not None:
+            self.inner.done(geo, app_id)
+
+    def save(self):
+        if self.inner is not None:
+            self.inner.save()
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+# State of the incremental recrawl
+#
+# For every App the ETag / Last-Modified validators of its detail page and
+# the last version and update date seen are kept in a SQLite file. The next
+# crawl sends conditional requests , and an App whose page answers 304 or
+# shows the same version is emitted as an 'unchanged' record without the
+# page being parsed.
+
+import re
+import sqlite3
+
+from itunesbot.items import AppItem
+from itunesbot.spiders.schema import squashSpaces
+
+#Pattern to get the version shown in the What's New section of the new layout
+pat_version = re.compile(rb'whats-new__latest__version[^>]*>([^<]*)<')
+
+
+def sniffVersion(body):
+    """
+    Version shown on a detail page , read from the raw bytes without a DOM
+
+    :param body: Raw page bytes
+    :return: The version or None if the page does not show one
+    """
+    match = pat_version.search(body)
+    if match is None:
+        return None
+    version = squashSpaces(match.group(1).decode('utf-8', 'replace'))
+    return version.split(' ')[-1] or None
+
+
+def unchangedItem(url, geo, app_num, known):
+    # Lightweight record for an App that did not change since the last crawl
+    appitem = AppItem()
+    appitem['app_url'] = url
+    appitem['app_geo'] = geo
+    appitem['app_num'] = app_num
+    appitem['app_version'] = known.get('app_version')
+    appitem['app_date_updated'] = known.get('app_date_updated')
+    appitem['app_crawl_status'] = 'unchanged'
+    return appitem
+
+
+class IncrementalState(object):
+    """
+    Per App validators and versions , keyed on storefront and App Id
+
+    :param path: SQLite file , created if missing
+    :param commit_every: Number of writes between commits
+    """
+
+    def __init__(self, path, commit_every=500):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS apps ('
+                          'geo TEXT NOT NULL, app_num TEXT NOT NULL, '
+                          'etag TEXT, last_modified TEXT, app_version TEXT, app_date_updated TEXT, '
+                          'PRIMARY KEY (geo, app_num))')
+        self.commit_every = commit_every
+        self.pending = 0
+
+    @classmethod
+    def fromSettings(cls, settings):
+        return cls(settings.get('INCREMENTAL_STATE_FILE', 'incremental.sqlite'))
+
+    def get(self, geo, app_num):
+        """
+        :return: dict of etag , last_modified , app_version and app_date_updated or None for a new App
+        """
+        row = self.conn.execute('SELECT etag, last_modified, app_version, app_date_updated FROM apps '
+                                'WHERE geo = ? AND app_num = ?', (geo, app_num)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(('etag', 'last_modified', 'app_version', 'app_date_updated'), row))
+
+    def recordValidators(self, geo, app_num, etag, last_modified):
+        self.write('INSERT INTO apps (geo, app_num, etag, last_modified) VALUES (?, ?, ?, ?) '
+                   'ON CONFLICT (geo, app_num) DO UPDATE SET '
+                   'etag = excluded.etag, last_modified = excluded.last_modified',
+                   (geo, app_num, etag, last_modified))
+
+    def recordVersion(self, geo, app_num, version, date_updated):
+        self.write('INSERT INTO apps (geo, app_num, app_version, app_date_updated) VALUES (?, ?, ?, ?) '
+                   'ON CONFLICT (geo, app_num) DO UPDATE SET '
+                   'app_version = excluded.app_version, app_date_updated = excluded.app_date_updated',
+                   (geo, app_num, version, date_updated))
+
+    def write(self, sql, params):
+        self.conn.execute(sql, params)
+        self.pending += 1
+        if self.pending >= self.commit_every:
+            self.conn.commit()
+            self.pending = 0
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
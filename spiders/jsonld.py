@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+# Structured data fast path for the App Detail Pages
+#
+# The new layout embeds a schema.org SoftwareApplication record as
+# <script type="application/ld+json">. The blocks are found with a byte level
+# scan of response.body and decoded on their own , so the fields they carry
+# are available without building a DOM of the page. Only the fields the new
+# layout schema does not fill are taken from them , the name , seller and
+# category are left to the DOM ( schema.v2_rules ) so a field holds the same
+# value whatever the fields= projection. A projection within jsonld_fields is
+# served without building the DOM ( see parsepool.extractV2 ).
+
+import json
+import re
+
+#Pattern to get the JSON-LD script blocks out of the raw page
+pat_jsonld = re.compile(rb'<script[^>]*?type=["\']application/ld\+json["\'][^>]*>(.*?)</script>', re.S | re.I)
+
+#schema.org types the App Store uses for the App record
+app_types = ('SoftwareApplication', 'MobileApplication', 'VideoGame', 'WebApplication')
+
+#AppItem fields the structured data fills , none of them is in schema.v2_rules
+jsonld_fields = frozenset(['is_paid', 'app_rating_value_av', 'app_review_counts_av', 'app_date_published',
+                           'app_description', 'app_compatibility'])
+
+
+def findBlocks(body):
+    """
+    Decode the JSON-LD blocks of the page , blocks that are not valid JSON are skipped
+
+    :param body: Raw page bytes
+    :return: List of decoded objects , @graph and top level lists are flattened
+    """
+    blocks = []
+    for match in pat_jsonld.finditer(body):
+        try:
+            data = json.loads(match.group(1))
+        except ValueError:
+            continue
+        if isinstance(data, dict) and '@graph' in data:
+            data = data['@graph']
+        if isinstance(data, list):
+            blocks.extend(obj for obj in data if isinstance(obj, dict))
+        elif isinstance(data, dict):
+            blocks.append(data)
+    return blocks
+
+
+def findApp(body):
+    # The first block describing an App , None when the page has none
+    for data in findBlocks(body):
+        kind = data.get('@type')
+        if isinstance(kind, list):
+            kind = kind[0] if kind else None
+        if kind in app_types:
+            return data
+    return None
+
+
+def appFields(data):
+    """
+    Map a schema.org App record onto AppItem fields
+
+    :param data: Decoded SoftwareApplication record
+    :return: dict of the AppItem fields the record carries
+    """
+    fields = {}
+    offers = data.get('offers')
+    if isinstance(offers, list):
+        offers = offers[0] if offers else None
+    if isinstance(offers, dict) and 'price' in offers:
+        try:
+            fields['is_paid'] = float(offers['price']) > 0
+        except (TypeError, ValueError):
+            pass
+
+    rating = data.get('aggregateRating')
+    if isinstance(rating, dict):
+        try:
+            fields['app_rating_value_av'] = float(rating['ratingValue'])
+            fields['app_review_counts_av'] = int(rating.get('reviewCount', rating.get('ratingCount')))
+        except (KeyError, TypeError, ValueError):
+            fields.pop('app_rating_value_av', None)
+
+    if data.get('datePublished'):
+        fields['app_date_published'] = data['datePublished']
+    if data.get('description'):
+        fields['app_description'] = data['description']
+    if data.get('operatingSystem'):
+        fields['app_compatibility'] = data['operatingSystem']
+    return fields
+
+
+def extractFields(body):
+    """
+    :param body: Raw page bytes
+    :return: dict of AppItem fields found in the structured data , empty if there is none
+    """
+    data = findApp(body)
+    if data is None:
+        return {}
+    return appFields(data)
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+
+# Detail page layout sniffing
+#
+# The App Detail Pages come in two layouts , the old one parsed by
+# parseAppDetails ( #left-stack ) and the new one parsed by parseAppDetails_v2
+# ( product-header ). The layout is told from a few marker strings in the raw
+# body before any DOM is built , so a page goes straight to the parser of its
+# layout. Pages showing neither , like the redirect and 'Connecting to the
+# iTunes Store' pages , are skipped without being parsed. A JSON-LD record
+# alone does not make a page of the new layout , without the header the DOM
+# fields would all be missing from an item counted as a success.
+
+LEGACY = 'legacy'
+V2 = 'v2'
+SKIP = 'skip'
+
+#Marker of the new layout , its title header
+v2_marker = b'product-header__title'
+#Markers of the old layout
+legacy_markers = (b'id="left-stack"', b"id='left-stack'")
+
+
+def sniffLayout(body):
+    """
+    Layout of a detail page , read from the raw bytes without a DOM
+
+    :param body: Raw page bytes
+    :return: V2 , LEGACY or SKIP when the page shows neither layout
+    """
+    if body.find(v2_marker) != -1:
+        return V2
+    for marker in legacy_markers:
+        if body.find(marker) != -1:
+            return LEGACY
+    return SKIP
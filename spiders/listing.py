@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+# Link extraction for the listing pages without a DOM
+#
+# The genre and letter listing pages are large and only their links are
+# needed. The anchors are found with one scan of the raw body by a compiled
+# pattern that only takes the App links , https://itunes.apple.com/<cc>/app/... ,
+# and their values are decoded and unescaped as lxml would. The
+# result is the one of the CSS selectors a[href^="https://itunes.apple.com/"]
+# and #selectedgenre > ul:nth-child(2) > li > a ( see benchmarks/bench_listing.py ),
+# except for anchors written inside comments or scripts , which the scan sees.
+
+import html
+import re
+
+#href of an anchor , quoted or not , {0} is the start the value must have
+HREF = rb'<a\s[^>]*?(?<=\s)href\s*=\s*(?:"({0}[^"]*)"|\'({0}[^\']*)\'|({0}[^\s"\'>]*))'
+pat_anchor_href = re.compile(HREF.replace(b'{0}', b''), re.I)
+#Anchors to an App , the other hrefs are not even decoded
+pat_app_href = re.compile(HREF.replace(b'{0}', rb'https://itunes\.apple\.com/\w\w/app/'), re.I)
+
+APP_STORE_PREFIX = 'https://itunes.apple.com/'
+
+
+def anchorHrefs(body, encoding='utf-8', pattern=pat_anchor_href):
+    """
+    :param body: Raw page bytes , or a part of them
+    :param encoding: Encoding of the page
+    :param pattern: pat_anchor_href or pat_app_href
+    :return: href of every anchor , in the order of the page
+    """
+    hrefs = []
+    for quoted, single_quoted, bare in pattern.findall(body):
+        href = (quoted or single_quoted or bare).decode(encoding, 'replace')
+        if '&' in href:
+            href = html.unescape(href)
+        hrefs.append(href)
+    return hrefs
+
+
+def appLinks(body, encoding='utf-8'):
+    """
+    :param body: Raw listing page bytes
+    :param encoding: Encoding of the page
+    :return: App links of the page , in the order of the page
+    """
+    links = anchorHrefs(body, encoding, pat_app_href)
+    # The pattern ignores case , the CSS prefix match does not
+    if any(not link.startswith(APP_STORE_PREFIX) for link in links):
+        links = [link for link in links if link.startswith(APP_STORE_PREFIX)]
+    return links
+
+
+def paginationLinks(body, encoding='utf-8'):
+    """
+    :param body: Raw listing page bytes
+    :param encoding: Encoding of the page
+    :return: Links of the pagination list , the second list of #selectedgenre
+    """
+    start = body.find(b'id="selectedgenre"')
+    if start == -1:
+        return []
+    first = body.find(b'<ul', start)
+    first_end = body.find(b'</ul>', first) if first != -1 else -1
+    second = body.find(b'<ul', first_end) if first_end != -1 else -1
+    if second == -1:
+        return []
+    second_end = body.find(b'</ul>', second)
+    return anchorHrefs(body[second:second_end if second_end != -1 else len(body)], encoding)
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+# iTunes Lookup API support for the lookup mode of the spider
+#
+# Instead of fetching one detail page per App , the App Ids found on the
+# listing pages are sent in batches to the lookup endpoint which returns
+# the App records as JSON , up to 200 Apps per request.
+
+from urllib.parse import urlencode
+
+from itunesbot.items import AppItem
+import itunesbot.spiders.country_code_map as ccode
+
+
+def lookupUrl(base_url, app_ids, geo):
+    """
+    :param base_url: Lookup endpoint , ITUNES_LOOKUP_URL
+    :param app_ids: Numeric App Ids as strings
+    :param geo: Storefront code the records are wanted for
+    :return: URL of the batched lookup request
+    """
+    # The commas are left unescaped , a full batch is still longer than the
+    # default URLLENGTH_LIMIT which is raised in settings.py. The API takes
+    # the country part only of the language storefronts ( befr , ae-ar )
+    return '{}?{}'.format(base_url, urlencode([('id', ','.join(app_ids)), ('country', geo[:2]),
+                                               ('entity', 'software')], safe=','))
+
+
+def formatSize(size_bytes):
+    # Same unit as the App Size shown on the detail pages
+    try:
+        return '{:.1f} MB'.format(int(size_bytes) / (1024.0 * 1024.0))
+    except (TypeError, ValueError):
+        return None
+
+
+def lookupItem(result, geo, url=None):
+    """
+    Fill an AppItem from one lookup result record
+
+    :param result: Decoded record from the results list of the lookup response
+    :param geo: Storefront code the lookup was made for
+    :param url: App url found on the listing page , the record url is used if not given
+    :return: AppItem
+    """
+    appitem = AppItem()
+    appitem['app_crawl_status'] = 'success'
+    appitem['app_url'] = url or result.get('trackViewUrl')
+    appitem['app_num'] = str(result.get('trackId'))
+    appitem['app_geo'] = geo
+    if geo in ccode.country_codes_map:
+        appitem['app_country'] = ccode.country_codes_map[geo]
+
+    appitem['app_name'] = result.get('trackName')
+    appitem['app_publisher'] = result.get('artistName')
+    appitem['app_publisher_store_site'] = result.get('artistViewUrl')
+    appitem['app_publisher_home_site'] = result.get('sellerUrl')
+    appitem['app_seller'] = result.get('sellerName')
+    appitem['app_description'] = result.get('description')
+    appitem['app_version_remarks'] = result.get('releaseNotes')
+    appitem['app_version'] = result.get('version')
+    appitem['app_size'] = formatSize(result.get('fileSizeBytes'))
+    appitem['app_category_name'] = result.get('primaryGenreName')
+    if result.get('primaryGenreId') is not None:
+        appitem['app_category_id'] = str(result['primaryGenreId'])
+    appitem['app_date_published'] = result.get('releaseDate')
+    appitem['app_date_updated'] = result.get('currentVersionReleaseDate')
+    appitem['app_lang'] = ', '.join(result.get('languageCodesISO2A') or [])
+    appitem['app_rating'] = result.get('trackContentRating') or result.get('contentAdvisoryRating')
+    appitem['app_content_rating_reasons'] = ''.join(result.get('advisories') or [])
+    appitem['app_compatibility'] = result.get('minimumOsVersion')
+    appitem['supported_devices'] = result.get('supportedDevices')
+    appitem['app_for_watch'] = any('Watch' in device for device in result.get('supportedDevices') or [])
+
+    price = result.get('price')
+    appitem['app_pricing'] = result.get('formattedPrice')
+    appitem['is_paid'] = bool(price)
+
+    # Customer Ratings for the Current and All Versions
+    appitem['app_rating_value_cv'] = float(result.get('averageUserRatingForCurrentVersion') or 0)
+    appitem['app_review_counts_cv'] = int(result.get('userRatingCountForCurrentVersion') or 0)
+    appitem['app_star_rating_cv'] = appitem['app_rating_value_cv']
+    appitem['app_rating_value_av'] = float(result.get('averageUserRating') or 0)
+    appitem['app_review_counts_av'] = int(result.get('userRatingCount') or 0)
+    appitem['app_star_rating_av'] = appitem['app_rating_value_av']
+    return appitem
+
+
+def failedItem(app_id, geo, url):
+    # App asked for but missing from the lookup response , or the lookup failed
+    appitem = AppItem()
+    appitem['app_for_watch'] = False
+    appitem['app_url'] = url
+    appitem['app_num'] = app_id
+    appitem['app_geo'] = geo
+    appitem['app_crawl_status'] = 'fail'
+    return appitem
@@ -1,18 +1,24 @@
 import scrapy
-import re
-from itunesbot.items import AppItem
-import itunesbot.spiders.country_code_map as ccode
-from urllib.parse import urlparse
-from bs4 import BeautifulSoup
-
-def extractFirst(val):
-    return val.extract_first(default='Not Found')
-
-def extractFirstNum(val):
-    return val.extract_first(default=0)
-
-def extractFirstElseNone(val):
-    return val.extract_first(default=None)
+import json
+from time import time
+from scrapy import signals
+from scrapy.exceptions import DontCloseSpider
+from scrapy.utils.defer import maybe_deferred_to_future
+from twisted.internet import task
+from itunesbot.items import AppItem, toCount
+from itunesbot.timing import timed
+import itunesbot.spiders.schema as schema
+import itunesbot.spiders.lookup as lookup
+import itunesbot.spiders.dedup as dedup
+import itunesbot.spiders.incremental as incremental
+import itunesbot.spiders.parsepool as parsepool
+import itunesbot.spiders.jsonld as jsonld
+import itunesbot.spiders.storefronts as fanout
+import itunesbot.spiders.retryqueue as retryqueue
+import itunesbot.spiders.pagination as pagination
+import itunesbot.spiders.priority as priority
+import itunesbot.spiders.layout as layout
+import itunesbot.spiders.listing as listing
 
 
 class AppSpider(scrapy.Spider):
@@ -24,6 +30,10 @@ class AppSpider(scrapy.Spider):
                  start_letter='A',
                  end_letter='Z',
                  popular=None,
+                 mode=None,
+                 storefronts=None,
+                 retry_only=None,
+                 fields=None,
                  *args,
                  **kwargs):
 
@@ -32,18 +42,24 @@ class AppSpider(scrapy.Spider):
         The spider will being the crawl based on the inputs provided and will do only 1 of the below possible scenarios
         a. If start and popular is provided , then Popular Apps are only fetched.
         b. Else If start , start_letter and end_letter is provided , then do Alphabetwise Crawl
+        In both scenarios mode decides how the App details are fetched , 'html' requests every
+        App Detail Page and 'lookup' sends the App Ids in batches to the iTunes Lookup API
 
         :param start: The start url from which the spider will begin the crawling
         :param start_letter: Batch control , specifies the Page to start with
         :param end_letter: Batch control , specifies the Page to end with
         :param popular: Only Popular Apps - roughly it will give you Top 200 apps
+        :param mode: 'html' ( default ) or 'lookup'
+        :param storefronts: 'all' or comma separated storefront codes , every App found on the
+                            storefront of the start url is also fetched from these
+        :param retry_only: Only crawl the Apps waiting in the retry queue
+        :param fields: Comma separated AppItem fields , only these are extracted and the items
+                       carry only these and the fields of the App link
         :param args: Additional arguments
         :param kwargs: Additional Keyword Arguments
         """
 
         super(AppSpider, self).__init__(*args, **kwargs)
-        #Pattern to get itunes app link
-        self.pat_app_link = re.compile(r'https://itunes.apple.com/[\w][\w]/app/(.)*')
 
         self.base_url = start
         #Set whether to get Popular Apps only or not
@@ -56,33 +72,169 @@ class AppSpider(scrapy.Spider):
         self.start_letter = start_letter
         self.end_letter = end_letter
 
-        #Set to store urls already visited
-        self.urlsvisited = {}
+        # Set how the App details are fetched
+        self.mode = mode or 'html'
+        if self.mode not in ('html', 'lookup'):
+            raise ValueError('Unknown mode {} , use html or lookup'.format(self.mode))
+        #App Ids waiting for a lookup request , per storefront
+        self.lookup_batches = {}
+        #App Id dedup , incremental recrawl state , parse pool and retry queue , set up in from_crawler
+        self.app_filter = None
+        self.incremental_state = None
+        self.parse_pool = None
+        self.retry_queue = None
+        self.retry_only = bool(retry_only)
+        self.retry_codes = frozenset()
+        self.retry_timer = None
+        #Pages per letter of the last crawl , set up in from_crawler
+        self.page_counts = pagination.PageCounts()
+        #Ranks the App requests when APP_PRIORITY_ENABLED , set up in from_crawler
+        self.app_priority = None
+        self.listing_priority = 0
+        #Highest App priority of the lookup batch waiting , per storefront
+        self.lookup_priority = {}
+        #Pushes requests to the shared frontier when FRONTIER_ENABLED , set by FrontierMiddleware
+        self.frontier_push = None
+        #Histograms of the callbacks when TIMING_ENABLED , set by TimingMiddleware
+        self.timings = None
+
+        # Set the storefronts to fan out to , the start url gives the first one
+        self.primary_geo = schema.appGeoAndId(start)[0]
+        self.storefronts = fanout.storefrontList(storefronts, self.primary_geo) if storefronts else []
+
+        #Compile the extraction schemas once for the whole crawl
+        self.legacy_schema = schema.ItemSchema(schema.legacy_rules)
+        self.v2_schema = schema.ItemSchema(schema.v2_rules)
+        #Fields of a new layout page , from the DOM and from the JSON-LD blocks
+        self.v2_fields = self.v2_schema.field_names.union(jsonld.jsonld_fields)
+        #Fields the items carry , None for all of them , and the legacy fields to extract for them
+        self.item_fields = None
+        self.legacy_fields = None
+        self.link_only = False
+        if fields:
+            # The rules filling none of the fields asked for are not run
+            self.item_fields, extracted = schema.projectionFields(fields, AppItem.fields)
+            self.v2_fields = self.v2_fields.intersection(extracted)
+            self.legacy_fields = extracted
+            # The App link gives all of them , no App Detail Page or lookup is needed
+            self.link_only = self.item_fields <= schema.link_fields
+        #Fields parsed again on the other storefronts
+        self.storefront_fields = self.v2_fields.difference(fanout.invariant_fields)
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super(AppSpider, cls).from_crawler(crawler, *args, **kwargs)
+        crawler.signals.connect(spider.spiderIdle, signal=signals.spider_idle)
+        if crawler.settings.getbool('APPID_DEDUP_ENABLED', True):
+            spider.app_filter = dedup.AppIdFilter.fromSettings(crawler.settings)
+        if crawler.settings.getbool('INCREMENTAL_ENABLED'):
+            spider.incremental_state = incremental.IncrementalState.fromSettings(crawler.settings)
+        spider.parse_pool = parsepool.ParsePool.fromSettings(crawler.settings)
+        spider.page_counts = pagination.PageCounts.fromSettings(crawler.settings)
+        if crawler.settings.getbool('APP_PRIORITY_ENABLED'):
+            spider.app_priority = priority.AppPriority.fromSettings(crawler.settings)
+            # Listing pages go first , the Apps they list are ranked against each other
+            spider.listing_priority = crawler.settings.getint('APP_PRIORITY_LISTING', 1000)
+        if crawler.settings.getbool('RETRY_QUEUE_ENABLED') or spider.retry_only:
+            spider.retry_queue = retryqueue.RetryQueue.fromSettings(crawler.settings)
+            spider.retry_codes = frozenset(int(code) for code in
+                                     crawler.settings.getlist('RETRY_QUEUE_CODES', [403, 429, 500, 502, 503, 504]))
+            crawler.signals.connect(spider.spiderOpened, signal=signals.spider_opened)
+        if spider.storefronts:
+            # A download slot , with its own concurrency budget , per storefront
+            if crawler.settings.frozen:
+                spider.logger.warning('Settings already frozen , the storefronts share the default slot budget')
+            else:
+                crawler.settings.set('DOWNLOAD_SLOTS', fanout.slotSettings(
+                    crawler.settings, [spider.primary_geo] + spider.storefronts), priority='spider')
+        crawler.signals.connect(spider.appScraped, signal=signals.item_scraped)
+        crawler.signals.connect(spider.spiderClosed, signal=signals.spider_closed)
+        return spider
 
     def start_requests(self):
 
         self.logger.info('Setting up the Spider')
+        self.lookup_url = self.settings.get('ITUNES_LOOKUP_URL', 'https://itunes.apple.com/lookup')
+        self.lookup_batch_size = self.settings.getint('ITUNES_LOOKUP_BATCH', 200)
+        self.page_probe = max(1, self.settings.getint('PAGINATION_PROBE', 3))
+
+        # Retry only mode , every App of the retry queue is sent , due or not
+        if self.retry_only:
+            self.logger.info('Retry Queue Fetch -- Started , {} Apps queued'.format(len(self.retry_queue)))
+            for request in self.retryRequests(float('inf')):
+                yield request
+            return
+
+        # Apps the last crawls left in the retry queue
+        if self.retry_queue is not None:
+            for request in self.retryRequests():
+                yield request
 
         # Check if Popular is provided or not
         # This is only the Popular Apps for the given Genre/Category
         if self.popular:
             self.logger.info('Popular Apps Fetch -- Started')
-            yield scrapy.Request(url=self.base_url, callback=self.parseCategory)
+            yield scrapy.Request(url=self.base_url, callback=self.parseCategory, priority=self.listing_priority)
 
         # Then letter wise fetch needs to be done
         # This is Alphabet Wise
         else:
             self.logger.info('Alphabetwise Fetch -- Started')
             self.logger.info('Range given is {}-{}'.format(self.start_letter,self.end_letter))
-            letters = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ*'
-            start_index = letters.index(self.start_letter)
-            end_index = letters.index(self.end_letter) + 1
-            for letter in letters[start_index:end_index]:
-                url = '{}&letter={}'.format(self.base_url,letter)
-                self.logger.info('Send request to url : {}'.format(url))
-                yield scrapy.Request(url=url, callback=self.parseAlphabetWise)
+            # The genre page tells which Apps are popular , they rank above the others.
+            # Its Apps are only ranked , not requested , and the letters go out once it is read
+            if self.app_priority is not None:
+                yield scrapy.Request(url=self.base_url, callback=self.parsePopularRanks,
+                                     errback=self.popularRanksFailed, priority=self.listing_priority + 1)
+            else:
+                for request in self.letterRequests():
+                    yield request
+
+    def letterRequests(self):
+
+        """
+        :return: Requests for the listing pages of the letters start_letter to end_letter
+        """
 
+        letters = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ*'
+        start_index = letters.index(self.start_letter)
+        end_index = letters.index(self.end_letter) + 1
+        for letter in letters[start_index:end_index]:
+            url = '{}&letter={}'.format(self.base_url,letter)
+            self.logger.info('Send request to url : {}'.format(url))
+            # The pages the letter had in the last crawl go out with its first page
+            predicted = self.page_counts.predicted(url) or 1
+            yield scrapy.Request(url=url, callback=self.parseAlphabetWise, priority=self.listing_priority,
+                                 meta={'letter_url': url, 'page': 1, 'planned': predicted})
+            for page in range(2, predicted + 1):
+                yield self.listingRequest(url, page, predicted)
+
+    @timed
+    def parsePopularRanks(self, response):
 
+        """
+        Marks the Apps of the genre page as popular for the alphabet crawl , the Apps
+        outside the letter range are not requested
+
+        :param response: Genre page response
+        :return: Scrapy Request objects for the letters
+        """
+
+        for link in listing.appLinks(response.body, response.encoding):
+            geo, app_id = schema.appGeoAndId(link)
+            if app_id is not None:
+                self.app_priority.markPopular(geo, app_id)
+        self.setStat('priority/popular', len(self.app_priority.popular))
+        for request in self.letterRequests():
+            yield request
+
+    def popularRanksFailed(self, failure):
+        # Without the genre page the letters are crawled on the other scores only
+        self.logger.warning('Genre page failed , no App is ranked as popular : {}'.format(failure.value))
+        return self.letterRequests()
+
+
+    @timed
     def parseCategory(self,response):
 
         """
@@ -91,17 +243,17 @@ class AppSpider(scrapy.Spider):
         :return: Scrapy Request object
         """
 
-        for link in response.css('a[href^="https://itunes.apple.com/"]::attr(href)').extract():
-            match = re.match(self.pat_app_link,link)
-            if match:
-                self.logger.info('App url {} -- request sent'.format(link))
-                yield scrapy.Request(url=link,callback=self.parseAppDetails_v2)
+        # The links are scanned from the raw body , the page needs no DOM
+        for link in listing.appLinks(response.body, response.encoding):
+            for request in self.requestApp(link, popular=True):
+                yield request
 
 
     '''
     This will get the list of Apps in the Page Wise and Alphabetical Display of Apps.
     Will be used only 
     '''
+    @timed
     def parseAlphabetWise(self,response):
 
         """
@@ -112,31 +264,346 @@ class AppSpider(scrapy.Spider):
         """
 
         #Get the App Links
-        for link in response.css('a[href^="https://itunes.apple.com/"]::attr(href)').extract():
-            match = re.match(self.pat_app_link,link)
-            if match:
-                request = scrapy.Request(url=link,callback=self.parseAppDetails_v2)
-                request.meta['handle_httpstatus_list'] = [403,503]
-                self.logger.info('App url {} -- request sent'.format(link))
+        for request in self.listedApps(response):
+            yield request
+
+        #Request all the pages of the letter at once , the pagination links give their number
+        letter_url = response.meta.get('letter_url', response.url)
+        planned = response.meta.get('planned', 1)
+        count = pagination.pageCount(listing.paginationLinks(response.body, response.encoding))
+        if not pagination.isEmptyPage(response.body):
+            self.page_counts.found(letter_url, 1)
+        self.incStat('pagination/letters')
+        if count > planned:
+            self.logger.info('AppList {} -- pages {} to {} requested'.format(letter_url, planned + 1, count))
+            for page in range(planned + 1, count + 1):
+                yield self.listingRequest(letter_url, page, count)
+
+    @timed
+    def parseListingPage(self, response):
+
+        """
+        Gets the App urls of a listing page requested by the pagination planner.
+        The last planned page , when it still lists Apps , requests the next
+        PAGINATION_PROBE pages
+
+        :param response: URL Request Response
+        :return: Scrapy Request Object
+        """
+
+        # Past the last page , no need for the DOM
+        if pagination.isEmptyPage(response.body):
+            self.incStat('pagination/empty')
+            return
+        letter_url = response.meta['letter_url']
+        page = response.meta['page']
+        self.page_counts.found(letter_url, page)
+        for request in self.listedApps(response):
+            yield request
+        if page == response.meta['planned']:
+            planned = page + self.page_probe
+            self.incStat('pagination/probed', self.page_probe)
+            for next_page in range(page + 1, planned + 1):
+                yield self.listingRequest(letter_url, next_page, planned)
+
+    def listingRequest(self, letter_url, page, planned):
+        # Listing page of a letter , planned is the last page requested so far
+        self.incStat('pagination/requested')
+        return scrapy.Request(url=pagination.pageUrl(letter_url, page), callback=self.parseListingPage,
+                              priority=self.listing_priority, meta={'letter_url': letter_url, 'page': page, 'planned': planned})
+
+    def listedApps(self, response):
+        # Requests for the Apps of a letter listing page
+        for link in listing.appLinks(response.body, response.encoding):
+            for request in self.requestApp(link, {'handle_httpstatus_list': self.statusList([403, 503])}):
                 yield request
 
-        #Go to next Page if available
-        for link in response.css('#selectedgenre > ul:nth-child(2) > li > a::attr(href)').extract():
 
-            #Check if link already visited or not
-            #if link in self.urlsvisited:
-            #    continue
-            #else:
-            #    self.urlsvisited[link] = True
-            #yield scrapy.Request(url=link,callback=self.parseAlphabetWise)
-            self.logger.info('AppList url {} -- request sent'.format(link))
-            yield scrapy.Request(url=link, callback=self.parseCategory)
+    def requestApp(self, link, meta=None, popular=False):
+
+        """
+        Requests for an App link found on a listing page.
+        In html mode this is the App Detail Page request , in lookup mode the App Id is
+        queued and a lookup request is returned once a whole batch has been collected
+
+        :param link: App url
+        :param meta: Meta for the App Detail Page request
+        :param popular: True for the Apps of the popular genre page
+        :return: List of Scrapy Request objects
+        """
+
+        # The same App is linked from many listing pages under different urls
+        geo, app_id = schema.appGeoAndId(link)
+        if app_id is not None and self.app_filter is not None:
+            if not self.app_filter.isNew(geo, app_id):
+                self.incStat('appids/duplicate')
+                return []
+            self.incStat('appids/new')
+        if popular and app_id is not None and self.app_priority is not None:
+            self.app_priority.markPopular(geo, app_id)
+        if self.link_only:
+            return self.listedItems(link, geo, app_id)
+
+        if self.mode == 'html':
+            self.logger.info('App url {} -- request sent'.format(link))
+            callback = self.parseAppDetails_v2 if self.parse_pool is None else self.parseAppDetailsPooled
+            if self.retry_queue is not None:
+                # The failures the retry queue takes have to reach the callback
+                meta = dict(meta or {})
+                meta['handle_httpstatus_list'] = self.statusList(meta.get('handle_httpstatus_list', []))
+            if self.storefronts:
+                meta = dict(meta or {}, download_slot=fanout.downloadSlot(geo))
+            return [scrapy.Request(url=link, callback=callback, meta=meta, priority=self.appPriority(geo, app_id))]
+
+        if app_id is None:
+            return []
+        requests = []
+        # Storefront fan-out : the App goes into the lookup batch of every storefront
+        for store_geo in [geo] + self.storefronts:
+            if store_geo != geo and self.app_filter is not None and not self.app_filter.isNew(store_geo, app_id):
+                continue
+            batch = self.lookup_batches.setdefault(store_geo, [])
+            batch.append((app_id, link if store_geo == geo else fanout.storefrontUrl(link, store_geo)))
+            # A batch is as urgent as its most urgent App
+            self.lookup_priority[store_geo] = max(self.lookup_priority.get(store_geo, 0),
+                                                  self.appPriority(store_geo, app_id))
+            if len(batch) >= self.lookup_batch_size:
+                requests.append(self.lookupRequest(store_geo))
+        return requests
+
+    def listedItems(self, link, geo, app_id):
+        # Items of the fields= projection filled from the App link , for every storefront
+        items = []
+        for store_geo in [geo] + self.storefronts:
+            if store_geo != geo:
+                if app_id is None or (self.app_filter is not None and not self.app_filter.isNew(store_geo, app_id)):
+                    continue
+            appitem = AppItem()
+            appitem['app_url'] = link if store_geo == geo else fanout.storefrontUrl(link, store_geo)
+            appitem['app_crawl_status'] = 'listed'
+            schema.storeFields(appitem, appitem['app_url'])
+            items.append(schema.projectItem(appitem, self.item_fields))
+        self.incStat('projection/listed', len(items))
+        return items
+
+    def retryRequests(self, until=None):
+
+        """
+        App Detail Page requests for the Apps of the retry queue due by until.
+        Apps that failed in a lookup batch are sent as App Detail Page requests as well
+
+        :param until: Time the Apps are due by , now if not given
+        :return: List of Scrapy Request objects
+        """
+
+        rows, given_up = self.retry_queue.take(until)
+        if given_up:
+            self.logger.warning('{} Apps given up after {} retries'.format(given_up, self.retry_queue.max_attempts))
+            self.incStat('retryqueue/given_up', given_up)
+        callback = self.parseAppDetails_v2 if self.parse_pool is None else self.parseAppDetailsPooled
+        requests = []
+        for geo, app_id, link in rows:
+            # The first request of the App is done in the shared frontier , a retry is a task of its own
+            meta = {'handle_httpstatus_list': self.statusList([404]), 'frontier_retry': '{:.0f}'.format(time())}
+            if self.storefronts:
+                meta['download_slot'] = fanout.downloadSlot(geo)
+            self.logger.info('App url {} -- retry sent'.format(link))
+            requests.append(scrapy.Request(url=link, callback=callback, meta=meta, dont_filter=True,
+                                           priority=self.appPriority(geo, app_id)))
+        self.incStat('retryqueue/sent', len(requests))
+        return requests
+
+    def queueRetry(self, link, status):
+        # Failed App : into the retry queue when the status is worth a retry , out of it when not
+        geo, app_id = schema.appGeoAndId(link)
+        if self.retry_queue is None or app_id is None:
+            return
+        if status in self.retry_codes:
+            if self.retry_queue.add(geo, app_id, link, status):
+                self.incStat('retryqueue/queued')
+        elif (geo, app_id) in self.retry_queue:
+            self.retry_queue.done(geo, app_id)
+            self.incStat('retryqueue/dropped')
+
+    def appPriority(self, geo, app_id):
+        # Request priority of an App , 0 for all of them without APP_PRIORITY_ENABLED
+        if self.app_priority is None or app_id is None:
+            return 0
+        return self.app_priority.score(geo, app_id)
+
+    def crawlRequest(self, request):
+        # Request sent outside the callbacks , through the shared frontier in the distributed mode
+        if self.frontier_push is not None:
+            self.frontier_push([request])
+        else:
+            self.crawler.engine.crawl(request)
+
+    def statusList(self, codes):
+        # Non 200 statuses passed to the callback , with the ones the retry queue takes
+        return sorted(self.retry_codes.union(codes))
+
+    def sendRetries(self):
+        # Apps of the retry queue that are due , sent while the crawl runs
+        for request in self.retryRequests():
+            self.crawlRequest(request)
+
+    def lookupRequest(self, geo):
+        # Request for the App Ids queued for the storefront , the queue is emptied
+        batch = self.lookup_batches.pop(geo)
+        url = lookup.lookupUrl(self.lookup_url, [app_id for app_id, link in batch], geo)
+        self.logger.info('Lookup of {} Apps -- request sent'.format(len(batch)))
+        meta = {'lookup_geo': geo, 'lookup_links': batch, 'handle_httpstatus_list': self.statusList([403, 503])}
+        if self.storefronts:
+            meta['download_slot'] = fanout.downloadSlot(geo)
+        return scrapy.Request(url=url, callback=self.parseLookup, meta=meta,
+                              priority=self.lookup_priority.pop(geo, 0))
+
+    def appScraped(self, item):
+        # Only Apps crawled successfully are kept for the later runs
+        if item.get('app_crawl_status') == 'fail' or not item.get('app_url'):
+            return
+        geo, app_id = schema.appGeoAndId(item['app_url'])
+        if app_id is None:
+            return
+        if self.app_filter is not None:
+            self.app_filter.done(geo, app_id)
+        if self.retry_queue is not None and (geo, app_id) in self.retry_queue:
+            self.retry_queue.done(geo, app_id)
+            self.incStat('retryqueue/recovered')
+        if self.incremental_state is not None and item.get('app_crawl_status') == 'success':
+            self.incremental_state.recordVersion(geo, app_id, item.get('app_version'), item.get('app_date_updated'))
+        if self.app_priority is not None:
+            self.app_priority.record(geo, app_id, toCount(item.get('app_review_counts_av')))
+        if self.storefronts and self.mode == 'html' and geo == self.primary_geo and not self.link_only:
+            self.fanOut(item, app_id)
+
+    def fanOut(self, item, app_id):
+        # Fetch an App found on the first storefront from the other storefronts
+        base = fanout.invariantFields(item) if item.get('app_crawl_status') == 'success' else None
+        for geo in self.storefronts:
+            if self.app_filter is not None and not self.app_filter.isNew(geo, app_id):
+                self.incStat('appids/duplicate')
+                continue
+            url = fanout.storefrontUrl(item['app_url'], geo)
+            self.incStat('storefronts/requests')
+            self.crawlRequest(scrapy.Request(url=url, callback=self.parseStorefront,
+                                             priority=self.appPriority(geo, app_id),
+                                             meta={'storefront_base': base,
+                                                   'download_slot': fanout.downloadSlot(geo),
+                                                   'handle_httpstatus_list': self.statusList([403, 404, 503])}))
+
+    @timed
+    def parseStorefront(self, response):
+
+        """
+        Parses the App Detail Page of an App on a storefront it was not found on.
+        When the first storefront's page was parsed , its country invariant fields
+        are copied rather than parsed again
+
+        :param response: App Detail Page response
+        :return: AppItem
+        """
+
+        unchanged = self.checkUnchanged(response)
+        if unchanged is not None:
+            return unchanged
+        if (response.status != 200):
+            # 404 , the App is not sold on this storefront
+            return self.failedApp(response)
+        page_layout = self.sniffLayout(response)
+        if page_layout != layout.V2:
+            return self.otherLayoutApp(response, page_layout, 'parseStorefront')
+        base = response.meta.get('storefront_base')
+        fields = self.v2_fields if base is None else self.storefront_fields
+        appitem, source = parsepool.extractV2(response, self.v2_schema, fields,
+                                              timer=self.fieldTimer('parseStorefront'))
+        self.incStat(source)
+        if base is not None:
+            appitem.update(base)
+            self.incStat('storefronts/invariant_copied')
+        return appitem
+
+    def spiderClosed(self):
+        if self.app_filter is not None:
+            self.app_filter.save()
+        self.page_counts.save()
+        if self.app_priority is not None:
+            self.app_priority.close()
+        if self.incremental_state is not None:
+            self.incremental_state.close()
+        if self.parse_pool is not None:
+            self.parse_pool.close()
+        if self.retry_queue is not None:
+            if self.retry_timer is not None and self.retry_timer.running:
+                self.retry_timer.stop()
+            self.setStat('retryqueue/left', len(self.retry_queue))
+            self.retry_queue.close()
+
+    def spiderOpened(self):
+        # The due Apps of the retry queue are sent every RETRY_QUEUE_POLL_SECS
+        self.retry_timer = task.LoopingCall(self.sendRetries)
+        self.retry_timer.start(self.settings.getfloat('RETRY_QUEUE_POLL_SECS', 30.0), now=False)
+
+    def spiderIdle(self):
+        # Send the last , partly filled , lookup batches before the spider closes
+        waiting = False
+        for geo in list(self.lookup_batches):
+            self.crawlRequest(self.lookupRequest(geo))
+            waiting = True
+        # Stay open for the Apps of the retry queue due within RETRY_QUEUE_MAX_WAIT ,
+        # the later ones are left for the next crawl
+        if self.retry_queue is not None:
+            requests = self.retryRequests()
+            for request in requests:
+                self.crawlRequest(request)
+            next_due = self.retry_queue.nextDue()
+            if requests or (next_due is not None and
+                            next_due - time() <= self.settings.getfloat('RETRY_QUEUE_MAX_WAIT', 600.0)):
+                waiting = True
+        if waiting:
+            raise DontCloseSpider
+
+    @timed
+    def parseLookup(self, response):
+
+        """
+        Fills an AppItem for every App of a lookup batch
+
+        :param response: Lookup API response
+        :return: AppItem objects , failed ones for the Apps the response does not have
+        """
 
+        geo = response.meta['lookup_geo']
+        results = {}
+        if response.status == 200:
+            for result in json.loads(response.text).get('results', []):
+                if 'trackId' in result:
+                    results[str(result['trackId'])] = result
+        else:
+            self.logger.info('Lookup url {} -- non 200 response'.format(response.url))
+
+        for app_id, link in response.meta['lookup_links']:
+            if app_id not in results:
+                # Only a failed batch is retried , an App missing from a good answer is not sold there
+                if response.status != 200:
+                    self.queueRetry(link, response.status)
+                yield lookup.failedItem(app_id, geo, link)
+                continue
+            # Incremental mode : the same version and update date as the last crawl
+            known = self.incremental_state.get(geo, app_id) if self.incremental_state is not None else None
+            result = results[app_id]
+            if known is not None and known['app_version'] == result.get('version') \
+                    and known['app_date_updated'] == result.get('currentVersionReleaseDate'):
+                self.incStat('incremental/same_version')
+                yield incremental.unchangedItem(link, geo, app_id, known)
+            else:
+                yield lookup.lookupItem(result, geo, link)
 
     '''
     This will parse the App Detail Page and extract all the required information
     Extracted Information will be stored as Scrapy Item
     '''
+    @timed
     def parseAppDetails(self,response):
         
         DOWNLOAD_DELAY = 5
@@ -151,280 +618,120 @@ class AppSpider(scrapy.Spider):
             appitem['app_crawl_status'] = 'fail'
             return appitem
 
-        appitem['app_crawl_status'] = 'success'
-        # Store the Language in which this App URL Page was crawled
-        appitem['app_html_lang'] = extractFirst(response.css('html::attr(lang)'))
-        # Store the App Title on seen on the Title Bar of the Page
-        appitem['app_title'] = extractFirst(response.css('head > title::text'))
-        # Store the App Name as seen
-        appitem['app_name'] = extractFirst(response.css('#title > div.left > h1::text'))
-        # Store the App Publisher
-        appitem['app_publisher'] = extractFirst(response.css('#title > div.left > h2::text'))
-        # Store the App Publisher's Store Site
-        appitem['app_publisher_store_site'] = extractFirst(response.css('#title > div.right > a::attr(href)'))
-
-        # Store the App Publisher Home Site
-        appitem['app_publisher_home_site'] = extractFirst(
-            response.css('#content > div > div.center-stack > div.app-links > a:nth-child(1)::attr(href)'))
-        # Store the App Support Site if available
-        appitem['app_support_site'] = extractFirst(
-            response.css('#content > div > div.center-stack > div.app-links > a:nth-child(2)::attr(href)'))
-
-        for row in response.css('#left-stack > div.lockup.product.application > ul > li'):
-            # Store the App Pricing
-            rec = row.xpath('span[contains(@itemprop,"offers")]/div/text()').extract_first()
-            if rec is not None:
-                appitem['app_pricing'] = rec
-                if "Free" in appitem['app_pricing']:
-                    appitem['is_paid'] = False
-                else:
-                    appitem['is_paid'] = True
-                continue
-            # Store the App Category
-            rec = row.xpath('@class').extract_first()
-            if rec is not None and "genre" in rec:
-                appitem['app_category_name'] = row.css('a > span::text').extract_first()
-                # Store the App Category Id
-                categoryURL = extractFirst(row.css('a::attr(href)'))
-                try:
-                    part = urlparse(categoryURL)
-                    segments = part.path.split('/')
-                    appitem['app_category_id'] = segments[4].replace('id', '')
-                except:
-                    appitem['app_category_id'] = 'na'
-                continue
-
-            # Store the App Updated Date and Release Date
-            elif rec is not None and 'release' in rec:
-                # Store the App Updated Date
-                last_updated_date = extractFirst(row.css('span:nth-child(2)::text'))
-                appitem['app_date_updated'] = last_updated_date
-
-                # Store the App Release Date
-                release_date = extractFirst(row.css('span:nth-child(2)::attr(content)'))
-                appitem['app_date_published'] = release_date
-                continue
-
-            # Store the App Languages
-            elif rec is not None and 'language' in rec:
-                appitem['app_lang'] = extractFirst(row.xpath('text()'))
-                continue
-
-            # Store the App Version
-            rec = row.xpath('span[contains(@itemprop,"softwareVersion")]/text()').extract_first()
-            if rec is not None:
-                appitem['app_version'] = rec
-                continue
-
-            # Store the App Size
-            rec = extractFirst(row.css('span::text'))
-            if "size" in rec.lower():
-                appitem['app_size'] = extractFirst(row.xpath('text()'))
-                continue
-            elif "watch" in rec.lower():
-                appitem['app_for_watch'] = True
-                continue
-
-            # Store the App Seller
-            rec = row.xpath('span[contains(@itemprop,"author")]/span/text()').extract_first()
-            if rec is not None:
-                appitem['app_seller'] = rec
-                continue
-
-        # Store the App Content Rating
-        tmp = response.css('#left-stack > div.lockup.product.application > div.app-rating > a::text').extract_first()
-        if tmp:
-            appitem['app_content_rating'] = tmp
-        else:
-            tmp = response.css('#left-stack > div.lockup.product.application > div > a::text').extract_first()
-            if tmp:
-                appitem['app_content_rating'] = tmp
-            else:
-                appitem['app_content_rating'] = 'Not found'
-
-        # Store the App Content Rating Reasons
-        tmp = ''
-        for row in response.css('#left-stack > div.lockup.product.application > div.app-rating > ul > li'):
-            tmp = tmp + row.xpath('text()').extract_first().strip()
-        appitem['app_content_rating_reasons'] = tmp
-
-        # Store the App compatability
-        appitem['app_compatibility'] = extractFirst(response.xpath('//*[@id="left-stack"]/div[1]/p/span[2]/text()'))
-
-        # Store the Current Version Ratings Value
-        appitem['app_rating_value_cv'] = float(extractFirstNum(
-            response.css('#left-stack > div.extra-list.customer-ratings > div:nth-child(3) > span:nth-child(1)::text')))
-        # Store the Current Version Review Counts
-        cv_reviewCount = extractFirstNum(
-            response.css('#left-stack > div.extra-list.customer-ratings > div:nth-child(3) > span.rating-count::text'))
-        if cv_reviewCount != 0:
-            cv_reviewCount = cv_reviewCount.replace("Ratings", "").strip()
-        appitem['app_review_counts_cv'] = int(cv_reviewCount)
-        # Store the Current Version Star Ratings
-        appitem['app_star_rating_cv'] = appitem['app_rating_value_cv']
-
-        # Get the App Current Version Ratings
-        appitem['app_rating_cv'] = extractFirst(
-            response.css('#left-stack > div.extra-list.customer-ratings > div:nth-child(3)::attr(aria-label)'))
-        # Get the App All Version Ratings
-        appitem['app_rating_av'] = extractFirst(
-            response.css('#left-stack > div.extra-list.customer-ratings > div:nth-child(5)::attr(aria-label)'))
-
-        # If possible , get the App All Version Review Counts
-        try:
-            if 'Ratings' in appitem['app_rating_av']:
-                tok = appitem['app_rating_av'].split(',')
-                rt = tok[1].strip('Ratings').strip(' ')
-                appitem['app_review_counts_av'] = rt
-        except Exception as e:
-            pass
-
-        # Get the App Top In app Purchases if available
-        inapp = response.css('#left-stack > div.extra-list.in-app-purchases > h4').extract_first()
-        if inapp:
-            appitem['has_inapp'] = True
-        else:
-            appitem['has_inapp'] = False
-
-        tmp = ''
-        for inappdata in response.css('#left-stack > div.extra-list.in-app-purchases > ol > li'):
-            tmp = tmp + ' '.join(inappdata.css('span::text').extract())
-            tmp = tmp + '||'
-        appitem['inapp_info'] = tmp
-
-        # Store the App Description
-        appitem['app_description'] = ' '.join(
-            response.css('#content > div > div.center-stack > div:nth-child(1) > p::text').extract())
-
-        # Store the Version Remarks
-        appitem['app_version_remarks'] = ' '.join(
-            response.css('#content > div > div.center-stack > div:nth-child(3) > p::text').extract())
-
-        # Get Similar Apps bought by Customer
-        tmp = ''
-        for sa in response.css('#content > div > div.center-stack > div:nth-child(6) > div.content > div > div'):
-            # tmp = tmp + sa.xpath('@aria-label').extract_first().strip() + ' | '
-            tmp = tmp + sa.xpath('a/@href').extract_first().rstrip() + '||'
-        appitem['app_cust_also_bought'] = tmp
-
-        # Store the Customer Reviews
-        tmp = ''
-        for sa in response.css('#content > div > div.center-stack > div.customer-reviews > div'):
-            tmp = tmp + sa.xpath('h5/div/@aria-label').extract_first() + ':'
-            tmp = tmp.replace('\n', '')
-            tmp = tmp.replace('\t', '')
-            tmp = tmp + sa.xpath('p/text()').extract_first().strip() + '|'
-            tmp = tmp.lstrip().replace('\n', '').replace('\t', '')
-        appitem['app_customer_reviews'] = tmp
-
-        # Store the App Geo and App Id
-        part = urlparse(response.url)
-        segments = part.path.split('/')
-        appitem['app_geo'] = segments[1]
-        appitem['app_num'] = segments[4].replace('id', '')
-
-        if appitem['app_geo'] in ccode.country_codes_map:
-            appitem['app_country'] = ccode.country_codes_map[appitem['app_geo']]
+        self.legacyFields(response, appitem, 'parseAppDetails')
         # End of Enhanced Code Addition
 
         self.logger.info('App Details Extraction : {} -- done'.format(response.url))
         return appitem
+
+    def legacyFields(self, response, appitem, callback):
+        appitem['app_crawl_status'] = 'success'
+        # The fields and their selectors are listed in schema.legacy_rules
+        self.legacy_schema.extract(response.selector.root, appitem, response.url, only=self.legacy_fields,
+                                   timer=self.fieldTimer(callback))
+        return appitem
     
     # Updating the App Details Parser to incorporate the new layout 
     # Dec 6 - hari 
+    @timed
     def parseAppDetails_v2(self,response):
 
         self.logger.info('App Details Extraction : {} -- started'.format(response.url))
-        # Enhanced Code Starts Below
+        # Incremental mode : a 304 or the same version as the last crawl needs no parsing
+        unchanged = self.checkUnchanged(response)
+        if unchanged is not None:
+            return unchanged
+        if (response.status != 200):
+            return self.failedApp(response)
+        page_layout = self.sniffLayout(response)
+        if page_layout != layout.V2:
+            return self.otherLayoutApp(response, page_layout, 'parseAppDetails_v2')
+        appitem, source = parsepool.extractV2(response, self.v2_schema, self.v2_fields,
+                                              timer=self.fieldTimer('parseAppDetails_v2'))
+        self.incStat(source)
+        return appitem
+
+    async def parseAppDetailsPooled(self, response):
+
+        """
+        parseAppDetails_v2 with the page parsed in the PARSE_POOL_WORKERS processes
+
+        :param response: App Detail Page response
+        :return: AppItem
+        """
+
+        unchanged = self.checkUnchanged(response)
+        if unchanged is not None:
+            return unchanged
+        if (response.status != 200):
+            return self.failedApp(response)
+        page_layout = self.sniffLayout(response)
+        if page_layout != layout.V2:
+            return self.otherLayoutApp(response, page_layout, 'parseAppDetailsPooled')
+        fields = None if self.item_fields is None else self.v2_fields
+        fields, source = await maybe_deferred_to_future(self.parse_pool.extract(response, fields))
+        self.incStat(source)
+        self.incStat('parse_pool/pages')
+        return AppItem(fields)
+
+    def failedApp(self, response):
+        self.logger.info('App url {} -- non 200 response'.format(response.url))
+        self.queueRetry(response.url, response.status)
         appitem = AppItem()
         appitem['app_for_watch'] = False
-        # Store the App URL
         appitem['app_url'] = response.url
-        extras = {}
-        if (response.status != 200):
-            
-            self.logger.info('App url {} -- non 200 response'.format(response.url))
-            appitem['app_crawl_status'] = 'fail'
-            return appitem
+        appitem['app_crawl_status'] = 'fail'
+        return appitem
 
-        kvmap={'Seller':'app_seller', 'Size':'app_size', 'Category':'app_category_name', 'Price':'app_pricing', 'App Support':'app_support_site', 'Developer Website':'app_publisher_home_site', 'Privacy Policy':'app_privacy_policy', 'Copyright':'app_copyright', 'Age Rating':'app_rating', 'In-App Purchases':'inapp_info'}                
-        Soup = BeautifulSoup(response.text, 'lxml')
-        app_name = Soup.find('h1',{'class' : 'product-header__title app-header__title'}).text
-        appitem['app_name'] = re.sub('[\s] +',' ',app_name).strip()
-        app_info = Soup.find_all("div",{"class":"information-list__item l-row"})
-        app_related_links = Soup.find("div",{"class" : 'l-column small-hide medium-show medium-9 medium-offset-3 large-10 large-offset-2'})
-        customer_ratings = Soup.find("div",{"class":"we-customer-ratings__averages"})
-        try:
-                app_ratings=customer_ratings.text
-                appitem['app_content_rating']=re.sub('[\s] +',' ',app_ratings).strip()
-        except:
-                appitem['app_content_rating']='not sufficent ratings'
-
-        for x in app_info:
-                try:
-                        key=(x.find('dt',{'class' : 'information-list__item__term medium-valign-top l-column medium-3 large-2'})).text
-                        value=(x.find('dd',{'class' : 'information-list__item__definition l-column medium-9 large-6'})).text
-
-                        # Check if key is present in kvmap 
-                        # If key not present , then standardize the key and add it to extras 
-                        if key in kvmap:
-                            appitem[re.sub('[\s] +',' ',kvmap[key]).strip()]=re.sub('[\s] +',' ',value).strip()
-                        else:
-                            stdkey = key.replace(' ','_').lower()
-                            extras[stdkey] = value
-                except:
-                        value='nil'
-        for link in app_related_links.findAll('a', href=True):
-                        # Check if key is present in kvmap 
-                        # If key not present , then standardize the key and add it to extras 
-                        if link.text in kvmap:
-                            appitem[kvmap[link.text]]=re.sub('[\s] +',' ',link['href']).strip()
-                        else:
-                            stdkey = link.text.replace(' ','_').lower()
-                            extras[stdkey] = re.sub('[\s] +',' ',link['href']).strip()
-        
-        # Add the extras to the appitem
-        appitem['app_extras'] = re.sub('[\s] +',' ',extras).strip()
-
-            # Updating the App Details Parser 
-            # Dec 14 - Hariharan
-        # Add the app supports to the appitem
-        temp=[]
-        supports = soup.findAll('div',attrs={"class":"supports-list__item__copy"})
-        for x in supports:
-             y = x.find('h3').text
-             temp.append(y.strip())
-        appitem['app_supports'] = temp
-            
-        #Add the app descrption to the appitem
-        description = soup.find("div",{"class" : 'section__description'})
-        appitem['app_version_remarks']=description.find('p').get_text())
-
-        #Add the apps by same developer and the similar apps
-        d={}
-        c={}
-        temp2=soup.find_all("section",{"class":'l-content-width section section--bordered'})
-        for h2tags in temp2:
-            temp=h2tags.find_all("h2",{"class":'section__headline'})
-            for x in temp:
-                names = x.get_text().strip()
-                if names == 'More By This Developer':
-                    app_info=h2tags.find_all("div",{"class" : 'we-lockup__title '})
-                    app_links=h2tags.find_all("a",{"class" : 'targeted-link'})
-                    for z in app_links:
-                        app_href=(z.attrs['href'])
-                        app_names=z.find("div",{"class" : 'we-truncate we-truncate--single-line ember-view targeted-link__target'})
-                        app_name=(app_names.get_text())
-                        d[re.sub('[\s] +',' ',app_name).strip()]=re.sub('[\s] +',' ',app_href).strip()
-                        appitem['more_apps_by_developer']=d
-                elif names == 'You May Also Like':
-                    app_info=h2tags.find_all("div",{"class" : 'we-lockup__title '})
-                    app_links=h2tags.find_all("a",{"class" : 'targeted-link'})
-                    for z in app_links:
-                        app_href=(z.attrs['href'])
-                        app_names=z.find("div",{"class" : 'we-truncate we-truncate--single-line ember-view targeted-link__target'})
-                        app_name=(app_names.get_text())
-                        c[re.sub('[\s] +',' ',app_name).strip()]=re.sub('[\s] +',' ',app_href).strip()
-                        appitem['similar_apps']=c
-
-        return appitem  
+    def sniffLayout(self, response):
+        # Layout of a detail page from its raw bytes , counted per layout
+        page_layout = layout.sniffLayout(response.body)
+        self.incStat('layout/{}'.format(page_layout))
+        return page_layout
+
+    def otherLayoutApp(self, response, page_layout, callback):
+        # A page the v2 parser would fail on : the old layout parser , or a
+        # failed item without parsing for the pages showing no layout
+        appitem = AppItem()
+        appitem['app_for_watch'] = False
+        appitem['app_url'] = response.url
+        if page_layout == layout.LEGACY:
+            return self.legacyFields(response, appitem, callback)
+        self.logger.info('App url {} -- no known layout , skipped'.format(response.url))
+        appitem['app_crawl_status'] = 'fail'
+        return appitem
+
+    def checkUnchanged(self, response):
+        # 'unchanged' record when the page answered 304 or shows the version of the last crawl
+        known = response.meta.get('incremental_known')
+        if known is None:
+            return None
+        if response.status == 304:
+            self.incStat('incremental/not_modified')
+            return self.unchangedApp(response, known)
+        if response.status == 200 and known['app_version'] \
+                and incremental.sniffVersion(response.body) == known['app_version']:
+            self.incStat('incremental/same_version')
+            return self.unchangedApp(response, known)
+        return None
+
+    def unchangedApp(self, response, known):
+        geo, app_id = schema.appGeoAndId(response.url)
+        return incremental.unchangedItem(response.url, geo, app_id, known)
+
+    def fieldTimer(self, callback):
+        # Field group timer of the schemas , None unless TIMING_FIELD_GROUPS
+        if self.timings is None:
+            return None
+        return self.timings.fieldTimer(callback)
+
+    def incStat(self, key, count=1):
+        # Crawl stats are only there when the spider runs inside a crawler
+        crawler = getattr(self, 'crawler', None)
+        if crawler is not None and crawler.stats is not None:
+            crawler.stats.inc_value(key, count)
+
+    def setStat(self, key, value):
+        crawler = getattr(self, 'crawler', None)
+        if crawler is not None and crawler.stats is not None:
+            crawler.stats.set_value(key, value)
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+# Pagination planner for the letter listing pages
+#
+# Instead of following the pagination links page after page , all the pages
+# of a letter are requested at once. The page count comes from the
+# pagination links of the letter's first page , or from the previous crawl
+# when PAGINATION_STATE_FILE has it , in which case the pages go out with
+# the first page. The pagination list may not show every page , so the last
+# planned page , when it still lists Apps , plans PAGINATION_PROBE more. A
+# page past the end lists no App , it is told apart from the raw bytes
+# without building the DOM and ends the probing.
+
+import json
+import os
+import re
+
+from itunesbot.spiders.listing import pat_app_href
+
+#Page number of a pagination link
+pat_page = re.compile(r'[?&]page=(\d+)')
+
+
+def pageUrl(letter_url, page):
+    # Letter url gives page 1
+    if page == 1:
+        return letter_url
+    return '{}&page={}'.format(letter_url, page)
+
+
+def pageCount(links):
+    """
+    :param links: Pagination links of a listing page
+    :return: Highest page number among them , 1 if there is none
+    """
+    count = 1
+    for link in links:
+        match = pat_page.search(link)
+        if match:
+            count = max(count, int(match.group(1)))
+    return count
+
+
+def isEmptyPage(body):
+    # A page past the last one lists no App , no anchor appLinks would take
+    return pat_app_href.search(body) is None
+
+
+class PageCounts(object):
+    """
+    Pages per letter url seen in the crawls , kept in a JSON file
+
+    :param path: JSON file , None keeps the counts for this crawl only
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.previous = {}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.previous = json.load(f)
+        self.seen = {}
+
+    @classmethod
+    def fromSettings(cls, settings):
+        return cls(settings.get('PAGINATION_STATE_FILE'))
+
+    def predicted(self, letter_url):
+        # Pages the letter had in the last crawl , None when unknown
+        return self.previous.get(letter_url)
+
+    def found(self, letter_url, page):
+        # A page that lists Apps
+        if page > self.seen.get(letter_url, 0):
+            self.seen[letter_url] = page
+
+    def save(self):
+        if not self.path:
+            return
+        counts = dict(self.previous)
+        counts.update(self.seen)
+        tmp = '{}.tmp'.format(self.path)
+        with open(tmp, 'w') as f:
+            json.dump(counts, f, indent=0, sort_keys=True)
+        os.replace(tmp, self.path)
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+# Detail page parsing in worker processes
+#
+# Parsing a detail page takes the reactor thread for as long as the DOM is
+# built , no download is scheduled or finished in the meantime. With
+# PARSE_POOL_WORKERS set the bodies are sent to a pool of processes instead ,
+# which run the same extraction and hand back the fields as a plain dict
+# through a Deferred. PARSE_POOL_QUEUE bounds the pages handed to the pool
+# at a time , the callbacks waiting for a slot hold their response back.
+
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+
+from scrapy.http import HtmlResponse
+from twisted.internet import defer, reactor
+
+from itunesbot.items import AppItem
+import itunesbot.spiders.schema as schema
+import itunesbot.spiders.jsonld as jsonld
+
+#Schema of the worker process , compiled on its first page
+worker_schema = None
+
+
+def extractV2(response, v2_schema, v2_fields, timer=None):
+    """
+    Fields of a new layout detail page answered with a 200
+
+    :param response: Detail page response
+    :param v2_schema: Compiled schema.v2_rules
+    :param v2_fields: Fields to extract , those of v2_schema and of jsonld.jsonld_fields
+    :param timer: Optional field group timer of ItemSchema.extract , the JSON-LD blocks are timed as 'jsonld'
+    :return: (AppItem , stat key telling whether the DOM was built)
+    """
+    appitem = AppItem()
+    appitem['app_for_watch'] = False
+    # Store the App URL
+    appitem['app_url'] = response.url
+    appitem['app_crawl_status'] = 'success'
+    # The JSON-LD blocks and the DOM fill different fields , a page whose
+    # requested fields are all JSON-LD ones is served without building the DOM
+    dom_needed = not v2_fields.isdisjoint(v2_schema.field_names)
+    found = {}
+    if not v2_fields.isdisjoint(jsonld.jsonld_fields):
+        started = perf_counter()
+        found = jsonld.extractFields(response.body)
+        if timer is not None:
+            timer('jsonld', perf_counter() - started)
+    if dom_needed:
+        source = 'jsonld/fallback'
+    elif found:
+        source = 'jsonld/sufficient'
+    else:
+        source = 'jsonld/absent'
+
+    if dom_needed:
+        # The fields and their selectors are listed in schema.v2_rules
+        # response.selector is parsed once and cached on the response
+        v2_schema.extract(response.selector.root, appitem, response.url, only=v2_fields, timer=timer)
+    for name, value in found.items():
+        if name in v2_fields:
+            appitem[name] = value
+    return appitem, source
+
+
+def workerExtract(url, content_type, body, fields=None):
+    # Runs in the worker process , the body is decoded there as well
+    global worker_schema
+    if worker_schema is None:
+        v2_schema = schema.ItemSchema(schema.v2_rules)
+        worker_schema = (v2_schema, v2_schema.field_names.union(jsonld.jsonld_fields))
+    headers = {'Content-Type': content_type} if content_type else None
+    v2_schema, v2_fields = worker_schema
+    appitem, source = extractV2(HtmlResponse(url=url, body=body, headers=headers), v2_schema,
+                                v2_fields if fields is None else v2_fields.intersection(fields))
+    return dict(appitem), source
+
+
+class ParsePool(object):
+    """
+    Pool of worker processes parsing detail pages
+
+    :param workers: Number of processes
+    :param queue_size: Pages handed to the pool at a time , twice the workers if not given
+    """
+
+    def __init__(self, workers, queue_size=None):
+        self.workers = workers
+        # Spawned rather than forked , the reactor process has threads running
+        self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        self.slots = defer.DeferredSemaphore(queue_size or workers * 2)
+
+    @classmethod
+    def fromSettings(cls, settings):
+        workers = settings.getint('PARSE_POOL_WORKERS', 0)
+        if workers <= 0:
+            return None
+        return cls(workers, settings.getint('PARSE_POOL_QUEUE', 0) or None)
+
+    def extract(self, response, fields=None):
+        """
+        :param response: Detail page answered with a 200
+        :param fields: Fields to extract , all those of schema.v2_rules and jsonld.jsonld_fields if not given
+        :return: Deferred firing with (dict of the AppItem fields , stat key)
+        """
+        content_type = response.headers.get('Content-Type')
+        if content_type is not None:
+            content_type = content_type.decode('latin-1')
+        return self.slots.run(self.submit, response.url, content_type, response.body, fields)
+
+    def submit(self, url, content_type, body, fields=None):
+        d = defer.Deferred()
+
+        def done(future):
+            # Called on an executor thread , the Deferred fires on the reactor thread
+            error = future.exception()
+            if error is not None:
+                reactor.callFromThread(d.errback, error)
+            else:
+                reactor.callFromThread(d.callback, future.result())
+
+        self.executor.submit(workerExtract, url, content_type, body, fields).add_done_callback(done)
+        return d
+
+    def close(self):
+        self.executor.shutdown(wait=True)
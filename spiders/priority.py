@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+# Priority of the App requests
+#
+# An App request is ranked on how much the App matters and on how long ago
+# it was crawled. Apps listed on the popular genre page get
+# APP_PRIORITY_POPULAR , the rating count of the last crawl adds ten points
+# per power of ten , and every day since the last crawl adds one point up to
+# APP_PRIORITY_STALE_DAYS , which is also what an App never crawled gets.
+# The rating counts and crawl times are kept in APP_PRIORITY_STATE_FILE.
+
+import math
+import sqlite3
+from time import time
+
+
+def appScore(popular, rating_count, crawled_at, now, popular_boost=100, stale_days=30):
+    """
+    :param popular: True if the App is on the popular genre page
+    :param rating_count: Rating count of the last crawl or None
+    :param crawled_at: Time of the last crawl or None
+    :param now: Current time
+    :return: Request priority , higher is crawled first
+    """
+    score = popular_boost if popular else 0
+    if rating_count:
+        score += int(10 * math.log10(1 + rating_count))
+    if crawled_at is None:
+        score += stale_days
+    else:
+        score += min(stale_days, int((now - crawled_at) / 86400))
+    return score
+
+
+class AppPriority(object):
+    """
+    Ranks App requests , keyed on storefront and App Id
+
+    :param path: SQLite file with the last crawl of every App , created if missing
+    :param popular_boost: Points of an App on the popular genre page
+    :param stale_days: Days after which an App counts as stale as one never crawled
+    :param commit_every: Number of writes between commits
+    """
+
+    def __init__(self, path, popular_boost=100, stale_days=30, commit_every=500):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS apps ('
+                          'geo TEXT NOT NULL, app_num TEXT NOT NULL, rating_count INTEGER, crawled_at REAL, '
+                          'PRIMARY KEY (geo, app_num))')
+        self.popular_boost = popular_boost
+        self.stale_days = stale_days
+        self.commit_every = commit_every
+        self.pending = 0
+        #Apps seen on the popular genre page in this crawl
+        self.popular = set()
+
+    @classmethod
+    def fromSettings(cls, settings):
+        return cls(settings.get('APP_PRIORITY_STATE_FILE', 'priority.sqlite'),
+                   popular_boost=settings.getint('APP_PRIORITY_POPULAR', 100),
+                   stale_days=settings.getint('APP_PRIORITY_STALE_DAYS', 30))
+
+    def markPopular(self, geo, app_num):
+        self.popular.add((geo, app_num))
+
+    def score(self, geo, app_num):
+        row = self.conn.execute('SELECT rating_count, crawled_at FROM apps WHERE geo = ? AND app_num = ?',
+                                (geo, app_num)).fetchone()
+        rating_count, crawled_at = row if row is not None else (None, None)
+        return appScore((geo, app_num) in self.popular, rating_count, crawled_at, time(),
+                        self.popular_boost, self.stale_days)
+
+    def record(self, geo, app_num, rating_count):
+        # A crawled App , a missing rating count keeps the last one
+        self.conn.execute('INSERT INTO apps VALUES (?, ?, ?, ?) '
+                          'ON CONFLICT (geo, app_num) DO UPDATE SET crawled_at = excluded.crawled_at , '
+                          'rating_count = COALESCE(excluded.rating_count, apps.rating_count)',
+                          (geo, app_num, rating_count, time()))
+        self.pending += 1
+        if self.pending >= self.commit_every:
+            self.conn.commit()
+            self.pending = 0
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+# Deferred retry queue of the App Detail Pages that failed
+#
+# An App whose page answered one of RETRY_QUEUE_CODES is written to a SQLite
+# file with the time it is due again. The wait doubles with every attempt ,
+# from RETRY_QUEUE_BASE_SECS up to RETRY_QUEUE_MAX_SECS , with jitter so the
+# Apps that failed together are not all retried together. Due Apps are sent
+# again later in the same crawl , the ones still waiting when the crawl ends
+# are picked up at the start of the next one , and -a retry_only=1 crawls
+# nothing but the queue. An App is dropped from the queue once it is crawled
+# , answers a status that is not worth a retry ( 404 ) or was sent again
+# RETRY_QUEUE_MAX_ATTEMPTS times.
+
+import random
+import sqlite3
+from time import time
+
+
+def backoffSecs(attempts, base, cap, rand=random.random):
+    """
+    Wait before the next attempt , half of it fixed and half of it random
+
+    :param attempts: Attempts made so far , 1 after the first failure
+    :param base: Wait after the first failure
+    :param cap: Longest wait
+    :return: Seconds
+    """
+    secs = min(cap, base * 2 ** (attempts - 1))
+    return secs / 2 + rand() * secs / 2
+
+
+class RetryQueue(object):
+    """
+    Failed Apps keyed on storefront and App Id. Taking an App to send it
+    again counts the attempt and already sets the time of the next one , so
+    an App whose retry never answers ( the crawl stopped ) comes back by itself
+
+    :param path: SQLite file , created if missing
+    :param base_secs: Wait after the first failure
+    :param max_secs: Longest wait
+    :param max_attempts: Retries sent for an App before it is given up
+    """
+
+    def __init__(self, path, base_secs=60.0, max_secs=3600.0, max_attempts=5):
+        self.base_secs = base_secs
+        self.max_secs = max_secs
+        self.max_attempts = max_attempts
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS retries ('
+                          'geo TEXT NOT NULL, app_num TEXT NOT NULL, url TEXT NOT NULL, '
+                          'attempts INTEGER NOT NULL, due REAL NOT NULL, status INTEGER, '
+                          'PRIMARY KEY (geo, app_num))')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS retries_due ON retries (due)')
+        #Keys in the queue , most crawled Apps are not in it
+        self.keys = set(self.conn.execute('SELECT geo, app_num FROM retries').fetchall())
+
+    @classmethod
+    def fromSettings(cls, settings):
+        return cls(settings.get('RETRY_QUEUE_FILE', 'retryqueue.sqlite'),
+                   base_secs=settings.getfloat('RETRY_QUEUE_BASE_SECS', 60.0),
+                   max_secs=settings.getfloat('RETRY_QUEUE_MAX_SECS', 3600.0),
+                   max_attempts=settings.getint('RETRY_QUEUE_MAX_ATTEMPTS', 5))
+
+    def add(self, geo, app_num, url, status):
+        """
+        Queue an App after a failed attempt , an App already queued keeps its schedule
+
+        :param status: HTTP status of the failed attempt
+        :return: True if the App was not queued yet
+        """
+        due = time() + backoffSecs(1, self.base_secs, self.max_secs)
+        self.conn.execute('INSERT INTO retries VALUES (?, ?, ?, 0, ?, ?) '
+                          'ON CONFLICT (geo, app_num) DO UPDATE SET status = excluded.status',
+                          (geo, app_num, url, due, status))
+        self.conn.commit()
+        if (geo, app_num) in self.keys:
+            return False
+        self.keys.add((geo, app_num))
+        return True
+
+    def take(self, until=None):
+        """
+        Apps to send again , each taken App counts an attempt and is due again after the next wait
+
+        :param until: Time the Apps are due by , now if not given , float('inf') for all of them
+        :return: (list of (geo , app_num , url) , number of Apps given up)
+        """
+        now = time()
+        rows = self.conn.execute('SELECT geo, app_num, url, attempts FROM retries WHERE due <= ? ORDER BY due',
+                                 (now if until is None else until,)).fetchall()
+        taken = []
+        given_up = 0
+        for geo, app_num, url, attempts in rows:
+            if attempts >= self.max_attempts:
+                self.conn.execute('DELETE FROM retries WHERE geo = ? AND app_num = ?', (geo, app_num))
+                self.keys.discard((geo, app_num))
+                given_up += 1
+                continue
+            due = now + backoffSecs(attempts + 2, self.base_secs, self.max_secs)
+            self.conn.execute('UPDATE retries SET attempts = ?, due = ? WHERE geo = ? AND app_num = ?',
+                              (attempts + 1, due, geo, app_num))
+            taken.append((geo, app_num, url))
+        self.conn.commit()
+        return taken, given_up
+
+    def nextDue(self):
+        # Time the next App is due , None when the queue is empty
+        return self.conn.execute('SELECT MIN(due) FROM retries').fetchone()[0]
+
+    def done(self, geo, app_num):
+        if (geo, app_num) not in self.keys:
+            return
+        self.keys.discard((geo, app_num))
+        self.conn.execute('DELETE FROM retries WHERE geo = ? AND app_num = ?', (geo, app_num))
+        self.conn.commit()
+
+    def __contains__(self, key):
+        return key in self.keys
+
+    def __len__(self):
+        return len(self.keys)
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
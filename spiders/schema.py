@@ -0,0 +1,609 @@
+# -*- coding: utf-8 -*-
+
+# Declarative extraction schema for AppItem
+#
+# Each AppItem field is described once , as a selector plus a normalizer.
+# ItemSchema compiles the rules into lxml XPath objects when the spider starts
+# and then runs them over the parsed tree of every page in a single pass , so
+# adding a field is a schema edit and no selector string is parsed per page.
+
+import re
+from time import perf_counter
+from urllib.parse import urlparse
+
+from lxml import etree
+from parsel.csstranslator import HTMLTranslator
+
+import itunesbot.spiders.country_code_map as ccode
+
+#Pattern used to squash the runs of whitespace left around the text nodes
+pat_spaces = re.compile(r'[\s] +')
+ascii_spaces = ' \n\t\x0c\r'
+
+css_translator = HTMLTranslator()
+
+#Marks a field without a default , the field is left unset when nothing matched
+MISSING = object()
+
+
+def compilePath(css=None, xpath=None):
+    """
+    Compile a CSS or XPath selector into an lxml XPath object
+
+    :param css: CSS selector , the parsel ::text and ::attr() extensions are supported
+    :param xpath: XPath expression , evaluated relative to the node it is run on
+    :return: etree.XPath
+    """
+    if css is not None:
+        xpath = css_translator.css_to_xpath(css)
+    return etree.XPath(xpath, smart_strings=False)
+
+
+def compilePaths(css=None, xpath=None):
+    # A field may list several selectors , tried in order until one matches
+    paths = css if css is not None else xpath
+    if isinstance(paths, (list, tuple)):
+        if css is not None:
+            return [compilePath(css=p) for p in paths]
+        return [compilePath(xpath=p) for p in paths]
+    return [compilePath(css=css, xpath=xpath)]
+
+
+def collapseBlank(text):
+    # Whitespace only text nodes are collapsed the way BeautifulSoup does it
+    if text.strip(ascii_spaces):
+        return text
+    return '\n' if '\n' in text else ' '
+
+
+def nodeText(node):
+    return ''.join(collapseBlank(text) for text in node.itertext())
+
+
+def squashSpaces(val):
+    return pat_spaces.sub(' ', val).strip()
+
+
+# Ways of turning the matched results into a value
+
+def first(results):
+    return results[0]
+
+
+def textOf(results):
+    # Full text content of the first matched node
+    return nodeText(results[0])
+
+
+def exists(results):
+    return True
+
+
+class Field(object):
+    """
+    Extracts one item field
+
+    :param name: AppItem field to fill
+    :param css: CSS selector(s) of the value
+    :param xpath: XPath selector(s) of the value
+    :param take: Turns the list of matches into the value ( first , textOf , exists )
+    :param normalize: Optional function applied to the value
+    :param default: Value stored when nothing matched , the field is left unset if not given
+    :param many: The whole list of matches , empty or not , is passed to normalize
+    """
+
+    def __init__(self, name, css=None, xpath=None, take=first, normalize=None, default=MISSING, many=False):
+        self.name = name
+        self.css = css
+        self.xpath = xpath
+        self.take = take
+        self.normalize = normalize
+        self.default = default
+        self.many = many
+
+    def fields(self):
+        return [self.name]
+
+    def compile(self):
+        name, take, normalize, default = self.name, self.take, self.normalize, self.default
+        paths = compilePaths(self.css, self.xpath)
+
+        if self.many:
+            path = paths[0]
+            normalize = normalize or list
+
+            def run(node, item, url, only=None):
+                item[name] = normalize(path(node))
+            return run
+
+        def run(node, item, url, only=None):
+            for path in paths:
+                results = path(node)
+                if results:
+                    value = take(results)
+                    item[name] = normalize(value) if normalize is not None else value
+                    return
+            if default is not MISSING:
+                item[name] = default
+        return run
+
+
+class Const(object):
+    """
+    Stores a fixed value , used inside Rows cases that only flag something
+    """
+
+    def __init__(self, name, value):
+        self.name = name
+        self.value = value
+
+    def fields(self):
+        return [self.name]
+
+    def compile(self):
+        name, value = self.name, self.value
+
+        def run(node, item, url, only=None):
+            item[name] = value
+        return run
+
+
+class Computed(object):
+    """
+    Derives fields from the fields already extracted and the page url
+
+    :param names: AppItem fields set by the function
+    :param function: Called as function(item, url)
+    """
+
+    def __init__(self, names, function):
+        self.names = names
+        self.function = function
+
+    def fields(self):
+        return list(self.names)
+
+    def compile(self):
+        function = self.function
+
+        def run(node, item, url, only=None):
+            function(item, url)
+        return run
+
+
+class Case(object):
+    """
+    One alternative of a Rows rule , the test is an XPath relative to the row
+    and the rules run only for rows where it matches
+    """
+
+    def __init__(self, test, rules):
+        self.test = test
+        self.rules = rules
+
+
+class Rows(object):
+    """
+    Walks a list of rows and runs the rules of the first Case matching each row
+
+    :param css: CSS selector of the rows
+    :param xpath: XPath selector of the rows
+    :param cases: Ordered list of Case
+    """
+
+    def __init__(self, cases, css=None, xpath=None):
+        self.css = css
+        self.xpath = xpath
+        self.cases = cases
+
+    def fields(self):
+        return [name for case in self.cases for rule in case.rules for name in rule.fields()]
+
+    def compile(self):
+        rows = compilePath(self.css, self.xpath)
+        cases = [(compilePath(xpath=case.test), [rule.compile() for rule in case.rules])
+                 for case in self.cases]
+
+        def run(node, item, url, only=None):
+            for row in rows(node):
+                for test, rules in cases:
+                    if test(row):
+                        for rule in rules:
+                            rule(row, item, url, only)
+                        break
+        return run
+
+
+class Table(object):
+    """
+    Reads key / value rows , keys found in keymap fill the mapped field and
+    the others are kept in the extras field under a standardized key. The
+    value of a row whose field is not asked for is not read
+
+    :param keymap: Displayed key to AppItem field
+    :param extras: AppItem field holding the dict of unmapped keys
+    :param rows: XPath of the rows
+    :param key: XPath of the key relative to the row , taken with key_take
+    :param value: XPath of the value relative to the row , taken with value_take
+    :param normalize: Function applied to mapped values
+    :param normalize_extras: Function applied to unmapped values
+    """
+
+    def __init__(self, keymap, extras, rows, key, value, key_take=textOf, value_take=textOf,
+                 normalize=None, normalize_extras=None):
+        self.keymap = keymap
+        self.extras = extras
+        self.rows = rows
+        self.key = key
+        self.value = value
+        self.key_take = key_take
+        self.value_take = value_take
+        self.normalize = normalize
+        self.normalize_extras = normalize_extras
+
+    def fields(self):
+        return list(self.keymap.values()) + [self.extras]
+
+    def compile(self):
+        keymap, extras_name = self.keymap, self.extras
+        key_take, value_take = self.key_take, self.value_take
+        normalize = self.normalize or (lambda val: val)
+        normalize_extras = self.normalize_extras or (lambda val: val)
+        rows = compilePath(xpath=self.rows)
+        key_path = compilePath(xpath=self.key)
+        value_path = compilePath(xpath=self.value)
+
+        def run(node, item, url, only=None):
+            keep_extras = only is None or extras_name in only
+            if keep_extras:
+                extras = item.get(extras_name)
+                if extras is None:
+                    extras = item[extras_name] = {}
+            for row in rows(node):
+                key = key_path(row)
+                if not key:
+                    continue
+                key = key_take(key)
+                field = keymap.get(key)
+                if field is None:
+                    if not keep_extras:
+                        continue
+                elif only is not None and field not in only:
+                    continue
+                value = value_path(row)
+                if not value:
+                    continue
+                value = value_take(value)
+                if field is not None:
+                    item[field] = normalize(value)
+                else:
+                    extras[key.replace(' ', '_').lower()] = normalize_extras(value)
+        return run
+
+
+class Sections(object):
+    """
+    Collects the {AppName : AppURL} links of the sections whose headline
+    is one of the given titles
+
+    :param titles: Headline text to AppItem field
+    :param sections: XPath of the sections
+    :param headline: XPath of the headlines relative to the section
+    :param links: XPath of the links relative to the section
+    :param name: XPath of the link name relative to the link
+    """
+
+    def __init__(self, titles, sections, headline, links, name):
+        self.titles = titles
+        self.sections = sections
+        self.headline = headline
+        self.links = links
+        self.name = name
+
+    def fields(self):
+        return list(self.titles.values())
+
+    def compile(self):
+        titles = self.titles
+        sections = compilePath(xpath=self.sections)
+        headline = compilePath(xpath=self.headline)
+        links = compilePath(xpath=self.links)
+        name = compilePath(xpath=self.name)
+
+        def run(node, item, url, only=None):
+            collected = {}
+            for section in sections(node):
+                for title in headline(section):
+                    field = titles.get(nodeText(title).strip())
+                    if field is None or (only is not None and field not in only):
+                        continue
+                    related = collected.setdefault(field, {})
+                    for link in links(section):
+                        app_name = name(link)
+                        app_name = nodeText(app_name[0]) if app_name else ''
+                        related[squashSpaces(app_name)] = squashSpaces(link.get('href', ''))
+                        item[field] = related
+        return run
+
+
+class ItemSchema(object):
+    """
+    A compiled list of rules , built once and run over every page
+
+    :param rules: List of Field , Const , Computed , Rows , Table or Sections
+    """
+
+    def __init__(self, rules):
+        self.rules = rules
+        self.compiled = [(frozenset(rule.fields()), rule.compile()) for rule in rules]
+        #Every field the rules fill
+        self.field_names = frozenset(name for names, _ in self.compiled for name in names)
+        #Field group of every rule , by its first field listed in field_groups
+        self.groups = [next((field_groups[name] for name in rule.fields() if name in field_groups), 'other')
+                       for rule in rules]
+
+    def fields(self):
+        return [name for rule in self.rules for name in rule.fields()]
+
+    def extract(self, root, item, url, only=None, timer=None):
+        """
+        Fill the item from the parsed page
+
+        :param root: lxml root element of the page ( response.selector.root )
+        :param item: AppItem to fill
+        :param url: URL of the page
+        :param only: Optional set of fields , rules filling none of them are skipped and the
+                     Table and Sections rules leave out the rows of the other fields
+        :param timer: Optional function taking a field group and the seconds its rules took on the page
+        :return: The item
+        """
+        if timer is None:
+            for names, run in self.compiled:
+                if only is None or not names.isdisjoint(only):
+                    run(root, item, url, only)
+            return item
+
+        spent = {}
+        for (names, run), group in zip(self.compiled, self.groups):
+            if only is None or not names.isdisjoint(only):
+                started = perf_counter()
+                run(root, item, url, only)
+                spent[group] = spent.get(group, 0.0) + perf_counter() - started
+        for group, secs in spent.items():
+            timer(group, secs)
+        return item
+
+
+# Normalizers shared by the rule lists below
+
+pat_row_text = etree.XPath('text()', smart_strings=False)
+pat_span_text = etree.XPath('descendant-or-self::span/text()', smart_strings=False)
+pat_link_href = etree.XPath('a/@href', smart_strings=False)
+pat_review_label = etree.XPath('h5/div/@aria-label', smart_strings=False)
+pat_review_text = etree.XPath('p/text()', smart_strings=False)
+pat_support_title = etree.XPath('.//h3', smart_strings=False)
+
+
+def categoryId(url):
+    try:
+        segments = urlparse(url).path.split('/')
+        return segments[4].replace('id', '')
+    except:
+        return 'na'
+
+
+def joinRatingReasons(rows):
+    return ''.join(pat_row_text(row)[0].strip() for row in rows)
+
+
+def joinInappInfo(rows):
+    return ''.join(' '.join(pat_span_text(row)) + '||' for row in rows)
+
+
+def joinAlsoBought(rows):
+    return ''.join(pat_link_href(row)[0].rstrip() + '||' for row in rows)
+
+
+def joinCustomerReviews(rows):
+    tmp = ''
+    for row in rows:
+        tmp = tmp + pat_review_label(row)[0] + ':'
+        tmp = tmp.replace('\n', '')
+        tmp = tmp.replace('\t', '')
+        tmp = tmp + pat_review_text(row)[0].strip() + '|'
+        tmp = tmp.lstrip().replace('\n', '').replace('\t', '')
+    return tmp
+
+
+def supportsList(rows):
+    titles = []
+    for row in rows:
+        title = pat_support_title(row)
+        titles.append(nodeText(title[0]).strip() if title else '')
+    return titles
+
+
+def versionNumber(val):
+    # 'Version 1.2.3' , the label is localized so only the last word is kept
+    return squashSpaces(val).split(' ')[-1]
+
+
+def copyStarRating(item, url):
+    item['app_star_rating_cv'] = item['app_rating_value_cv']
+
+
+def appGeoAndId(url):
+    """
+    :param url: App url as linked from the listing pages
+    :return: (storefront code , numeric App Id as a string) , None for a part not found
+    """
+    segments = urlparse(url).path.split('/')
+    geo = segments[1] if len(segments) > 1 and segments[1] else None
+    for segment in reversed(segments):
+        if segment.startswith('id') and segment[2:].isdigit():
+            return geo, segment[2:]
+    return geo, None
+
+
+def storeFields(item, url):
+    # Store the App Geo and App Id
+    segments = urlparse(url).path.split('/')
+    item['app_geo'] = segments[1]
+    item['app_num'] = segments[4].replace('id', '')
+    if item['app_geo'] in ccode.country_codes_map:
+        item['app_country'] = ccode.country_codes_map[item['app_geo']]
+
+
+#Fields every AppItem keeps with the fields= projection , the App link gives all of them
+link_fields = frozenset(['app_url', 'app_crawl_status', 'app_geo', 'app_num', 'app_country'])
+#Computed fields and the fields they are computed from
+field_inputs = {'app_star_rating_cv': ('app_rating_value_cv',)}
+
+
+def projectionFields(spec, item_fields):
+    """
+    Fields of the fields= projection
+
+    :param spec: Comma separated AppItem field names
+    :param item_fields: All the AppItem fields
+    :return: (fields the items keep , fields the schemas have to extract for them)
+    """
+    requested = set(name.strip() for name in spec.split(',') if name.strip())
+    unknown = requested.difference(item_fields)
+    if unknown:
+        raise ValueError('Unknown AppItem fields {}'.format(', '.join(sorted(unknown))))
+    kept = frozenset(requested.union(link_fields))
+    extracted = set(kept)
+    for name in kept:
+        extracted.update(field_inputs.get(name, ()))
+    return kept, frozenset(extracted)
+
+
+def projectItem(item, fields):
+    # Drop what the rules filling several fields at once set beyond the projection
+    for name in [name for name in item if name not in fields]:
+        del item[name]
+    return item
+
+
+def lowerContains(path, word):
+    # XPath test for word in the lower cased string of path
+    return 'contains(translate({}, "{}", "{}"), "{}")'.format(path, word.upper(), word, word)
+
+
+LEFT_STACK = '#left-stack > div.lockup.product.application'
+RATINGS = '#left-stack > div.extra-list.customer-ratings'
+CENTER_STACK = '#content > div > div.center-stack'
+FIRST_SPAN_TEXT = 'string((descendant-or-self::span/text())[1])'
+
+# Rules for the old layout (#left-stack) parsed by parseAppDetails
+legacy_rules = [
+    Field('app_html_lang', css='html::attr(lang)', default='Not Found'),
+    Field('app_title', css='head > title::text', default='Not Found'),
+    Field('app_name', css='#title > div.left > h1::text', default='Not Found'),
+    Field('app_publisher', css='#title > div.left > h2::text', default='Not Found'),
+    Field('app_publisher_store_site', css='#title > div.right > a::attr(href)', default='Not Found'),
+    Field('app_publisher_home_site', css=CENTER_STACK + ' > div.app-links > a:nth-child(1)::attr(href)',
+          default='Not Found'),
+    Field('app_support_site', css=CENTER_STACK + ' > div.app-links > a:nth-child(2)::attr(href)',
+          default='Not Found'),
+    Rows(css=LEFT_STACK + ' > ul > li', cases=[
+        Case('span[contains(@itemprop,"offers")]/div/text()', [
+            Field('app_pricing', xpath='span[contains(@itemprop,"offers")]/div/text()'),
+            Field('is_paid', xpath='span[contains(@itemprop,"offers")]/div/text()',
+                  normalize=lambda val: "Free" not in val),
+        ]),
+        Case('contains(@class,"genre")', [
+            Field('app_category_name', css='a > span::text', default=None),
+            Field('app_category_id', css='a::attr(href)', normalize=categoryId, default='na'),
+        ]),
+        Case('contains(@class,"release")', [
+            Field('app_date_updated', css='span:nth-child(2)::text', default='Not Found'),
+            Field('app_date_published', css='span:nth-child(2)::attr(content)', default='Not Found'),
+        ]),
+        Case('contains(@class,"language")', [
+            Field('app_lang', xpath='text()', default='Not Found'),
+        ]),
+        Case('span[contains(@itemprop,"softwareVersion")]/text()', [
+            Field('app_version', xpath='span[contains(@itemprop,"softwareVersion")]/text()'),
+        ]),
+        Case(lowerContains(FIRST_SPAN_TEXT, 'size'), [
+            Field('app_size', xpath='text()', default='Not Found'),
+        ]),
+        Case(lowerContains(FIRST_SPAN_TEXT, 'watch'), [
+            Const('app_for_watch', True),
+        ]),
+        Case('span[contains(@itemprop,"author")]/span/text()', [
+            Field('app_seller', xpath='span[contains(@itemprop,"author")]/span/text()'),
+        ]),
+    ]),
+    Field('app_content_rating', css=[LEFT_STACK + ' > div.app-rating > a::text',
+                                     LEFT_STACK + ' > div > a::text'], default='Not found'),
+    Field('app_content_rating_reasons', css=LEFT_STACK + ' > div.app-rating > ul > li', many=True,
+          normalize=joinRatingReasons),
+    Field('app_compatibility', xpath='//*[@id="left-stack"]/div[1]/p/span[2]/text()', default='Not Found'),
+    Field('app_rating_value_cv', css=RATINGS + ' > div:nth-child(3) > span:nth-child(1)::text',
+          normalize=float, default=0.0),
+    # The counts are kept as shown , '1,234 Ratings' , NormalizePipeline turns them into numbers
+    Field('app_review_counts_cv', css=RATINGS + ' > div:nth-child(3) > span.rating-count::text', default=0),
+    Computed(['app_star_rating_cv'], copyStarRating),
+    Field('app_rating_cv', css=RATINGS + ' > div:nth-child(3)::attr(aria-label)', default='Not Found'),
+    Field('app_rating_av', css=RATINGS + ' > div:nth-child(5)::attr(aria-label)', default='Not Found'),
+    Field('app_review_counts_av', css=RATINGS + ' > div:nth-child(5) > span.rating-count::text'),
+    Field('has_inapp', css='#left-stack > div.extra-list.in-app-purchases > h4', take=exists, default=False),
+    Field('inapp_info', css='#left-stack > div.extra-list.in-app-purchases > ol > li', many=True,
+          normalize=joinInappInfo),
+    Field('app_description', css=CENTER_STACK + ' > div:nth-child(1) > p::text', many=True,
+          normalize=' '.join),
+    Field('app_version_remarks', css=CENTER_STACK + ' > div:nth-child(3) > p::text', many=True,
+          normalize=' '.join),
+    Field('app_cust_also_bought', css=CENTER_STACK + ' > div:nth-child(6) > div.content > div > div',
+          many=True, normalize=joinAlsoBought),
+    Field('app_customer_reviews', css=CENTER_STACK + ' > div.customer-reviews > div', many=True,
+          normalize=joinCustomerReviews),
+    Computed(['app_geo', 'app_num', 'app_country'], storeFields),
+]
+
+# Information list term to AppItem field for the new layout
+kvmap = {'Seller': 'app_seller', 'Size': 'app_size', 'Category': 'app_category_name', 'Price': 'app_pricing',
+         'App Support': 'app_support_site', 'Developer Website': 'app_publisher_home_site',
+         'Privacy Policy': 'app_privacy_policy', 'Copyright': 'app_copyright', 'Age Rating': 'app_rating',
+         'In-App Purchases': 'inapp_info'}
+
+#Field to the group it is timed in ( TIMING_FIELD_GROUPS ) , the other fields are timed as 'other'
+field_groups = dict(
+    [(name, 'info_list') for name in list(kvmap.values()) + ['app_extras', 'app_category_id', 'is_paid',
+                                                              'app_date_published', 'app_lang']] +
+    [(name, 'ratings') for name in ('app_content_rating', 'app_rating_value_cv', 'app_review_counts_cv',
+                                    'app_star_rating_cv', 'app_rating_cv', 'app_rating_av',
+                                    'app_review_counts_av', 'app_customer_reviews')] +
+    [(name, 'related_apps') for name in ('more_apps_by_developer', 'similar_apps', 'app_cust_also_bought')] +
+    [(name, 'supports') for name in ('app_supports', 'app_compatibility', 'app_for_watch')])
+
+# Rules for the new layout (product-header) parsed by parseAppDetails_v2
+v2_rules = [
+    Field('app_name', xpath='//h1[@class="product-header__title app-header__title"]', take=textOf,
+          normalize=squashSpaces, default=''),
+    Field('app_content_rating', css='div.we-customer-ratings__averages', take=textOf,
+          normalize=squashSpaces, default='not sufficent ratings'),
+    Table(kvmap, 'app_extras',
+          rows='//div[@class="information-list__item l-row"]',
+          key='.//dt[@class="information-list__item__term medium-valign-top l-column medium-3 large-2"]',
+          value='.//dd[@class="information-list__item__definition l-column medium-9 large-6"]',
+          normalize=squashSpaces),
+    Table(kvmap, 'app_extras',
+          rows='(//div[@class="l-column small-hide medium-show medium-9 medium-offset-3 large-10 '
+               'large-offset-2"])[1]//a[@href]',
+          key='.', value='@href', value_take=first,
+          normalize=squashSpaces, normalize_extras=squashSpaces),
+    Field('app_version', css='p.whats-new__latest__version', take=textOf, normalize=versionNumber),
+    Field('app_date_updated', css='div.whats-new__latest time::attr(datetime)'),
+    Field('app_supports', css='div.supports-list__item__copy', many=True, normalize=supportsList),
+    Field('app_version_remarks', xpath=css_translator.css_to_xpath('div.section__description') + '/descendant::p[1]',
+          take=textOf),
+    Sections({'More By This Developer': 'more_apps_by_developer', 'You May Also Like': 'similar_apps'},
+             sections='//section[@class="l-content-width section section--bordered"]',
+             headline=css_translator.css_to_xpath('h2.section__headline'),
+             links=css_translator.css_to_xpath('a.targeted-link'),
+             name='.//div[@class="we-truncate we-truncate--single-line ember-view targeted-link__target"]'),
+]
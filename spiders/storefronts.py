@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+# Storefront fan-out
+#
+# With -a storefronts=all ( or a list like gb,de,fr ) the listing pages are
+# crawled once , on the storefront of the start url , and every App found
+# there is then fetched from each of the other storefronts. The fields that
+# do not vary by country are taken from the first storefront's item instead
+# of being parsed again , and every storefront gets its own download slot
+# so one slow storefront does not hold up the others.
+
+from urllib.parse import urlparse, urlunparse
+
+import itunesbot.spiders.country_code_map as ccode
+
+#Fields that are the same on every storefront , copied from the first one
+invariant_fields = frozenset(['app_version', 'app_date_updated', 'app_date_published', 'app_compatibility',
+                              'app_seller', 'app_copyright', 'app_support_site', 'app_publisher_home_site',
+                              'app_privacy_policy', 'app_size', 'supported_devices', 'app_for_watch'])
+
+
+def storefrontList(spec, primary):
+    """
+    :param spec: 'all' or comma separated storefront codes of country_codes_map
+    :param primary: Storefront of the start url , left out of the list
+    :return: Storefront codes to fan out to
+    """
+    if spec == 'all':
+        geos = sorted(ccode.country_codes_map)
+    else:
+        geos = [geo.strip() for geo in spec.split(',') if geo.strip()]
+        unknown = [geo for geo in geos if geo not in ccode.country_codes_map]
+        if unknown:
+            raise ValueError('Unknown storefronts {} , see country_code_map'.format(', '.join(unknown)))
+    return [geo for geo in geos if geo != primary]
+
+
+def storefrontUrl(url, geo):
+    # Same page on another storefront , the storefront is the first path segment
+    parts = urlparse(url)
+    segments = parts.path.split('/')
+    segments[1] = geo
+    return urlunparse(parts._replace(path='/'.join(segments)))
+
+
+def downloadSlot(geo):
+    return 'storefront-{}'.format(geo)
+
+
+def slotSettings(settings, geos):
+    """
+    DOWNLOAD_SLOTS with a slot per storefront , STOREFRONT_CONCURRENCY
+    requests at a time or the budget given in STOREFRONT_BUDGETS
+
+    :param settings: Crawler settings
+    :param geos: Storefront codes
+    """
+    slots = dict(settings.getdict('DOWNLOAD_SLOTS'))
+    concurrency = settings.getint('STOREFRONT_CONCURRENCY', 2)
+    budgets = settings.getdict('STOREFRONT_BUDGETS')
+    for geo in geos:
+        slots.setdefault(downloadSlot(geo), {'concurrency': int(budgets.get(geo, concurrency))})
+    return slots
+
+
+def invariantFields(item):
+    # The country invariant fields of a fully parsed item
+    return dict((name, item[name]) for name in invariant_fields if name in item)
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+
+from scrapy.http import HtmlResponse, Request
+
+from itunesbot.middlewares import IncrementalRecrawlMiddleware
+from itunesbot.spiders.incremental import IncrementalState
+from itunesbot.spiders.main import AppSpider
+
+URL = 'https://itunes.apple.com/us/app/some-app/id100000000?mt=8'
+
+
+def pageResponse(etag, flags=None):
+    return HtmlResponse(url=URL, body=b'<html></html>', request=Request(URL), flags=flags,
+                        headers={'ETag': etag, 'Last-Modified': 'Wed, 06 Dec 2017 10:00:00 GMT'})
+
+
+def test_cached_responses_keep_the_validators():
+    spider = AppSpider()
+    spider.incremental_state = IncrementalState(':memory:')
+    mw = IncrementalRecrawlMiddleware()
+
+    mw.process_response(Request(URL), pageResponse('"fresh"'), spider)
+    assert spider.incremental_state.get('us', '100000000')['etag'] == '"fresh"'
+
+    # A page replayed from the HTTP cache carries the validators of an older fetch
+    mw.process_response(Request(URL), pageResponse('"stale"', flags=['cached']), spider)
+    assert spider.incremental_state.get('us', '100000000')['etag'] == '"fresh"'
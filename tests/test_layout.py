@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+
+from scrapy.http import HtmlResponse, Request
+
+from itunesbot.benchmarks.pages import render_v2_detail_page
+from itunesbot.spiders import layout
+from itunesbot.spiders.main import AppSpider
+
+
+def test_jsonld_alone_is_not_the_new_layout():
+    url, html = render_v2_detail_page(100000000)
+    assert layout.sniffLayout(html.encode('utf-8')) == layout.V2
+    # The JSON-LD record of the page without the rest of it
+    start = html.index('<script name="schema:software-application"')
+    body = '<html><head>{}</head><body></body></html>'.format(html[start:html.index('</script>', start) + 9])
+    assert layout.sniffLayout(body.encode('utf-8')) == layout.SKIP
+
+    item = AppSpider().parseAppDetails_v2(HtmlResponse(url=url, body=body, encoding='utf-8', request=Request(url)))
+    assert item['app_crawl_status'] == 'fail'
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+from scrapy.http import HtmlResponse, Request
+
+from itunesbot.benchmarks.pages import render_v2_detail_page
+from itunesbot.spiders import jsonld, parsepool, schema
+from itunesbot.spiders.main import AppSpider
+
+PROJECTIONS = ['app_name,app_seller,app_category_name',
+               'is_paid,app_rating_value_av,app_review_counts_av,app_description',
+               'app_name,is_paid,app_size']
+
+
+def pageResponse(app_id):
+    url, html = render_v2_detail_page(app_id)
+    return HtmlResponse(url=url, body=html, encoding='utf-8', request=Request(url))
+
+
+@pytest.mark.parametrize('fields', PROJECTIONS)
+def test_projected_item_is_the_full_item_restricted(fields):
+    full_spider = AppSpider()
+    spider = AppSpider(fields=fields)
+    for app_id in range(100000000, 100000020):
+        full = full_spider.parseAppDetails_v2(pageResponse(app_id))
+        projected = schema.projectItem(spider.parseAppDetails_v2(pageResponse(app_id)), spider.item_fields)
+        assert dict(projected) == {name: value for name, value in full.items() if name in spider.item_fields}
+
+
+def test_jsonld_projection_skips_the_dom():
+    v2_schema = schema.ItemSchema(schema.v2_rules)
+    response = pageResponse(100000000)
+    appitem, source = parsepool.extractV2(response, v2_schema, frozenset(['is_paid', 'app_description']))
+    assert source == 'jsonld/sufficient'
+    assert appitem['app_description']
+    assert response._cached_selector is None
+
+
+def test_jsonld_fields_are_not_dom_fields():
+    assert jsonld.jsonld_fields.isdisjoint(schema.ItemSchema(schema.v2_rules).field_names)
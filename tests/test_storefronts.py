@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+
+from scrapy.http import HtmlResponse, Request
+
+from itunesbot.benchmarks.pages import render_v2_detail_page
+from itunesbot.spiders import schema
+from itunesbot.spiders import storefronts as fanout
+from itunesbot.spiders.main import AppSpider
+
+
+def spyNormalize(normalize, taken):
+    def spy(val):
+        value = normalize(val)
+        taken.append(value)
+        return value
+    return spy
+
+
+def test_storefront_parse_skips_the_invariant_rows(monkeypatch):
+    # Every value a Table rule reads goes through its normalize
+    taken = []
+    for rule in schema.v2_rules:
+        if isinstance(rule, schema.Table):
+            monkeypatch.setattr(rule, 'normalize', spyNormalize(rule.normalize, taken))
+    spider = AppSpider(storefronts='au')
+
+    url, html = render_v2_detail_page(100000000)
+    full = spider.parseAppDetails_v2(HtmlResponse(url=url, body=html, encoding='utf-8', request=Request(url)))
+    base = fanout.invariantFields(full)
+    # Seller , size , support site , developer site , privacy policy and copyright
+    table_fields = fanout.invariant_fields.intersection(schema.kvmap.values())
+    invariant_values = set(base[name] for name in table_fields if name in base)
+    assert len(invariant_values) >= 4
+    assert invariant_values <= set(taken)
+
+    del taken[:]
+    au_url = fanout.storefrontUrl(url, 'au')
+    request = Request(au_url, meta={'storefront_base': base})
+    item = spider.parseStorefront(HtmlResponse(url=au_url, body=html, encoding='utf-8', request=request))
+    assert taken
+    assert invariant_values.isdisjoint(taken)
+    assert dict(item, app_url=url) == dict(full)
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+
+# Hot path timing ( TIMING_ENABLED )
+#
+# The spider callbacks marked with @timed , the field groups of the detail
+# page schemas ( TIMING_FIELD_GROUPS , see schema.field_groups ) and the wait
+# of every response between its download and its callback are recorded in
+# histograms. They are written to the crawl stats when the spider closes and ,
+# with TIMING_PROMETHEUS_PORT set , served in the Prometheus text format on
+# http://127.0.0.1:<port>/metrics while the crawl runs.
+
+import bisect
+import functools
+import inspect
+from time import perf_counter
+
+from twisted.web.resource import Resource
+
+#Upper bounds of the histogram buckets in seconds
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+#Metric name to ( Prometheus help , label names )
+METRICS = {
+    'callback': ('Time spent in the spider callbacks', ('callback',)),
+    'field_group': ('Time spent extracting a group of fields from a detail page', ('callback', 'group')),
+    'queue_wait': ('Time between the download of a response and the start of its callback', ('callback',)),
+}
+
+
+class Histogram(object):
+    """
+    Counts of observations per bucket , with their sum
+
+    :param buckets: Sorted upper bounds in seconds , a last +Inf bucket is added
+    """
+
+    __slots__ = ('buckets', 'counts', 'total', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, secs):
+        self.counts[bisect.bisect_left(self.buckets, secs)] += 1
+        self.total += secs
+        self.count += 1
+
+    def quantile(self, q):
+        """
+        :return: Upper bound of the bucket holding the q quantile , None past the last bucket
+        """
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return None
+
+
+def formatBound(bound):
+    return '{:g}'.format(bound)
+
+
+class Timings(object):
+    """
+    Histograms per metric and label values
+
+    :param buckets: Upper bounds of the buckets in seconds
+    :param field_groups: True to time the field groups of the detail pages
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, field_groups=False):
+        self.buckets = tuple(sorted(buckets))
+        self.field_groups = field_groups
+        self.histograms = {}
+
+    @classmethod
+    def fromSettings(cls, settings):
+        buckets = settings.getlist('TIMING_BUCKETS') or DEFAULT_BUCKETS
+        return cls([float(bound) for bound in buckets], field_groups=settings.getbool('TIMING_FIELD_GROUPS'))
+
+    def observe(self, metric, labels, secs):
+        """
+        :param metric: Key of METRICS
+        :param labels: Tuple of label values , in the order of the label names of the metric
+        :param secs: Observed time in seconds
+        """
+        key = (metric, labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram(self.buckets)
+        histogram.observe(secs)
+
+    def fieldTimer(self, callback):
+        """
+        :return: The timer ItemSchema.extract takes , None when the field groups are not timed
+        """
+        if not self.field_groups:
+            return None
+        return lambda group, secs: self.observe('field_group', (callback, group), secs)
+
+    def toStats(self, stats):
+        # timing/<metric>/<label values>/count , mean_ms , p50_ms , p99_ms and the bucket counts
+        for (metric, labels), histogram in sorted(self.histograms.items()):
+            prefix = 'timing/{}/{}'.format(metric, '/'.join(labels))
+            stats.set_value(prefix + '/count', histogram.count)
+            stats.set_value(prefix + '/mean_ms', round(1000.0 * histogram.total / histogram.count, 3))
+            for name, q in (('p50_ms', 0.5), ('p99_ms', 0.99)):
+                bound = histogram.quantile(q)
+                stats.set_value('{}/{}'.format(prefix, name), None if bound is None else 1000.0 * bound)
+            stats.set_value(prefix + '/buckets', {formatBound(bound): count for bound, count
+                                                  in zip(self.buckets + (float('inf'),), histogram.counts)})
+
+    def prometheusText(self):
+        """
+        :return: The histograms in the Prometheus text exposition format
+        """
+        lines = []
+        for metric, (help_text, label_names) in sorted(METRICS.items()):
+            name = 'itunesbot_{}_seconds'.format(metric)
+            lines.append('# HELP {} {}'.format(name, help_text))
+            lines.append('# TYPE {} histogram'.format(name))
+            for (key, labels), histogram in sorted(self.histograms.items()):
+                if key != metric:
+                    continue
+                label_text = ','.join('{}="{}"'.format(label, value) for label, value in zip(label_names, labels))
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float('inf'),), histogram.counts):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else formatBound(bound)
+                    lines.append('{}_bucket{{{},le="{}"}} {}'.format(name, label_text, le, cumulative))
+                lines.append('{}_sum{{{}}} {!r}'.format(name, label_text, histogram.total))
+                lines.append('{}_count{{{}}} {}'.format(name, label_text, histogram.count))
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsResource(Resource):
+    # /metrics of the Prometheus endpoint
+    isLeaf = True
+
+    def __init__(self, timings):
+        Resource.__init__(self)
+        self.timings = timings
+
+    def render_GET(self, request):
+        request.setHeader(b'Content-Type', b'text/plain; version=0.0.4; charset=utf-8')
+        return self.timings.prometheusText().encode('utf-8')
+
+
+def timed(callback):
+    """
+    Records the time spent in a spider callback when the spider has timings.
+    Generator callbacks are timed over the steps of the generator only , not
+    over what the engine does with the requests and items in between
+
+    :param callback: Spider method taking the response
+    :return: Wrapped method
+    """
+    name = callback.__name__
+
+    if inspect.isgeneratorfunction(callback):
+        @functools.wraps(callback)
+        def wrapper(self, response, *args, **kwargs):
+            results = callback(self, response, *args, **kwargs)
+            if self.timings is None:
+                yield from results
+                return
+            spent = 0.0
+            while True:
+                started = perf_counter()
+                try:
+                    result = next(results)
+                except StopIteration:
+                    break
+                finally:
+                    spent += perf_counter() - started
+                yield result
+            self.timings.observe('callback', (name,), spent)
+        return wrapper
+
+    @functools.wraps(callback)
+    def wrapper(self, response, *args, **kwargs):
+        if self.timings is None:
+            return callback(self, response, *args, **kwargs)
+        started = perf_counter()
+        try:
+            return callback(self, response, *args, **kwargs)
+        finally:
+            self.timings.observe('callback', (name,), perf_counter() - started)
+    return wrapper